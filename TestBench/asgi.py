@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'TestBench.settings')
+# ASGI 部署使用 testplatform.async_views；设置 TESTBENCH_ASYNC_VIEWS= （空）可退回同步视图
+os.environ.setdefault('TESTBENCH_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 
 import os
 import logging
+import tempfile
 from pathlib import Path
 from datetime import datetime
 from utils.custom_log_handler import CustomRotatingFileHandler
@@ -47,7 +48,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 放在最前面：统计其余中间件与视图的总耗时（testplatform.metrics）
+    'testplatform.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'testplatform.db_router.ReadYourWritesMiddleware',
+    'testplatform.sharding.ShardContextMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',
@@ -75,6 +80,18 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'TestBench.wsgi.application'
+ASGI_APPLICATION = 'TestBench.asgi.application'
+
+# testcase / keyword / project 接口使用 testplatform.async_views（异步 ORM）；TestBench/asgi.py 默认打开，WSGI 部署保持同步视图
+TESTBENCH_ASYNC_VIEWS = bool(os.environ.get('TESTBENCH_ASYNC_VIEWS'))
+# 异步视图里交给同步实现的操作（写操作、generate、mode=thread 的 run、结果入库）的线程数，每个 worker 进程一个线程池
+TESTBENCH_ASGI_SYNC_THREADS = int(os.environ.get('TESTBENCH_ASGI_SYNC_THREADS', 32))
+
+# 请求指标（testplatform.metrics）：是否返回 Server-Timing 响应头；同一 SQL 指纹在一个请求里重复多少次算 N+1；
+# 多进程部署时各进程指标快照的存放目录（manage.py serve 未设置时自动使用临时目录）
+TESTBENCH_SERVER_TIMING = bool(os.environ.get('TESTBENCH_SERVER_TIMING'))
+TESTBENCH_METRICS_N_PLUS_ONE_THRESHOLD = int(os.environ.get('TESTBENCH_METRICS_N_PLUS_ONE_THRESHOLD', 5))
+TESTBENCH_METRICS_DIR = os.environ.get('TESTBENCH_METRICS_DIR')
 
 
 # Database
@@ -91,6 +108,61 @@ DATABASES = {
     }
 }
 
+# 本地调试 / 基准测试（manage.py benchmark）：TESTBENCH_DB_SQLITE=1 时 default 使用 SQLite 文件，不需要 MySQL
+# IMMEDIATE 事务：并发写（e2e_tests/load_harness.py）时先排队拿写锁，而不是读后升级写锁直接报 database is locked
+# 测试库用文件而不是内存库：testplatform/tests.py 里的多进程测试需要子进程连上同一个测试库
+if os.environ.get('TESTBENCH_DB_SQLITE'):
+    DATABASES['default'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db.sqlite3',
+                            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+                            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'}}
+
+# 读写分离（testplatform.db_router）：default 为写库，TESTBENCH_DB_REPLICAS_HOSTS 为逗号分隔的只读副本 host:port，
+# 如 mysql_ha 的 "127.0.0.1:33062,127.0.0.1:33063"；账号和库名与 default 相同，账号需要 REPLICATION CLIENT 权限以查询复制延迟
+_replica_hosts = [h.strip() for h in os.environ.get('TESTBENCH_DB_REPLICAS_HOSTS', '').split(',') if h.strip()]
+for _i, _host in enumerate(_replica_hosts, 1):
+    _name, _, _port = _host.partition(':')
+    DATABASES[f'replica{_i}'] = {
+        **DATABASES['default'],
+        'HOST': _name,
+        'PORT': int(_port or 3306),
+        'TEST': {'MIRROR': 'default'},
+    }
+# 本地调试读写分离：TESTBENCH_DB_SQLITE_SPLIT=1 时用两个 SQLite 文件分别充当写库和读库（两边都要 migrate，数据不会自动同步）
+if os.environ.get('TESTBENCH_DB_SQLITE_SPLIT'):
+    DATABASES = {
+        'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db.sqlite3'},
+        'replica1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db_replica.sqlite3', 'TEST': {'MIRROR': 'default'}},
+    }
+# 按项目分片（testplatform.sharding）：TESTBENCH_DB_SHARDS_HOSTS 为逗号分隔的 别名=host:port/库名，
+# 如 "shard1=10.0.0.5:3306/testbench_s1"，账号与 default 相同；default 本身也是一个分片
+for _item in [h.strip() for h in os.environ.get('TESTBENCH_DB_SHARDS_HOSTS', '').split(',') if h.strip()]:
+    _alias, _, _address = _item.partition('=')
+    _hostport, _, _db_name = _address.partition('/')
+    _name, _, _port = _hostport.partition(':')
+    DATABASES[_alias] = {
+        **DATABASES['default'],
+        'HOST': _name,
+        'PORT': int(_port or 3306),
+        'NAME': _db_name or DATABASES['default']['NAME'],
+    }
+# 本地调试分片：TESTBENCH_DB_SQLITE_SHARDS=2 时 default 与 shard1、shard2 各用一个 SQLite 文件（每个库都要 migrate）
+_sqlite_shards = int(os.environ.get('TESTBENCH_DB_SQLITE_SHARDS') or 0)
+if _sqlite_shards:
+    if DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+        DATABASES['default'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db.sqlite3',
+                                'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'}}
+    for _i in range(1, _sqlite_shards + 1):
+        DATABASES[f'shard{_i}'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / f'db_shard{_i}.sqlite3',
+                                   'TEST': {'NAME': BASE_DIR / f'test_db_shard{_i}.sqlite3'}}
+TESTBENCH_DB_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')]
+TESTBENCH_DB_SHARDS = [alias for alias in DATABASES if alias.startswith('shard')]
+# 新建项目所在的分片
+TESTBENCH_NEW_PROJECT_SHARD = os.environ.get('TESTBENCH_NEW_PROJECT_SHARD', 'default')
+DATABASE_ROUTERS = ['testplatform.sharding.ShardRouter', 'testplatform.db_router.ReadWriteRouter']
+# 会话写入后多少秒内的读仍走写库（读己之写）；副本延迟超过多少秒时不再从该副本读
+TESTBENCH_DB_STICKY_SECONDS = 5
+TESTBENCH_DB_MAX_REPLICA_LAG = 3
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -133,10 +205,46 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 请求体上限：批量导入（testcase / keyword 的 import）整批放在一个 JSON 请求体里，几千条记录就会超过 Django 默认的 2.5MB；
+# 超过上限返回 413，更大的文件用 manage.py import_records 导入
+TESTBENCH_MAX_REQUEST_BYTES = int(os.environ.get('TESTBENCH_MAX_REQUEST_BYTES', 64 * 1024 * 1024))
+DATA_UPLOAD_MAX_MEMORY_SIZE = TESTBENCH_MAX_REQUEST_BYTES
+
+TEST_RUNNER = 'TestBench.test_runner.TestRunner'
+
+# 缓存：testplatform.cache 的版本号需要所有进程（serve 的各 worker、run_workers）可见
+# 设置 TESTBENCH_REDIS_URL 时使用 Redis（多台机器部署时必须）；未设置时使用本机文件缓存 TESTBENCH_CACHE_DIR，同一台机器上的进程共享
+# 文件缓存默认放在系统临时目录，不写进源码目录
+# 不要改成 LocMemCache：各进程的版本号互不可见，serve 多 worker / run_workers 会拒绝启动
+TESTBENCH_REDIS_URL = os.environ.get('TESTBENCH_REDIS_URL')
+if TESTBENCH_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': TESTBENCH_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('TESTBENCH_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'testbench_cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+# 进程内 LRU 缓存的条目上限（项目、关键字目录、用例详情）
+TESTBENCH_LOCAL_CACHE_SIZE = 1024
+# 每个进程最多保留的搜索 trigram 索引数（项目 × 用例 / 关键字），按 LRU 淘汰
+TESTBENCH_SEARCH_INDEX_CACHE_SIZE = int(os.environ.get('TESTBENCH_SEARCH_INDEX_CACHE_SIZE', 64))
+
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
+# 请求体 / parameters 日志：采样率（0~1，1 为全部记录）与单条最大长度（超出截断，0 不截断）
+TESTBENCH_LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('TESTBENCH_LOG_PAYLOAD_SAMPLE_RATE', 1.0))
+TESTBENCH_LOG_PAYLOAD_MAX_BYTES = int(os.environ.get('TESTBENCH_LOG_PAYLOAD_MAX_BYTES', 4096))
+
 def exclude_errors_callback(record):
     return record.levelno < logging.ERROR
 
@@ -157,21 +265,21 @@ LOGGING = {
     'handlers': {
         'file': {
             'level': 'INFO',
-            'class': 'utils.custom_log_handler.CustomRotatingFileHandler',
+            'class': 'utils.custom_log_handler.QueuedRotatingFileHandler',  # 请求线程只入队，后台线程写入
             'base_name': 'project',  # 基础日志文件名
             'log_dir': LOG_DIR,  # 日志目录
             'maxBytes': 300 * 1024 * 1024,  # 最大 300MB
-            'backupCount': 30,  # 保留最近 30 天的日志
+            'retention_days': 30,  # 保留最近 30 天的日志（按文件名里的时间戳删除更早的文件）
             'formatter': 'verbose',
             'encoding': 'utf-8',
         },
         'error_file': {
             'level': 'ERROR',
-            'class': 'utils.custom_log_handler.CustomRotatingFileHandler',
+            'class': 'utils.custom_log_handler.QueuedRotatingFileHandler',  # 请求线程只入队，后台线程写入
             'base_name': 'error',  # 基础日志文件名
             'log_dir': LOG_DIR,  # 日志目录
             'maxBytes': 300 * 1024 * 1024,  # 最大 300MB
-            'backupCount': 30,
+            'retention_days': 30,
             'formatter': 'verbose',
             'encoding': 'utf-8',
         },
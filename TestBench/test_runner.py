@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    manage.py test：仓库不带迁移文件（各环境本地 makemigrations），testplatform 的表直接按当前模型创建，与 manage.py benchmark 相同；
+    缓存换成临时目录下的文件缓存，不读写运行中服务的缓存，测试启动的子进程通过 TESTBENCH_CACHE_DIR 共用同一个目录
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.mkdtemp(prefix="testbench_test_cache_")
+        # 子进程重新加载 settings：去掉 TESTBENCH_REDIS_URL，指向同一个临时目录
+        self._cache_env = {name: os.environ.pop(name, None) for name in ("TESTBENCH_REDIS_URL", "TESTBENCH_CACHE_DIR")}
+        os.environ["TESTBENCH_CACHE_DIR"] = self._cache_dir
+        self._cache_settings = override_settings(CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": self._cache_dir,
+                "OPTIONS": {"MAX_ENTRIES": 10000},
+            }
+        })
+        self._cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_settings.disable()
+        for name, value in self._cache_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
+
+    def setup_databases(self, **kwargs):
+        with override_settings(MIGRATION_MODULES={"testplatform": None}):
+            return super().setup_databases(**kwargs)
@@ -0,0 +1,27 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# 不依赖运行中的服务：直接加载 Django，默认用 SQLite（TESTBENCH_DB_SQLITE），每次基准都在临时测试库里进行
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "TestBench.settings")
+os.environ.setdefault("TESTBENCH_DB_SQLITE", "1")
+
+import django  # noqa: E402
+
+django.setup()
+
+SMALL_VOLUMES = {"projects": 2, "testcases": 4, "steps": 3, "assertions": 2, "keywords": 3}
+
+
+@pytest.fixture(scope="session")
+def small_volumes():
+    return dict(SMALL_VOLUMES)
+
+
+@pytest.fixture(scope="session")
+def small_report(small_volumes):
+    from testplatform import benchmark
+    return benchmark.run(small_volumes, iterations=3, warmup=1)
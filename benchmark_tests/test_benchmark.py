@@ -0,0 +1,102 @@
+import json
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+
+from testplatform import benchmark, models
+
+
+def test_seed_volumes(small_volumes):
+    with benchmark.isolated_databases(), benchmark.target_server() as target_url:
+        names = benchmark.seed(small_volumes, target_url)
+        v = small_volumes
+        assert names == [f"{benchmark.PROJECT_PREFIX}{p}" for p in range(v["projects"])]
+        assert models.Project.objects.count() == v["projects"]
+        assert models.Testcase.objects.count() == v["projects"] * v["testcases"]
+        assert models.TestCaseKeyword.objects.count() == v["projects"] * v["testcases"] * v["steps"]
+        assert models.Assertion.objects.filter(testcase_keyword__isnull=False).count() == \
+            v["projects"] * v["testcases"] * v["steps"] * v["assertions"]
+
+
+def test_configured_cache_is_left_alone():
+    # 基准在临时缓存里进行：部署的 Redis / 运行中服务的缓存目录不被清空
+    cache.set("tb-bench-sentinel", 1)
+    try:
+        with benchmark.isolated_databases():
+            assert cache.get("tb-bench-sentinel") is None
+            cache.set("tb-bench-inside", 1)
+        assert cache.get("tb-bench-sentinel") == 1
+        assert cache.get("tb-bench-inside") is None
+    finally:
+        cache.delete("tb-bench-sentinel")
+
+
+def test_every_operation_is_measured(small_report):
+    expected = {name for name, _ in benchmark.Suite(["p"], {}, "http://127.0.0.1").cases()}
+    assert set(small_report["results"]) == expected
+    for name, result in small_report["results"].items():
+        assert result["errors"] == 0, f"{name}: {result.get('error')}"
+        assert result["iterations"] == 3
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"] <= result["max_ms"]
+        assert result["peak_memory_kb"] > 0
+    for name in ("testcase.show_testcase", "testcase.create", "project.show_all"):
+        assert small_report["results"][name]["queries"] > 0
+    assert small_report["meta"]["volumes"]["steps"] == 3
+
+
+def test_read_queries_do_not_grow_with_steps(small_volumes):
+    # 详情 / 列表 / 脚本生成的查询条数与步骤数、断言数无关（N+1 回归保护）
+    only = ["testcase.show_all", "testcase.show_testcase", "testcase.testcase_detail", "script_generator"]
+    few = benchmark.run({**small_volumes, "steps": 1, "assertions": 1}, iterations=2, warmup=1, only=only)
+    many = benchmark.run({**small_volumes, "steps": 6, "assertions": 3}, iterations=2, warmup=1, only=only)
+    for name in few["results"]:
+        assert few["results"][name]["queries"] == many["results"][name]["queries"], name
+
+
+def test_percentile():
+    samples = list(range(1, 101))
+    assert benchmark.percentile(samples, 50) == 50
+    assert benchmark.percentile(samples, 95) == 95
+    assert benchmark.percentile(samples, 99) == 99
+    assert benchmark.percentile([7], 99) == 7
+    assert benchmark.percentile([], 50) == 0.0
+
+
+def test_report_roundtrip_and_compare(small_report, tmp_path):
+    path = tmp_path / "report.json"
+    benchmark.save(small_report, path)
+    loaded = benchmark.load(path)
+    assert loaded == json.loads(json.dumps(small_report))
+    assert not any(row["regression"] for row in benchmark.compare(loaded, small_report))
+
+    slower = json.loads(json.dumps(small_report))
+    slower["results"]["testcase.show_testcase"]["p95_ms"] += 1000
+    slower["results"]["project.show_all"]["queries"] += 1
+    rows = {row["name"]: row for row in benchmark.compare(small_report, slower)}
+    assert rows["testcase.show_testcase"]["regression"]
+    assert rows["project.show_all"]["regression"]
+    assert not rows["keyword.show_all"]["regression"]
+    assert "REGRESSION" in benchmark.format_comparison(rows.values())
+
+
+def test_command_writes_json(tmp_path):
+    output = tmp_path / "bench.json"
+    call_command("benchmark", "--projects", "1", "--testcases", "2", "--steps", "1", "--assertions", "1",
+                 "--keywords", "1", "--iterations", "1", "--warmup", "0", "--only", "project.show_all",
+                 "--output", str(output))
+    report = json.loads(output.read_text(encoding="utf-8"))
+    assert list(report["results"]) == ["project.show_all"]
+    assert report["meta"]["database"] == "sqlite"
+
+
+def test_command_fails_on_regression(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    args = ["--projects", "1", "--testcases", "2", "--steps", "1", "--assertions", "1", "--keywords", "1",
+            "--iterations", "1", "--warmup", "0", "--only", "project.show_all"]
+    call_command("benchmark", *args, "--output", str(baseline))
+    report = json.loads(baseline.read_text(encoding="utf-8"))
+    report["results"]["project.show_all"]["queries"] = 0
+    baseline.write_text(json.dumps(report), encoding="utf-8")
+    with pytest.raises(Exception, match="regressions"):
+        call_command("benchmark", *args, "--compare", str(baseline), "--fail-on-regression")
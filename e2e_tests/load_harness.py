@@ -0,0 +1,406 @@
+"""
+HTTP API 压测：多个并发客户端按权重混合回放 create / update / show_all / search / show_testcase / delete，
+输出吞吐、各操作延迟分位数与错误率。需要先启动服务（./start.sh 或 python manage.py serve）。
+
+  python e2e_tests/load_harness.py --base-url http://localhost:8000 --mode open --rate 200 --duration 60 --clients 50
+  python e2e_tests/load_harness.py --mode closed --clients 20 --duration 30 --mix show_all=5,show_testcase=5,create=1
+
+两种模式：
+  - open（开环，默认）：按固定到达率发请求，不等上一个请求返回；延迟从"计划发送时间"算起，
+    服务变慢时排队时间会计入延迟（避免 coordinated omission），在途请求超过 --max-inflight 时记为 dropped
+  - closed（闭环）：--clients 个客户端各自循环"发请求 → 等响应 → 思考 --think-time 秒"
+每个客户端有独立的 cookie（tb_last_write），写后读的粘滞行为与真实客户端一致，可用于验证 ProxySQL / 读写分离。
+压测前在独立项目里造 --seed-testcases 条用例供读操作使用，结束后删除。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import sys
+import time
+import uuid
+from collections import Counter, deque
+
+import aiohttp
+import requests
+
+from test_project import create_project, delete_project
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIX = {"show_all": 30, "search": 15, "show_testcase": 30, "create": 10, "update": 10, "delete": 5}
+OPERATIONS = tuple(DEFAULT_MIX)
+DEFAULT_SEED_TESTCASES = 50
+DEFAULT_PAGE_SIZE = 20
+STEPS_PER_TESTCASE = 3
+PERCENTILES = (50, 90, 95, 99)
+
+
+# ===================== 请求体 =====================
+def keyword_payload(name) -> dict:
+    return {
+        "name": name,
+        "url": "http://127.0.0.1:9/load",
+        "method": "POST",
+        "params": {},
+        "headers": {"Content-Type": "application/json"},
+        "body_type": "raw",
+        "body": "{}",
+        "assertions": [],
+    }
+
+
+def testcase_payload(title, keyword_name, revision=0) -> dict:
+    return {
+        "title": title,
+        "name": f"{title}_name",
+        "level": 1,
+        "precondition": "",
+        "test_precondition": "",
+        "expected_result": "ok",
+        "type": "function_case",
+        "auto_flag": True,
+        "description": f"load test revision {revision}",
+        "keywords": [
+            {
+                "name": keyword_name,
+                "order": order,
+                "url": f"http://127.0.0.1:9/step/{order}",
+                "method": "POST",
+                "params": {},
+                "headers": {"Content-Type": "application/json"},
+                "body_type": "raw",
+                "body": json.dumps({"order": order, "revision": revision}),
+                "assertions": [{"target_value": "${response}.code", "operator": "equal", "compared_value": "200"}],
+            }
+            for order in range(1, STEPS_PER_TESTCASE + 1)
+        ],
+    }
+
+
+def _post(base_url, path, payload) -> dict:
+    resp = requests.post(f"{base_url}/testplatform/{path}/", json=payload, timeout=60)
+    data = resp.json()
+    if resp.status_code != 200 or "error" in data:
+        raise RuntimeError(f"{path} {payload['operate']} failed: {resp.status_code} {resp.text[:300]}")
+    return data
+
+
+# ===================== 压测状态 =====================
+class LoadState:
+    """压测用的项目、关键字与用例池：seeded 只读不删；created 为压测中新建的用例，update / delete 从这里取"""
+
+    def __init__(self, base_url, seed_testcases=DEFAULT_SEED_TESTCASES):
+        self.base_url = base_url
+        self.run_id = uuid.uuid4().hex[:8]
+        self.project = f"load_{self.run_id}"
+        self.keyword = f"load_kw_{self.run_id}"
+        self.seeded = [f"load_{self.run_id}_seed_{i:05d}" for i in range(seed_testcases)]
+        self.created = deque()
+        self.counter = itertools.count()
+
+    def setup(self):
+        create_project(self.base_url, self.project, "load test project")
+        _post(self.base_url, "keyword", {"operate": "create", "project_name": self.project,
+                                         "parameters": keyword_payload(self.keyword)})
+        records = [testcase_payload(title, self.keyword) for title in self.seeded]
+        for i in range(0, len(records), 500):
+            _post(self.base_url, "testcase", {"operate": "import", "project_name": self.project,
+                                              "parameters": {"records": records[i:i + 500], "strict": True}})
+
+    def teardown(self):
+        titles = self.seeded + list(self.created)
+        for i in range(0, len(titles), 500):
+            try:
+                _post(self.base_url, "testcase", {"operate": "delete", "project_name": self.project,
+                                                  "parameters": {"delete_title_list": titles[i:i + 500]}})
+            except RuntimeError as e:
+                logger.warning("teardown: %s", e)
+        delete_project(self.base_url, [self.project])
+
+    def next_title(self) -> str:
+        return f"load_{self.run_id}_new_{next(self.counter):07d}"
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {op: [] for op in OPERATIONS}
+        self.errors = Counter()
+        self.skipped = Counter()
+        self.error_samples = {}
+        self.dropped = 0
+
+    def record(self, op, latency_ms, error=None):
+        self.latencies[op].append(latency_ms)
+        if error:
+            self.errors[op] += 1
+            self.error_samples.setdefault(op, error[:300])
+
+
+def percentile(samples, pct) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(1, math.ceil(pct / 100 * len(ordered))) - 1]
+
+
+# ===================== 单个操作 =====================
+async def _call(session, base_url, path, operate, project, parameters):
+    """返回 (响应 JSON, 错误信息)；HTTP 非 200、返回 error 字段或 code 非 200 都算错误"""
+    payload = {"operate": operate, "project_name": project, "parameters": parameters}
+    try:
+        async with session.post(f"{base_url}/testplatform/{path}/", json=payload) as resp:
+            body = await resp.read()
+            if resp.status != 200:
+                return None, f"HTTP {resp.status}: {body[:200]!r}"
+            data = json.loads(body)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        return None, f"{type(e).__name__}: {e}"
+    if "error" in data or data.get("code", 200) != 200:
+        return data, f"code {data.get('code')}: {str(data.get('error') or data.get('message'))[:200]}"
+    return data, None
+
+
+async def run_operation(op, session, state, page_size):
+    """执行一个操作；返回错误信息（None 为成功），没有可用用例（如 delete 时池子为空）返回 "skip" """
+    base_url, project = state.base_url, state.project
+    if op == "show_all":
+        parameters = {"page_size": page_size} if page_size else {}
+        return (await _call(session, base_url, "testcase", "show_all", project, parameters))[1]
+    if op == "search":
+        title = random.choice(state.seeded)
+        # 按 "seed_00012" 这样的片段搜索
+        return (await _call(session, base_url, "testcase", "search", project, {"title": title[-10:]}))[1]
+    if op == "show_testcase":
+        title = random.choice(state.seeded)
+        return (await _call(session, base_url, "testcase", "show_testcase", project, {"title": title}))[1]
+    if op == "create":
+        title = state.next_title()
+        _, error = await _call(session, base_url, "testcase", "create", project, testcase_payload(title, state.keyword))
+        if error is None:
+            state.created.append(title)
+        return error
+    if op == "update":
+        if not state.created:
+            return "skip"
+        # 取出后再放回，避免同一条用例被并发的 delete 删掉
+        title = state.created.popleft()
+        try:
+            parameters = {**testcase_payload(title, state.keyword, revision=next(state.counter)),
+                          "update_source_title": title}
+            return (await _call(session, base_url, "testcase", "update", project, parameters))[1]
+        finally:
+            state.created.append(title)
+    if op == "delete":
+        if not state.created:
+            return "skip"
+        title = state.created.popleft()
+        return (await _call(session, base_url, "testcase", "delete", project, {"delete_title_list": [title]}))[1]
+    raise ValueError(f"unknown operation: {op}")
+
+
+async def _timed(op, session, state, stats, page_size, scheduled):
+    error = await run_operation(op, session, state, page_size)
+    if error == "skip":
+        stats.skipped[op] += 1
+        return
+    stats.record(op, (time.perf_counter() - scheduled) * 1000, error)
+
+
+# ===================== 开环 / 闭环 =====================
+def _chooser(mix):
+    ops = [op for op, weight in mix.items() if weight > 0]
+    weights = [mix[op] for op in ops]
+    return lambda: random.choices(ops, weights)[0]
+
+
+async def _open_loop(sessions, state, stats, choose, rate, duration, max_inflight, page_size):
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    tasks = set()
+    for i in itertools.count():
+        scheduled = start + i * interval
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_inflight:
+            stats.dropped += 1
+            continue
+        task = asyncio.create_task(_timed(choose(), sessions[i % len(sessions)], state, stats, page_size, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def _closed_loop(sessions, state, stats, choose, duration, think_time, page_size):
+    deadline = time.perf_counter() + duration
+
+    async def client(session):
+        while time.perf_counter() < deadline:
+            await _timed(choose(), session, state, stats, page_size, time.perf_counter())
+            if think_time:
+                await asyncio.sleep(think_time)
+
+    await asyncio.gather(*(client(session) for session in sessions))
+
+
+async def _run(state, mix, mode, rate, duration, clients, max_inflight, think_time, timeout, page_size):
+    stats = Stats()
+    choose = _chooser(mix)
+    connector = aiohttp.TCPConnector(limit=max_inflight, limit_per_host=max_inflight)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    # 每个客户端独立 cookie jar（读己之写粘滞按客户端生效），共用一个连接池
+    sessions = [
+        aiohttp.ClientSession(connector=connector, connector_owner=False, timeout=client_timeout,
+                              cookie_jar=aiohttp.CookieJar(unsafe=True))
+        for _ in range(clients)
+    ]
+    started = time.perf_counter()
+    try:
+        if mode == "open":
+            await _open_loop(sessions, state, stats, choose, rate, duration, max_inflight, page_size)
+        else:
+            await _closed_loop(sessions, state, stats, choose, duration, think_time, page_size)
+    finally:
+        elapsed = time.perf_counter() - started
+        for session in sessions:
+            await session.close()
+        await connector.close()
+    return stats, elapsed
+
+
+def run(base_url, mix=None, mode="open", rate=50.0, duration=30.0, clients=20, max_inflight=1000,
+        think_time=0.0, timeout=30.0, page_size=DEFAULT_PAGE_SIZE, seed_testcases=DEFAULT_SEED_TESTCASES) -> dict:
+    """造数 → 压测 → 清理，返回报告 dict（见 report()）"""
+    mix = mix or DEFAULT_MIX
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"unknown operations in mix: {sorted(unknown)}")
+    if mode not in ("open", "closed"):
+        raise ValueError("mode must be open or closed")
+    if mode == "open" and rate <= 0:
+        raise ValueError("rate must be positive in open mode")
+
+    state = LoadState(base_url, seed_testcases=max(1, seed_testcases))
+    state.setup()
+    try:
+        stats, elapsed = asyncio.run(
+            _run(state, mix, mode, rate, duration, clients, max_inflight, think_time, timeout, page_size))
+    finally:
+        state.teardown()
+    return report(stats, elapsed, mode=mode, rate=rate if mode == "open" else None, duration=duration,
+                  clients=clients, mix=mix)
+
+
+def report(stats, elapsed, **config) -> dict:
+    operations = {}
+    for op, samples in stats.latencies.items():
+        if not samples and not stats.skipped[op]:
+            continue
+        operations[op] = {
+            "count": len(samples),
+            "errors": stats.errors[op],
+            "error_rate": round(stats.errors[op] / len(samples), 4) if samples else 0.0,
+            "skipped": stats.skipped[op],
+            **{f"p{p}_ms": round(percentile(samples, p), 2) for p in PERCENTILES},
+            "max_ms": round(max(samples), 2) if samples else 0.0,
+        }
+        if op in stats.error_samples:
+            operations[op]["error_sample"] = stats.error_samples[op]
+    all_samples = [latency for samples in stats.latencies.values() for latency in samples]
+    completed = len(all_samples)
+    errors = sum(stats.errors.values())
+    return {
+        "config": config,
+        "total": {
+            "elapsed_s": round(elapsed, 2),
+            "completed": completed,
+            "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+            "errors": errors,
+            "error_rate": round(errors / completed, 4) if completed else 0.0,
+            "dropped": stats.dropped,
+            **{f"p{p}_ms": round(percentile(all_samples, p), 2) for p in PERCENTILES},
+        },
+        "operations": operations,
+    }
+
+
+def format_report(data) -> str:
+    config, total = data["config"], data["total"]
+    target = f", target {config['rate']} req/s" if config.get("rate") else ""
+    lines = [
+        f"mode {config['mode']}{target}, {config['clients']} clients, {total['elapsed_s']}s",
+        f"completed {total['completed']} ({total['throughput_rps']} req/s), errors {total['errors']} "
+        f"({total['error_rate']:.2%}), dropped {total['dropped']}",
+        f"{'operation':<16}{'count':>8}{'err%':>8}{'skip':>6}" + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES)
+        + f"{'max ms':>10}",
+    ]
+    for op, r in data["operations"].items():
+        lines.append(f"{op:<16}{r['count']:>8}{r['error_rate']:>8.2%}{r['skipped']:>6}"
+                     + "".join(f"{r[f'p{p}_ms']:>10.1f}" for p in PERCENTILES) + f"{r['max_ms']:>10.1f}")
+    lines.append(f"{'total':<16}{total['completed']:>8}{total['error_rate']:>8.2%}{'':>6}"
+                 + "".join(f"{total[f'p{p}_ms']:>10.1f}" for p in PERCENTILES))
+    for op, r in data["operations"].items():
+        if "error_sample" in r:
+            lines.append(f"  {op} error: {r['error_sample']}")
+    return "\n".join(lines)
+
+
+# ===================== 命令行 =====================
+def parse_mix(text) -> dict:
+    """"show_all=30,create=5" → {"show_all": 30, "create": 5}"""
+    mix = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        op, _, weight = item.partition("=")
+        mix[op.strip()] = float(weight or 1)
+    return mix
+
+
+def wait_for_server(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/testplatform/healthz/", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise SystemExit(f"server {base_url} did not become ready within {timeout}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TestBench HTTP API load test")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--mode", choices=["open", "closed"], default="open")
+    parser.add_argument("--rate", type=float, default=50.0, help="open 模式的到达率（请求/秒）")
+    parser.add_argument("--duration", type=float, default=30.0, help="压测时长（秒）")
+    parser.add_argument("--clients", type=int, default=20, help="客户端数（各自独立 cookie；closed 模式即并发数）")
+    parser.add_argument("--max-inflight", type=int, default=1000, help="open 模式在途请求上限，超出记为 dropped")
+    parser.add_argument("--think-time", type=float, default=0.0, help="closed 模式每个请求后的等待秒数")
+    parser.add_argument("--timeout", type=float, default=30.0, help="单个请求超时（秒）")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="show_all 的 page_size，0 为全量")
+    parser.add_argument("--seed-testcases", type=int, default=DEFAULT_SEED_TESTCASES, help="压测前造的用例数")
+    parser.add_argument("--mix", default=",".join(f"{op}={w}" for op, w in DEFAULT_MIX.items()),
+                        help="操作权重，如 show_all=30,search=15,show_testcase=30,create=10,update=10,delete=5")
+    parser.add_argument("--output", help="报告 JSON 保存路径")
+    args = parser.parse_args(argv)
+
+    wait_for_server(args.base_url)
+    data = run(args.base_url, mix=parse_mix(args.mix), mode=args.mode, rate=args.rate, duration=args.duration,
+               clients=args.clients, max_inflight=args.max_inflight, think_time=args.think_time,
+               timeout=args.timeout, page_size=args.page_size, seed_testcases=args.seed_testcases)
+    print(format_report(data))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    return 1 if data["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
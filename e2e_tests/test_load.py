@@ -0,0 +1,28 @@
+import logging
+
+import pytest
+
+import load_harness
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.usefixtures("wait_for_server")
+def test_load_open_loop(base_url):
+    # 低到达率的短时开环压测：验证压测脚本本身与混合读写在并发下没有错误
+    data = load_harness.run(base_url, mode="open", rate=20, duration=5, clients=5, seed_testcases=10)
+    logger.info("\n%s", load_harness.format_report(data))
+    total = data["total"]
+    assert total["completed"] >= 80, f"完成请求数过少: {total}"
+    assert total["errors"] == 0, f"压测出现错误: {data['operations']}"
+    assert total["dropped"] == 0
+    assert {"show_all", "show_testcase"} <= set(data["operations"])
+
+
+@pytest.mark.usefixtures("wait_for_server")
+def test_load_closed_loop(base_url):
+    mix = {"show_all": 1, "show_testcase": 1, "create": 1, "update": 1, "delete": 1}
+    data = load_harness.run(base_url, mix=mix, mode="closed", duration=3, clients=4, seed_testcases=5)
+    logger.info("\n%s", load_harness.format_report(data))
+    assert data["total"]["completed"] > 0
+    assert data["total"]["errors"] == 0, f"压测出现错误: {data['operations']}"
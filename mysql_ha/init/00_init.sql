@@ -3,6 +3,9 @@ CREATE DATABASE IF NOT EXISTS appdb;
 
 CREATE USER IF NOT EXISTS 'appuser'@'%' IDENTIFIED WITH mysql_native_password BY 'app_pass';
 GRANT ALL PRIVILEGES ON appdb.* TO 'appuser'@'%';
+-- 读写分离（testplatform/db_router.py）用 SHOW REPLICA STATUS 读取副本延迟，需要 REPLICATION CLIENT；
+-- 已有集群不会重跑本脚本，需在 master 上手动执行这一句（会复制到副本）
+GRANT REPLICATION CLIENT ON *.* TO 'appuser'@'%';
 
 -- 复制账号（9.x 可用的新权限名 REPLICATION REPLICA；旧名 REPLICATION SLAVE 也兼容）
 CREATE USER IF NOT EXISTS 'repl'@'%' IDENTIFIED WITH mysql_native_password BY 'repl_pass';
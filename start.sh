@@ -6,7 +6,23 @@ IP_ADDRESS=$(hostname -I | awk '{print $1}')
 # 打印本机地址
 echo "Local server address: http://$IP_ADDRESS:8000/"
 
-# 查看是否有残留manage进程
+# 启动方式：
+#   MODE=asgi（默认）：manage.py serve --interface asgi，uvicorn worker + 异步视图
+#   MODE=wsgi：manage.py serve --interface wsgi，多线程 worker
+#   MODE=runserver：Django 开发服务器（单进程，仅调试用）
+# WORKERS 为 worker 进程数，默认 CPU 核数；worker 之间通过 TESTBENCH_REDIS_URL（未设置时为本机文件缓存 .cache/）共享缓存版本号
+MODE=${MODE:-asgi}
+WORKERS=${WORKERS:-$(nproc)}
+PID_FILE=${PID_FILE:-/tmp/testbench-serve.pid}
+
+# 已有 serve 主进程在运行：发 SIGUSR2 热升级，新主进程加载新代码、worker 就绪后旧进程处理完在途请求再退出，不丢请求
+if [ "$MODE" != "runserver" ] && [ -f "$PID_FILE" ] && kill -0 "$(cat "$PID_FILE")" 2>/dev/null; then
+    echo "检测到运行中的 TestBench 服务（pid $(cat "$PID_FILE")），执行热升级。"
+    kill -USR2 "$(cat "$PID_FILE")"
+    exit 0
+fi
+
+# 查看是否有残留的开发服务器进程
 EXISTING_PIDS=$(pgrep -f "manage\.py runserver")
 
 if [ -n "$EXISTING_PIDS" ]; then
@@ -16,5 +32,15 @@ else
     echo "未检测到已有 Django runserver 进程。"
 fi
 
-# 启动 Django 开发服务器，监听 0.0.0.0，允许外部访问
-nohup python3 manage.py runserver 0.0.0.0:8000 &>/dev/null &
\ No newline at end of file
+if [ "$MODE" = "asgi" ] && ! python3 -c "import uvicorn" 2>/dev/null; then
+    echo "未安装 uvicorn（pip install uvicorn），改用 wsgi 模式启动。"
+    MODE=wsgi
+fi
+
+if [ "$MODE" = "runserver" ]; then
+    # 启动 Django 开发服务器，监听 0.0.0.0，允许外部访问
+    nohup python3 manage.py runserver 0.0.0.0:8000 &>/dev/null &
+else
+    # 停止：kill -TERM $(cat $PID_FILE)（等在途请求结束）；滚动重启 worker：kill -HUP
+    nohup python3 manage.py serve --bind 0.0.0.0:8000 --interface "$MODE" --workers "$WORKERS" --pid "$PID_FILE" &>/dev/null &
+fi
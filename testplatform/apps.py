@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class TestplatformConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'testplatform'
+
+    def ready(self):
+        # 用例 / 关键字写入后让搜索索引失效；项目 / 用例 / 关键字写入后递增缓存版本号；数据库建连时挂上查询计时与读己之写的写入记录
+        from . import search, cache, metrics, db_router
+        search.connect_signals()
+        cache.connect_signals()
+        metrics.connect_signals()
+        db_router.connect_signals()
@@ -0,0 +1,299 @@
+import json
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+from django.http import JsonResponse
+
+from .models import Testcase, KeyWord, Project
+from .pagination import apaginate, get_fields
+from .responses import amodel_list_response, model_list_data
+from . import search, cache, db_router, sharding, views
+from utils import test_runner, async_runner, load_runner
+from utils.custom_log_handler import log_payload
+
+logger = logging.getLogger('django')
+
+"""
+testcase / keyword / project 三个接口的异步版本（ASGI 部署时使用，见 urls.py 与 TestBench/asgi.py），请求 / 响应格式与 views 完全一致。
+  - 读操作（show_all / search / show_testcase / testcase_detail / project show_all）走异步 ORM，
+    等待数据库期间不占线程，流式输出使用异步迭代器
+  - run 的 mode=async / mode=load 直接在当前事件循环上执行，不再为每个请求新建事件循环
+  - 写操作（create / update / delete / import）依赖 transaction.atomic()（只有同步实现），
+    generate 和 mode=thread 的 run 本身是线程池逻辑，这些操作整体交给 views 中的同步视图，在线程里执行。
+    这些同步调用用 _in_thread 放进独立的线程池（TESTBENCH_ASGI_SYNC_THREADS 个线程），而不是 sync_to_async 默认的
+    thread_sensitive 模式：后者在一个 worker 里只有一个共享线程，一个几分钟的 thread 模式 run 会让其他请求的写入全部排队
+"""
+
+TESTCASE_ASYNC_OPERATES = ("show_all", "search", "show_testcase", "testcase_detail", "run")
+KEYWORD_ASYNC_OPERATES = ("show_all", "search")
+PROJECT_ASYNC_OPERATES = ("show_all",)
+
+_sync_executor = ThreadPoolExecutor(max_workers=settings.TESTBENCH_ASGI_SYNC_THREADS, thread_name_prefix="tb-sync")
+
+
+def _in_thread(func):
+    """
+    在 _sync_executor 的线程里执行同步函数（各自的数据库连接，互不排队）。
+    线程池里的线程收不到请求开始 / 结束信号，前后各调用一次 close_old_connections，按 CONN_MAX_AGE 回收连接
+    """
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False, executor=_sync_executor)
+
+
+def _native(request, operates):
+    """请求能否在异步视图里直接处理；格式错误等情况交给同步视图，报错信息与同步视图一致"""
+    if request.method != 'POST':
+        return None
+    try:
+        source_data = json.loads(request.body)
+        operate = source_data["operate"]
+        parameters = source_data["parameters"]
+    except Exception:
+        return None
+    if operate not in operates:
+        return None
+    if operate == "run" and (parameters.get("mode", "thread") not in ("async", "load") or parameters.get("queue")):
+        # 排队执行（queue=true）只是写一行任务，交给同步视图
+        return None
+    return source_data
+
+
+# ===================== testcase =====================
+async def testcase(request):
+    source_data = _native(request, TESTCASE_ASYNC_OPERATES)
+    if source_data is None:
+        return await _in_thread(views.testcase)(request)
+
+    try:
+        logger.info(log_payload(request.body))
+        operate = source_data["operate"]
+        project_name = source_data.get("project_name")
+        parameters = source_data["parameters"]
+        await sharding.aactivate(project_name)
+        page = None
+        fields = None
+        if operate == "show_all":
+            async with db_router.areplica_reads():
+                project = await cache.aget_project(project_name)
+                testcases = await db_router.abind(Testcase.objects.filter(project=project))
+                testcases, page = await apaginate(testcases, parameters)
+            fields = get_fields(Testcase, parameters)
+            message = "search all testcases successfully"
+            logger.info(f"Showing all testcase for project '{project_name}' with parameters: {log_payload(parameters)}")
+        elif operate == "search":
+            async with db_router.areplica_reads():
+                testcases, page = await search_testcase(project_name, parameters)
+            if testcases is None:
+                message = "no testcases match"
+                testcases = []
+            else:
+                message = "search testcases successfully"
+                fields = get_fields(Testcase, parameters)
+            logger.info(f"Searching testcase for project '{project_name}' with parameters: {log_payload(parameters)}")
+        elif operate == "show_testcase":
+            async with db_router.areplica_reads():
+                testcase, testcase_keywords, keyword_assertions = await show_testcase(project_name, parameters)
+            logger.info(f"Showing testcase for project '{project_name}' with parameters: {log_payload(parameters)}")
+            return JsonResponse(
+                {
+                    "code": 200,
+                    "message": "show testcase successfully",
+                    "testcase": model_list_data([testcase])[0],
+                    "testcase_keywords": model_list_data(testcase_keywords),
+                    "keyword_assertions": keyword_assertions,
+                },
+                status=200
+            )
+        elif operate == "testcase_detail":
+            async with db_router.areplica_reads():
+                detail = await show_testcase_detail(project_name, parameters)
+            logger.info(f"Showing testcase detail for project '{project_name}' with parameters: {log_payload(parameters)}")
+            return JsonResponse({"code": 200, "message": "show testcase detail successfully", **detail}, status=200)
+        else:
+            results, summary = await run_testcase(project_name, parameters)
+            run = await _in_thread(views.save_run_results)(project_name, parameters, results, summary)
+            logger.info(f"Running testcase for project '{project_name}' with parameters: {log_payload(parameters)}, summary: {summary}")
+            return JsonResponse(
+                {
+                    "code": 200,
+                    "message": "run testcases finished",
+                    "run_id": run.id if run else None,
+                    "summary": summary,
+                    "results": results,
+                },
+                status=200
+            )
+    except Exception as e:
+        logger.error(f"except:{e}, type:{type(e)}")
+        logger.error(traceback.format_exc())
+        return JsonResponse({'error': f"Exception: {e}, Type: {type(e)}, Traceback: {traceback.format_exc()}"}, status=400)
+
+    logger.info(f"Operation '{operate}' completed successfully for project '{project_name}'")
+    return await amodel_list_response(
+        "testcases",
+        testcases,
+        code=200,
+        message=message,
+        fields=fields,
+        extra={"page": page} if page is not None else None,
+        stream=True,
+    )
+
+
+async def search_testcase(project_name, parameters):
+    title = parameters.get("title")
+    if not project_name:
+        raise ValidationError('Must provide project_name for searching')
+    if not title:
+        raise ValidationError('Must provide title for searching')
+
+    project = await cache.aget_project(project_name)
+    testcases, page = await search.asearch(Testcase, project, title, parameters)
+    if not testcases:
+        return None, None
+    return testcases, page
+
+
+async def show_testcase(project_name, parameters):
+    title = parameters.get("title")
+    if not title:
+        raise ValidationError("Title must be provided for show_case operation")
+
+    project = await cache.aget_project(project_name)
+    project_case = f"{project_name}_{title}"
+
+    result = await cache.atestcase_entry(project, "show_testcase", title, lambda: _load_testcase(project_case))
+    if result is None:
+        raise ValidationError(f"Testcase with project_case '{project_case}' not found")
+    return result
+
+
+async def _load_testcase(project_case):
+    testcase = await Testcase.objects.filter(project_case=project_case).afirst()
+    if testcase is None:
+        return None
+    # async for 在线程里一次取完结果（含 prefetch），断言不会逐步骤查询
+    testcase_keywords = [tk async for tk in views.testcase_keywords_queryset(testcase)]
+    return testcase, testcase_keywords, views.keyword_assertions(testcase_keywords)
+
+
+async def show_testcase_detail(project_name, parameters):
+    title = parameters.get("title")
+    if not title:
+        raise ValidationError("Title must be provided for testcase_detail operation")
+
+    project = await cache.aget_project(project_name)
+    project_case = f"{project_name}_{title}"
+
+    detail = await cache.atestcase_entry(project, "testcase_detail", title, lambda: _load_testcase_detail(project, project_case))
+    if detail is None:
+        raise ValidationError(f"Testcase with project_case '{project_case}' not found")
+    return detail
+
+
+async def _load_testcase_detail(project, project_case):
+    testcase = await views.testcase_detail_queryset(project, project_case).afirst()
+    if testcase is None:
+        return None
+    return views.testcase_detail_data(testcase)
+
+
+async def run_testcase(project_name, parameters):
+    # 只处理 mode=async / load：执行计划的加载是同步 ORM（prefetch 全部步骤），放到线程里；请求发送在当前事件循环上并发
+    if not project_name:
+        raise ValidationError('Must provide project_name for running')
+
+    if parameters.get("mode") == "load":
+        profile = load_runner.load_profile(parameters)
+        plans = await _in_thread(load_runner.performance_plans)(project_name, parameters.get("title_list", []))
+        return await load_runner.run_plans_async(plans, profile)
+
+    plans = await _in_thread(test_runner.load_plans)(project_name, parameters.get("title_list", []))
+    return await async_runner.run_plans_async(
+        plans,
+        global_limit=parameters.get("global_limit", async_runner.DEFAULT_GLOBAL_LIMIT),
+        per_host_limit=parameters.get("per_host_limit", async_runner.DEFAULT_PER_HOST_LIMIT),
+        timeout=parameters.get("timeout", test_runner.DEFAULT_TIMEOUT),
+    )
+
+
+# ===================== keyword =====================
+async def keyword(request):
+    source_data = _native(request, KEYWORD_ASYNC_OPERATES)
+    if source_data is None:
+        return await _in_thread(views.keyword)(request)
+
+    try:
+        logger.info(f"Received POST request: {log_payload(request.body)}")
+        operate = source_data["operate"]
+        parameters = source_data["parameters"]
+        project_name = source_data.get("project_name")
+        await sharding.aactivate(project_name)
+        page = None
+        fields = None
+        if operate == "show_all":
+            logger.info(f"Showing all keywords for project '{project_name}'")
+            async with db_router.areplica_reads():
+                project = await cache.aget_project(project_name)
+                keywords = await db_router.abind(KeyWord.objects.filter(project=project))
+                keywords, page = await apaginate(keywords, parameters)
+            fields = get_fields(KeyWord, parameters)
+            message = "search all keyword successfully"
+        else:
+            logger.info(f"Searching keywords for project '{project_name}' with parameters: {log_payload(parameters)}")
+            async with db_router.areplica_reads():
+                keywords, page = await search_keyword(project_name, parameters)
+            if keywords is None:
+                message = "no keywords match"
+                keywords = []
+            else:
+                message = "search keywords successfully"
+                fields = get_fields(KeyWord, parameters)
+    except Exception as e:
+        logger.error(f"Exception occurred: {e}", exc_info=True)
+        return JsonResponse({'error': f"except:{e}, type:{type(e)}"}, status=400)
+
+    logger.info(f"Operation '{operate}' completed successfully for project '{project_name}'")
+    return await amodel_list_response(
+        "keyword",
+        keywords,
+        code=200,
+        message=message,
+        fields=fields,
+        extra={"page": page} if page is not None else None,
+        stream=True,
+    )
+
+
+async def search_keyword(project_name, parameters):
+    project = await cache.aget_project(project_name)
+
+    name = parameters.get("name")
+    if not name:
+        raise ValidationError('Must provide keyword name for searching')
+    keywords, page = await search.asearch(KeyWord, project, name, parameters)
+    if not keywords:
+        return None, None
+    return keywords, page
+
+
+# ===================== project =====================
+async def project(request):
+    source_data = _native(request, PROJECT_ASYNC_OPERATES)
+    if source_data is None:
+        return await _in_thread(views.project)(request)
+
+    logger.info(log_payload(request.body))
+    async with db_router.areplica_reads():
+        projects = await db_router.abind(Project.objects.all())
+    return await amodel_list_response("testcases", projects, code=200, message="search all project successfully", stream=True)
@@ -0,0 +1,450 @@
+import json
+import math
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import django
+from django.core.cache import cache as shared_cache
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.test import Client
+
+from .models import Project
+from . import cache, importer, metrics, search, sharding
+from utils import test_script_generator
+
+"""
+可复现的基准测试（manage.py benchmark 与 benchmark_tests/ 共用）：
+  1. 在临时测试库（与 manage.py test 相同的 test_ 库，SQLite 为内存库）里按
+     项目数 × 每项目用例数 × 每用例步骤数 × 每步骤断言数 生成数据（走 importer 的批量写入）
+  2. 通过测试客户端（完整中间件 + 视图）逐个调用 testcase / keyword / project 的每个 operate，
+     以及直接调用脚本生成器；run 的步骤请求发往进程内的桩服务
+  3. 每项记录 p50 / p95 / p99 耗时、每次调用的查询条数、峰值内存（tracemalloc，单独一次调用，不计入耗时）
+结果为 JSON，两次提交各跑一次后用 compare() / --compare 对比。
+"""
+
+DEFAULT_VOLUMES = {"projects": 2, "testcases": 50, "steps": 5, "assertions": 2, "keywords": 10}
+DEFAULT_ITERATIONS = 20
+DEFAULT_WARMUP = 2
+# run / import 每次处理的用例数
+RUN_BATCH = 10
+IMPORT_BATCH = 10
+# 对比时 p50 / p95 变慢超过该比例（且超过 MIN_REGRESSION_MS）算退化；查询条数只要增加就算
+DEFAULT_THRESHOLD = 0.2
+MIN_REGRESSION_MS = 1.0
+
+PROJECT_PREFIX = "bench_p"
+TESTCASE_URL = "/testplatform/testcase/"
+KEYWORD_URL = "/testplatform/keyword/"
+PROJECT_URL = "/testplatform/project/"
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+# ===================== 运行环境 =====================
+@contextmanager
+def isolated_databases(keepdb=False, verbosity=0):
+    """
+    与 manage.py test 相同：为每个数据库别名创建 test_ 库，结束后删除，不会碰到真实数据。
+    testplatform 的表直接按当前模型创建（仓库不带迁移文件，各环境本地 makemigrations）；
+    缓存同样换成临时目录下的文件缓存，不读写、不清空部署的 Redis 或运行中服务的缓存目录
+    """
+    from django.test.utils import override_settings, setup_databases, teardown_databases
+
+    with override_settings(MIGRATION_MODULES={"testplatform": None}):
+        old_config = setup_databases(verbosity, interactive=False, keepdb=keepdb, aliases=set(connections),
+                                     serialized_aliases=set())
+    try:
+        with tempfile.TemporaryDirectory(prefix="tb-bench-cache-") as cache_dir, override_settings(CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": cache_dir,
+                "OPTIONS": {"MAX_ENTRIES": 10000},
+            }
+        }):
+            reset_caches()
+            try:
+                yield
+            finally:
+                reset_caches()
+    finally:
+        teardown_databases(old_config, verbosity, keepdb=keepdb)
+
+
+def reset_caches():
+    # 进程内缓存（项目、关键字目录、搜索索引）里的 id 来自上一套库，换库后必须清掉；
+    # 只在 isolated_databases() 内调用，此时 shared_cache 是临时目录下的缓存
+    cache.clear_local()
+    shared_cache.clear()
+    search._indexes.clear()
+    sharding._entries.clear()
+
+
+class _TargetHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    _body = json.dumps({"code": 200, "message": "ok"}).encode()
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self._body)))
+        self.end_headers()
+        self.wfile.write(self._body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def target_server():
+    """run 的步骤请求目标：本机随机端口上的桩服务，固定返回 {"code": 200, "message": "ok"}"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _TargetHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="tb-bench-target", daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def casefile_dir():
+    """脚本生成写到临时目录，不污染仓库里的 casefile/"""
+    original = test_script_generator.CASEFILE_DIR
+    with tempfile.TemporaryDirectory(prefix="tb-bench-casefile-") as tmp:
+        test_script_generator.CASEFILE_DIR = Path(tmp)
+        try:
+            yield Path(tmp)
+        finally:
+            test_script_generator.CASEFILE_DIR = original
+
+
+# ===================== 造数 =====================
+def keyword_record(index, target_url, assertions=1) -> dict:
+    return {
+        "name": f"bench_kw_{index:04d}",
+        "url": f"{target_url}/kw/{index}",
+        "method": "POST",
+        "params": {},
+        "headers": {"Content-Type": "application/json"},
+        "body_type": "raw",
+        "body": '{"k": 1}',
+        "assertions": [{"target_value": "${response}.code", "operator": "equal", "compared_value": "200"}] * assertions,
+    }
+
+
+def testcase_record(title, volumes, target_url) -> dict:
+    steps = []
+    for order in range(1, volumes["steps"] + 1):
+        steps.append({
+            "name": f"bench_kw_{order % volumes['keywords']:04d}",
+            "order": order,
+            "url": f"{target_url}/step/{order}",
+            "method": "POST",
+            "params": {"order": order},
+            "headers": {"Content-Type": "application/json"},
+            "body_type": "raw",
+            "body": json.dumps({"title": title, "order": order}),
+            "assertions": [
+                {"target_value": "${response}.code", "operator": "equal", "compared_value": "200"}
+                if i % 2 == 0 else
+                {"target_value": "${response}.body['message']", "operator": "equal_to", "compared_value": "ok"}
+                for i in range(volumes["assertions"])
+            ],
+        })
+    return {
+        "title": title,
+        "name": title.replace("case", "name"),
+        "level": 1,
+        "precondition": "",
+        "test_precondition": "",
+        "expected_result": "ok",
+        "type": "function_case",
+        "auto_flag": True,
+        "description": f"benchmark case {title}",
+        "keywords": steps,
+    }
+
+
+def testcase_title(index) -> str:
+    return f"bench_case_{index:05d}"
+
+
+def seed(volumes, target_url) -> list[str]:
+    """按 volumes 生成数据，返回项目名列表；关键字 / 用例通过 importer 批量写入项目所在分片"""
+    volumes = {**DEFAULT_VOLUMES, **volumes}
+    if volumes["keywords"] < 1 or volumes["projects"] < 1:
+        raise ValidationError("benchmark needs at least one project and one keyword")
+    names = []
+    for p in range(volumes["projects"]):
+        project = Project.objects.create(name=f"{PROJECT_PREFIX}{p}", description="benchmark project")
+        sharding.place_project(project)
+        with sharding.use_project(project):
+            _check_import(importer.import_keywords(
+                project, [keyword_record(k, target_url) for k in range(volumes["keywords"])], strict=True))
+            _check_import(importer.import_testcases(
+                project, [testcase_record(testcase_title(t), volumes, target_url) for t in range(volumes["testcases"])],
+                strict=True))
+        names.append(project.name)
+    return names
+
+
+def _check_import(result):
+    if result["failed"]:
+        raise BenchmarkError(f"seeding failed: {result['errors'][:3]}")
+
+
+# ===================== 计时 =====================
+def percentile(samples, pct) -> float:
+    """最近秩法（nearest-rank）"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def measure(fn, iterations, warmup=DEFAULT_WARMUP) -> dict:
+    """
+    依次以 0 .. warmup+iterations 为参数调用 fn：前 warmup 次不计，中间 iterations 次计时并统计查询，
+    最后一次在 tracemalloc 下执行，只取峰值内存。写操作按下标成对（create i / update i / delete i）
+    """
+    timings, queries = [], []
+    errors, first_error = 0, None
+    for i in range(warmup + iterations + 1):
+        traced = i == warmup + iterations
+        if traced:
+            tracemalloc.start()
+        try:
+            with metrics.collect() as stats:
+                started = time.perf_counter()
+                fn(i)
+                elapsed = time.perf_counter() - started
+        except Exception as e:
+            errors += 1
+            first_error = first_error or f"{type(e).__name__}: {e}"
+            continue
+        finally:
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        if warmup <= i < warmup + iterations:
+            timings.append(elapsed * 1000)
+            queries.append(stats.queries)
+
+    result = {
+        "iterations": len(timings),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "mean_ms": round(statistics.fmean(timings), 3) if timings else 0.0,
+        "min_ms": round(min(timings), 3) if timings else 0.0,
+        "max_ms": round(max(timings), 3) if timings else 0.0,
+        "queries": int(statistics.median(queries)) if queries else 0,
+        "queries_max": max(queries) if queries else 0,
+        "peak_memory_kb": round(peak / 1024, 1),
+        "errors": errors,
+    }
+    if first_error:
+        result["error"] = first_error[:500]
+    return result
+
+
+class Suite:
+    """每个基准项为 (名称, fn(i))；读操作在第一个项目上，写操作使用按下标生成的独立名称"""
+
+    def __init__(self, project_names, volumes, target_url):
+        self.client = Client()
+        self.project = project_names[0]
+        self.volumes = {**DEFAULT_VOLUMES, **volumes}
+        self.target_url = target_url
+
+    def post(self, path, operate, parameters, project_name=None) -> dict:
+        payload = {"operate": operate, "parameters": parameters}
+        if path != PROJECT_URL:
+            payload["project_name"] = project_name or self.project
+        response = self.client.post(path, json.dumps(payload), content_type="application/json")
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        if response.status_code != 200:
+            raise BenchmarkError(f"{operate} returned HTTP {response.status_code}: {body[:300]!r}")
+        return json.loads(body)
+
+    def _title(self, i) -> str:
+        return testcase_title(i % self.volumes["testcases"])
+
+    def _run_titles(self) -> list[str]:
+        return [testcase_title(t) for t in range(min(RUN_BATCH, self.volumes["testcases"]))]
+
+    def cases(self) -> list[tuple]:
+        v = self.volumes
+        return [
+            # ----- project -----
+            ("project.show_all", lambda i: self.post(PROJECT_URL, "show_all", {})),
+            ("project.create", lambda i: self.post(PROJECT_URL, "create", {"name": f"bench_new_p{i}", "description": "new"})),
+            ("project.update", lambda i: self.post(PROJECT_URL, "update", {
+                "update_source_name": f"bench_new_p{i}", "name": f"bench_new_p{i}", "description": "updated"})),
+            ("project.delete", lambda i: self.post(PROJECT_URL, "delete", {"delete_list": [f"bench_new_p{i}"]})),
+            # ----- keyword -----
+            ("keyword.show_all", lambda i: self.post(KEYWORD_URL, "show_all", {})),
+            ("keyword.search", lambda i: self.post(KEYWORD_URL, "search", {"name": f"kw_{i % v['keywords']:04d}"})),
+            ("keyword.create", lambda i: self.post(KEYWORD_URL, "create", {
+                **keyword_record(i, self.target_url), "name": f"bench_new_kw_{i}"})),
+            ("keyword.update", lambda i: self.post(KEYWORD_URL, "update", {
+                **keyword_record(i, self.target_url, assertions=2), "update_source_name": f"bench_new_kw_{i}",
+                "name": f"bench_new_kw_{i}"})),
+            ("keyword.import", lambda i: self.post(KEYWORD_URL, "import", {"strict": True, "records": [
+                {**keyword_record(j, self.target_url), "name": f"bench_imp_kw_{i}_{j}"} for j in range(IMPORT_BATCH)]})),
+            ("keyword.delete", lambda i: self.post(KEYWORD_URL, "delete", {
+                "delete_name_list": [f"bench_new_kw_{i}"] + [f"bench_imp_kw_{i}_{j}" for j in range(IMPORT_BATCH)]})),
+            # ----- testcase -----
+            ("testcase.show_all", lambda i: self.post(TESTCASE_URL, "show_all", {})),
+            ("testcase.show_all.paged", lambda i: self.post(TESTCASE_URL, "show_all", {"page_size": 20})),
+            ("testcase.search", lambda i: self.post(TESTCASE_URL, "search", {"title": f"case_{i % v['testcases']:05d}"})),
+            ("testcase.show_testcase", lambda i: self.post(TESTCASE_URL, "show_testcase", {"title": self._title(i)})),
+            ("testcase.testcase_detail", lambda i: self.post(TESTCASE_URL, "testcase_detail", {"title": self._title(i)})),
+            ("testcase.run.thread", lambda i: self.post(TESTCASE_URL, "run", {
+                "title_list": self._run_titles(), "mode": "thread", "timeout": 5})),
+            ("testcase.run.async", lambda i: self.post(TESTCASE_URL, "run", {
+                "title_list": self._run_titles(), "mode": "async", "timeout": 5})),
+            ("testcase.generate", lambda i: self.post(TESTCASE_URL, "generate", {"title_list": [], "force": True})),
+            ("testcase.create", lambda i: self.post(TESTCASE_URL, "create", testcase_record(
+                f"bench_new_case_{i}", v, self.target_url))),
+            ("testcase.update", lambda i: self.post(TESTCASE_URL, "update", {
+                **testcase_record(f"bench_new_case_{i}", {**v, "assertions": v["assertions"] + 1}, self.target_url),
+                "update_source_title": f"bench_new_case_{i}"})),
+            ("testcase.import", lambda i: self.post(TESTCASE_URL, "import", {"strict": True, "records": [
+                testcase_record(f"bench_imp_{i}_{j}", v, self.target_url) for j in range(IMPORT_BATCH)]})),
+            ("testcase.delete", lambda i: self.post(TESTCASE_URL, "delete", {
+                "delete_title_list": [f"bench_new_case_{i}"] + [f"bench_imp_{i}_{j}" for j in range(IMPORT_BATCH)]})),
+            # ----- 脚本生成器（直接调用） -----
+            ("script_generator.full", lambda i: test_script_generator.create_test_scripts(self.project, force=True)),
+            ("script_generator.incremental", lambda i: test_script_generator.create_test_scripts(self.project)),
+        ]
+
+
+def run(volumes=None, iterations=DEFAULT_ITERATIONS, warmup=DEFAULT_WARMUP, only=None, keepdb=False,
+        progress=None) -> dict:
+    """
+    完整流程：临时库 → 造数 → 逐项计时 → 返回报告（dict，可直接 json.dump）。
+    only：只跑名称以其中任一前缀开头的项，如 ["testcase.show", "project"]
+    """
+    volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+    results = {}
+    with isolated_databases(keepdb=keepdb), target_server() as target_url, casefile_dir():
+        started = time.perf_counter()
+        project_names = seed(volumes, target_url)
+        seed_seconds = time.perf_counter() - started
+        vendor = connections["default"].vendor
+        suite = Suite(project_names, volumes, target_url)
+        for name, fn in suite.cases():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            results[name] = measure(fn, iterations, warmup)
+            if progress:
+                progress(name, results[name])
+
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": vendor,
+            "volumes": volumes,
+            "iterations": iterations,
+            "warmup": warmup,
+            "seed_seconds": round(seed_seconds, 3),
+            "max_rss_kb": _max_rss_kb(),
+        },
+        "results": results,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _max_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Linux 上单位为 KB（macOS 为字节）
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if platform.system() == "Darwin" else rss
+
+
+# ===================== 报告与对比 =====================
+def save(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def load(path) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def format_report(report) -> str:
+    lines = [f"{'name':<32}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'peak KB':>10}{'errors':>8}"]
+    for name, r in report["results"].items():
+        lines.append(f"{name:<32}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                     f"{r['queries']:>9}{r['peak_memory_kb']:>10.1f}{r['errors']:>8}")
+    return "\n".join(lines)
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD) -> list[dict]:
+    """逐项对比两份报告，返回每项的变化；regression 为 True 的是退化项。只在一边出现的项跳过"""
+    rows = []
+    for name, new in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        row = {"name": name, "regression": False, "reasons": []}
+        for key in ("p50_ms", "p95_ms"):
+            before, after = old[key], new[key]
+            row[key] = (before, after)
+            if after - before > MIN_REGRESSION_MS and before and (after - before) / before > threshold:
+                row["regression"] = True
+                row["reasons"].append(f"{key} {before:.2f} -> {after:.2f}")
+        row["queries"] = (old["queries"], new["queries"])
+        if new["queries"] > old["queries"]:
+            row["regression"] = True
+            row["reasons"].append(f"queries {old['queries']} -> {new['queries']}")
+        if new["errors"] > old["errors"]:
+            row["regression"] = True
+            row["reasons"].append(f"errors {old['errors']} -> {new['errors']}")
+        rows.append(row)
+    return rows
+
+
+def format_comparison(rows) -> str:
+    lines = [f"{'name':<32}{'p50 ms':>20}{'p95 ms':>20}{'queries':>13}  status"]
+    for row in rows:
+        p50, p95, queries = row["p50_ms"], row["p95_ms"], row["queries"]
+        status = "REGRESSION: " + "; ".join(row["reasons"]) if row["regression"] else "ok"
+        lines.append(f"{row['name']:<32}{p50[0]:>9.2f} -> {p50[1]:<7.2f}{p95[0]:>9.2f} -> {p95[1]:<7.2f}"
+                     f"{queries[0]:>5} -> {queries[1]:<4}  {status}")
+    return "\n".join(lines)
@@ -0,0 +1,299 @@
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache as shared_cache
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .models import Project, KeyWord, Testcase
+from . import db_router, metrics
+
+"""
+项目 / 关键字目录 / 用例详情的读穿透缓存，两级：
+  - 进程内 LRU：命中时不走网络、不反序列化
+  - Django cache（settings.CACHES：Redis，未配置时为本机文件缓存）：进程间共享，worker 重启后不用回源
+失效不删 key，而是更换版本号：缓存 key 里带上版本号，写路径给版本号写入一个新的随机值后旧条目自然不再命中，由 LRU / 过期时间淘汰。
+用随机值而不是 incr：文件 / 数据库缓存的 incr 是先读再写，并发递增会丢失一次，随机值只依赖单个 key 的 set 是原子的。
+版本号必须在所有进程间共享：进程内后端（LocMemCache / DummyCache）下一个进程的写入不会让其他进程的 LRU 失效，
+serve 多 worker 与 run_workers 在这种配置下拒绝启动（is_shared）。
+  - "projects"：项目名 → Project，项目增删改时递增
+  - "project:<id>"：该项目的关键字目录、用例详情，项目下用例 / 关键字 / 步骤 / 断言任何写入都递增
+写路径在 transaction.atomic() 块内调用 bump_*：块内立即递增一次，提交后（on_commit）再递增一次。
+提交前有并发读把旧数据按中间版本写进缓存，也会被提交后的第二次递增作废，提交之后的读一定回源拿到新数据。
+事务块内的读只回源不回填，避免把未提交（可能回滚）的数据写进缓存。
+版本号在进程内缓存 VERSION_TTL 秒，LRU 命中时不用每次都读共享缓存（文件缓存每读一次是一次文件打开 + 反序列化）：
+本进程的写入立即生效，其他进程的写入最多 VERSION_TTL 秒后生效；处于读己之写窗口（db_router.is_sticky）的请求不用进程内的版本号，
+写入方紧接着的读即使落在别的 worker 上也能拿到新数据。
+在 db_router.replica_reads() 内回源时，只有副本已追上该 scope 最后一次提交时，才从副本读，否则改读写库，
+避免把副本上的旧数据写进新版本号下的缓存。
+"""
+
+LOCAL_CACHE_SIZE = getattr(settings, "TESTBENCH_LOCAL_CACHE_SIZE", 1024)
+# 共享缓存里的条目过期时间（秒）；正确性靠版本号保证，这里只是回收旧版本占用的空间
+SHARED_CACHE_TIMEOUT = 3600
+# 版本号在进程内的缓存时间（秒），与 sharding.DIRECTORY_TTL 相同；0 表示每次都读共享缓存
+VERSION_TTL = getattr(settings, "TESTBENCH_CACHE_VERSION_TTL", 1.0)
+
+PROJECTS_SCOPE = "projects"
+# 只在当前进程内有效的缓存后端
+LOCAL_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+_MISSING = object()
+
+
+# ===================== 进程内 LRU =====================
+class LRUCache:
+    def __init__(self, maxsize=LOCAL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local = LRUCache()
+
+
+# ===================== 版本号 =====================
+def is_shared() -> bool:
+    """版本号是否对其他进程可见；为 False 时只能单进程部署"""
+    return settings.CACHES[DEFAULT_CACHE_ALIAS]["BACKEND"] not in LOCAL_BACKENDS
+
+
+def _namespace() -> str:
+    # 同一个缓存后端可能被不同的库共用（开发服务器与 manage.py test / benchmark 的临时库），key 按 default 库区分
+    db = connections[DEFAULT_DB_ALIAS].settings_dict
+    return hashlib.md5(f"{db.get('HOST')}/{db['NAME']}".encode("utf-8")).hexdigest()[:8]
+
+
+def _version_key(scope) -> str:
+    return f"tb:cache:{_namespace()}:ver:{scope}"
+
+
+def _written_key(scope) -> str:
+    # scope 最后一次提交写入的时间戳
+    return f"tb:cache:{_namespace()}:written:{scope}"
+
+
+def _new_version() -> int:
+    # secrets 而不是 random：fork 出来的 worker 继承同一个 random 状态，会生成相同的序列
+    return secrets.randbits(63)
+
+
+# 版本号 key → (过期时刻 time.monotonic, 版本号)
+_versions: dict[str, tuple[float, int]] = {}
+
+
+def _local_version(key):
+    if VERSION_TTL <= 0 or db_router.is_sticky():
+        return None
+    entry = _versions.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+def _remember_version(key, value):
+    if VERSION_TTL > 0:
+        _versions[key] = (time.monotonic() + VERSION_TTL, value)
+
+
+def version(scope) -> int:
+    key = _version_key(scope)
+    value = _local_version(key)
+    if value is not None:
+        return value
+    value = shared_cache.get(key)
+    if value is None:
+        # 版本号被淘汰 / 缓存重启：取一个新的随机值，不会撞上旧条目；并发时以先 add 成功的为准
+        shared_cache.add(key, _new_version(), None)
+        value = shared_cache.get(key)
+    _remember_version(key, value)
+    return value
+
+
+async def aversion(scope) -> int:
+    key = _version_key(scope)
+    value = _local_version(key)
+    if value is not None:
+        return value
+    value = await shared_cache.aget(key)
+    if value is None:
+        await shared_cache.aadd(key, _new_version(), None)
+        value = await shared_cache.aget(key)
+    _remember_version(key, value)
+    return value
+
+
+def _incr(scope):
+    key = _version_key(scope)
+    shared_cache.set(key, _new_version(), None)
+    # 本进程的下一次读直接读共享缓存里的新版本号
+    _versions.pop(key, None)
+
+
+def _committed(scope):
+    shared_cache.set(_written_key(scope), time.time(), None)
+    _incr(scope)
+
+
+def _atomic_aliases() -> list[str]:
+    # 分片后写事务不一定在 default 上，检查本线程所有已打开的连接
+    return [conn.alias for conn in connections.all(initialized_only=True) if conn.in_atomic_block]
+
+
+def bump(scope):
+    """在写事务内调用：立即换一次版本号，每个进行中的事务提交后记录提交时间并再换一次；不在事务内时直接记录"""
+    _incr(scope)
+    aliases = _atomic_aliases()
+    if not aliases:
+        _committed(scope)
+    for alias in aliases:
+        transaction.on_commit(lambda: _committed(scope), using=alias)
+
+
+def project_scope(project_id) -> str:
+    return f"project:{project_id}"
+
+
+def bump_project(project_id):
+    bump(project_scope(project_id))
+
+
+def bump_projects():
+    bump(PROJECTS_SCOPE)
+
+
+# ===================== 读穿透 =====================
+def _entry_key(scope, name, ver) -> str:
+    # name 可能含中文 / 空格（用例标题），memcached 之类的后端不接受，统一取 md5
+    digest = hashlib.md5(name.encode("utf-8")).hexdigest()
+    return f"tb:cache:{_namespace()}:{scope}:{digest}:{ver}"
+
+
+def cached(scope, name, loader, allow_in_atomic=False):
+    """
+    按 (scope 当前版本, name) 读缓存，未命中时调用 loader() 回源并回填两级缓存；loader 返回 None 不缓存。
+    allow_in_atomic：loader 读的数据不会被当前事务修改（如分片目录）时，事务内也可以走缓存
+    """
+    if not allow_in_atomic and _atomic_aliases():
+        return loader()
+
+    key = _entry_key(scope, name, version(scope))
+    value = _local.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+    value = shared_cache.get(key, _MISSING)
+    if value is _MISSING:
+        with db_router.fresh_reads(shared_cache.get(_written_key(scope))), metrics.timed("cache_load"):
+            value = loader()
+        if value is None:
+            return None
+        shared_cache.set(key, value, SHARED_CACHE_TIMEOUT)
+    _local.set(key, value)
+    return value
+
+
+async def acached(scope, name, aloader):
+    """
+    cached 的异步版本，供异步视图使用：命中时只有一次异步的共享缓存访问；aloader 为协程函数（使用异步 ORM）。
+    异步视图不在 transaction.atomic() 中执行，不需要事务内的判断
+    """
+    key = _entry_key(scope, name, await aversion(scope))
+    value = _local.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+    value = await shared_cache.aget(key, _MISSING)
+    if value is _MISSING:
+        async with db_router.afresh_reads(await shared_cache.aget(_written_key(scope))):
+            with metrics.timed("cache_load"):
+                value = await aloader()
+        if value is None:
+            return None
+        await shared_cache.aset(key, value, SHARED_CACHE_TIMEOUT)
+    _local.set(key, value)
+    return value
+
+
+def clear_local():
+    _local.clear()
+    _versions.clear()
+
+
+# ===================== 对外入口 =====================
+def get_project(name) -> Project:
+    """替代 views 里到处都是的 Project.objects.get(name=...)；返回的实例是共享的，只读使用"""
+    project = cached(PROJECTS_SCOPE, str(name), lambda: Project.objects.filter(name=name).first())
+    if project is None:
+        raise ValidationError(f"Project '{name}' not found")
+    return project
+
+
+async def aget_project(name) -> Project:
+    project = await acached(PROJECTS_SCOPE, str(name), lambda: Project.objects.filter(name=name).afirst())
+    if project is None:
+        raise ValidationError(f"Project '{name}' not found")
+    return project
+
+
+def keyword_catalog(project) -> dict[str, KeyWord]:
+    """项目下全部关键字：name → KeyWord"""
+    return cached(
+        project_scope(project.id),
+        "keywords",
+        lambda: {kw.name: kw for kw in KeyWord.objects.filter(project=project)},
+    )
+
+
+def testcase_entry(project, kind, title, loader):
+    """用例维度的缓存（show_testcase / testcase_detail 的结果），随项目版本号一起失效"""
+    return cached(project_scope(project.id), f"{kind}:{title}", loader)
+
+
+async def atestcase_entry(project, kind, title, aloader):
+    return await acached(project_scope(project.id), f"{kind}:{title}", aloader)
+
+
+# ===================== 信号：admin 等不经过 views 的写入 =====================
+def _on_project_change(sender, instance, **kwargs):
+    bump_projects()
+
+
+def _on_project_data_change(sender, instance, **kwargs):
+    bump_project(instance.project_id)
+
+
+def connect_signals():
+    from django.db.models.signals import post_save, post_delete
+    post_save.connect(_on_project_change, sender=Project, dispatch_uid="tb_cache_project_save")
+    post_delete.connect(_on_project_change, sender=Project, dispatch_uid="tb_cache_project_delete")
+    for model in (Testcase, KeyWord):
+        post_save.connect(_on_project_data_change, sender=model, dispatch_uid=f"tb_cache_{model.__name__}_save")
+        post_delete.connect(_on_project_data_change, sender=model, dispatch_uid=f"tb_cache_{model.__name__}_delete")
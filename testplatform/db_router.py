@@ -0,0 +1,303 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router, transaction
+
+"""
+读写分离（DATABASE_ROUTERS）：
+  - 写库：default（mysql_ha 中的 master）；所有写入、事务、以及未显式声明的读都走写库
+  - 读库：settings.TESTBENCH_DB_REPLICAS 中的别名（mysql_ha 中的 replica1 / replica2）
+只有包在 replica_reads() 里的读（show_all / search / show_testcase 等）才会路由到读库，并且满足：
+  - 读己之写：会话最近 TESTBENCH_DB_STICKY_SECONDS 秒内写过（ReadYourWritesMiddleware 写入的 cookie），读写库。
+    "写过"指请求里真正执行过 INSERT / UPDATE / DELETE 并已提交（见 _mark_writes），而不是 router 被问过写库
+  - 延迟保护：副本复制延迟（SHOW REPLICA STATUS 的 Seconds_Behind_Source，按进程缓存）超过
+    TESTBENCH_DB_MAX_REPLICA_LAG 秒、复制已停止或查询失败的副本不参与读；没有可用副本时读写库。
+    SHOW REPLICA STATUS 需要 REPLICATION CLIENT 权限（mysql_ha/init/00_init.sql 已授予 appuser），
+    读不到延迟时记一条 WARNING（每个副本在恢复前只记一次）
+"""
+
+logger = logging.getLogger('django')
+
+WRITER = DEFAULT_DB_ALIAS
+STICKY_COOKIE = "tb_last_write"
+STICKY_SECONDS = getattr(settings, "TESTBENCH_DB_STICKY_SECONDS", 5)
+MAX_REPLICA_LAG = getattr(settings, "TESTBENCH_DB_MAX_REPLICA_LAG", 3)
+# 复制延迟的检查间隔（秒），同一进程内的请求共用一次 SHOW REPLICA STATUS 的结果
+LAG_CHECK_INTERVAL = getattr(settings, "TESTBENCH_DB_LAG_CHECK_INTERVAL", 2)
+# Seconds_Behind_Source 是整秒精度，判断"副本是否已包含某时刻的写入"时多留 1 秒余量
+LAG_MARGIN = 1
+
+
+def replica_aliases() -> list[str]:
+    return [alias for alias in getattr(settings, "TESTBENCH_DB_REPLICAS", []) if alias in settings.DATABASES]
+
+
+# 当前上下文允许使用的读库别名，None 表示读写库
+_read_alias = contextvars.ContextVar("tb_read_alias", default=None)
+# 当前请求的状态：是否处于读己之写窗口内、本次请求是否发生了写入
+_request_state = contextvars.ContextVar("tb_request_state", default=None)
+
+
+# ===================== 复制延迟 =====================
+_lag_cache: dict[str, tuple[float, float | None]] = {}
+_lag_lock = threading.Lock()
+# 已记过"读不到延迟"警告的副本；读到延迟后移除，下次再读不到时重新记录
+_lag_unknown: set[str] = set()
+
+
+def _lag_unavailable(alias, reason) -> None:
+    if alias not in _lag_unknown:
+        _lag_unknown.add(alias)
+        logger.warning(f"replica {alias}: cannot read replication lag ({reason}), reads go to the writer")
+
+
+def _measure_lag(alias) -> float | None:
+    """返回副本延迟秒数；非副本、复制停止或查询失败时返回 None（视为不可用）"""
+    connection = connections[alias]
+    if connection.vendor != "mysql":
+        # 本地 SQLite 读写分离调试，没有复制延迟
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW REPLICA STATUS")
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description or ()]
+    except DatabaseError as e:
+        # 常见原因：账号缺少 REPLICATION CLIENT 权限
+        _lag_unavailable(alias, f"SHOW REPLICA STATUS failed: {e}")
+        return None
+    if row is None:
+        _lag_unavailable(alias, "SHOW REPLICA STATUS returned no row, not a replica")
+        return None
+    lag = dict(zip(columns, row)).get("Seconds_Behind_Source")
+    if lag is None:
+        _lag_unavailable(alias, "replication is not running")
+        return None
+    _lag_unknown.discard(alias)
+    return float(lag)
+
+
+def _lag_entry(alias) -> tuple[float, float | None]:
+    now = time.time()
+    entry = _lag_cache.get(alias)
+    if entry is not None and now - entry[0] < LAG_CHECK_INTERVAL:
+        return entry
+    with _lag_lock:
+        entry = _lag_cache.get(alias)
+        if entry is None or now - entry[0] >= LAG_CHECK_INTERVAL:
+            entry = _lag_cache[alias] = (now, _measure_lag(alias))
+    return entry
+
+
+def replica_lag(alias) -> float | None:
+    return _lag_entry(alias)[1]
+
+
+def replica_caught_up_to(alias) -> float | None:
+    """副本数据至少包含到哪个时间点的写入（unix 时间戳）；延迟未知时返回 None"""
+    checked_at, lag = _lag_entry(alias)
+    if lag is None:
+        return None
+    return checked_at - lag - LAG_MARGIN
+
+
+# ===================== 选择读库 =====================
+def is_sticky() -> bool:
+    """当前请求是否处于读己之写窗口内（该客户端最近 STICKY_SECONDS 秒内提交过写入）"""
+    state = _request_state.get()
+    return bool(state and state["sticky"])
+
+
+def choose_replica() -> str | None:
+    if is_sticky():
+        return None
+    healthy = []
+    for alias in replica_aliases():
+        lag = replica_lag(alias)
+        if lag is not None and lag <= MAX_REPLICA_LAG:
+            healthy.append(alias)
+    return random.choice(healthy) if healthy else None
+
+
+@contextmanager
+def replica_reads():
+    """
+    块内的读路由到一个可用副本；返回实际使用的别名。
+    需要在块外才求值的 QuerySet（流式输出）要用 bind() 绑定，否则求值时已离开上下文。
+    """
+    alias = choose_replica()
+    token = _read_alias.set(alias)
+    try:
+        yield alias or WRITER
+    finally:
+        _read_alias.reset(token)
+
+
+@asynccontextmanager
+async def areplica_reads():
+    """replica_reads 的异步版本：挑选副本可能要查复制延迟（同步 SQL），放到线程里执行"""
+    alias = await sync_to_async(choose_replica)()
+    token = _read_alias.set(alias)
+    try:
+        yield alias or WRITER
+    finally:
+        _read_alias.reset(token)
+
+
+def bind(queryset):
+    """把 QuerySet 固定到当前上下文路由到的库（分片 / 副本），用于在上下文之外才求值的流式输出"""
+    return queryset.using(router.db_for_read(queryset.model))
+
+
+async def abind(queryset):
+    # 分片目录未命中缓存时路由本身要查库，不能直接在事件循环里调用
+    return queryset.using(await sync_to_async(router.db_for_read)(queryset.model))
+
+
+@contextmanager
+def primary_reads():
+    """块内的读强制走写库"""
+    token = _read_alias.set(None)
+    try:
+        yield WRITER
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def fresh_reads(since):
+    """
+    块内的读需要包含 since（unix 时间戳）之前提交的写入：当前读库延迟不够小时改读写库。
+    since 为 None（不知道最后一次写入时间）时保守地读写库。
+    """
+    alias = _read_alias.get()
+    if alias is None or _replica_covers(alias, since):
+        yield alias or WRITER
+        return
+    with primary_reads() as writer:
+        yield writer
+
+
+@asynccontextmanager
+async def afresh_reads(since):
+    alias = _read_alias.get()
+    if alias is None or await sync_to_async(_replica_covers)(alias, since):
+        yield alias or WRITER
+        return
+    with primary_reads() as writer:
+        yield writer
+
+
+def _replica_covers(alias, since) -> bool:
+    caught_up = replica_caught_up_to(alias)
+    return since is not None and caught_up is not None and caught_up >= since
+
+
+# ===================== Router =====================
+class ReadWriteRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            # 关联对象跟随来源实例所在的库，避免主从混读
+            return instance._state.db
+        return _read_alias.get() or WRITER
+
+    def db_for_write(self, model, **hints):
+        # 只负责选库：router.db_for_write 也用来给事务 / 读路径选库，写入由 _mark_writes 在执行时记录
+        return WRITER
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 读库与写库是同一份数据
+        databases = {WRITER, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+# ===================== 读己之写 =====================
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def _mark_writes(execute, sql, params, many, context):
+    """
+    数据库连接的 execute wrapper：请求里执行成功的写语句标记 state["wrote"]；事务内的写等提交后再标记，回滚了不算。
+    bulk_create / QuerySet.update 等不发 post_save 信号的写入、分片库上的写入同样会被记录
+    """
+    result = execute(sql, params, many, context)
+    state = _request_state.get()
+    if state is None or state["wrote"] or not sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+        return result
+    connection = context["connection"]
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: state.update(wrote=True), using=connection.alias)
+    else:
+        state["wrote"] = True
+    return result
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    # 请求状态由 contextvar 决定，sync_to_async 线程里同样可见
+    if _mark_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_mark_writes)
+
+
+def connect_signals():
+    from django.db.backends.signals import connection_created
+    connection_created.connect(_on_connection_created, dispatch_uid="tb_db_router_mark_writes")
+    for connection in connections.all(initialized_only=True):
+        _on_connection_created(None, connection)
+
+
+class ReadYourWritesMiddleware:
+    """
+    请求发生写入后，通过 cookie 记录写入时间；同一客户端在 STICKY_SECONDS 内的读都走写库。
+    不保存 cookie 的客户端没有读己之写保证，只受副本延迟阈值保护。
+    同时支持 WSGI 与 ASGI：下游是异步视图时以协程方式执行，不会为每个请求占用一个线程。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self._state(request)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._finish(state, response)
+
+    async def __acall__(self, request):
+        state = self._state(request)
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._finish(state, response)
+
+    @staticmethod
+    def _state(request) -> dict:
+        try:
+            last_write = float(request.COOKIES.get(STICKY_COOKIE) or 0)
+        except ValueError:
+            last_write = 0
+        return {"sticky": time.time() - last_write < STICKY_SECONDS, "wrote": False}
+
+    @staticmethod
+    def _finish(state, response):
+        if state["wrote"]:
+            response.set_cookie(STICKY_COOKIE, f"{time.time():.3f}", max_age=STICKY_SECONDS, httponly=True, samesite="Lax")
+        return response
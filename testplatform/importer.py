@@ -0,0 +1,302 @@
+import json
+from collections import Counter
+
+import yaml
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+
+from .models import Testcase, KeyWord, TestCaseKeyword, Assertion
+from . import search, cache, sharding
+
+"""
+批量导入用例 / 关键字，记录格式与 README 中 create 的 parameters 相同：
+  - 用例：title、name、level、...、keywords[{name, order, url, ..., assertions[...]}]
+  - 关键字：name、url、method、params、headers、body_type、body、assertions[...]
+输入可以是 JSON 数组、JSON Lines 或 YAML（列表）。
+
+流程：先逐条校验（必填字段、重复、关键字是否存在、断言是否完整），出错的记录带下标返回、不入库；
+校验通过的记录在一个事务里用 bulk_create 分批写入 Testcase / TestCaseKeyword / Assertion。
+strict=True 时只要有一条出错就整批不导入。
+"""
+
+BATCH_SIZE = 500
+# 有 libyaml 时用 C 实现的安全加载器，几万条记录的 YAML 解析快一个数量级
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+TESTCASE_REQUIRED_FIELDS = ['title', 'name', 'level', 'precondition', 'test_precondition', 'expected_result', 'type', 'auto_flag', 'description', 'keywords']
+KEYWORD_REQUIRED_FIELDS = ['name', 'url', 'params', 'headers', 'body_type', 'body', 'method']
+
+
+# ===================== 解析输入 =====================
+def parse_records(content, fmt=None) -> list:
+    """
+    fmt: json / jsonl / yaml；不传时依次尝试 JSON、JSON Lines、YAML
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    fmt = (fmt or "").lower()
+
+    if fmt == "json":
+        records = json.loads(content)
+    elif fmt == "jsonl":
+        records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    elif fmt == "yaml":
+        records = yaml.load(content, Loader=_YAML_LOADER)
+    elif fmt:
+        raise ValidationError(f"Unsupported import format: {fmt}")
+    else:
+        try:
+            records = json.loads(content)
+        except ValueError:
+            try:
+                records = [json.loads(line) for line in content.splitlines() if line.strip()]
+            except ValueError:
+                records = yaml.load(content, Loader=_YAML_LOADER)
+
+    if isinstance(records, dict):
+        records = [records]
+    if not isinstance(records, list):
+        raise ValidationError("Import content must be a list of records")
+    return records
+
+
+def _check_assertions(assertions_data, require_compared_value):
+    for assertion_data in assertions_data or []:
+        target_value = assertion_data.get('target_value')
+        operator = assertion_data.get('operator')
+        compared_value = assertion_data.get('compared_value')
+        if not target_value or not operator or (require_compared_value and compared_value is None):
+            if require_compared_value:
+                raise ValidationError(
+                    "All of 'target_value', 'operator' and 'compared_value' are required and cannot be empty for each assertion")
+            raise ValidationError("Both 'target_value' and 'operator' are required and cannot be empty for each assertion")
+
+
+def _error_message(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(e.messages)
+    return f"{type(e).__name__}: {e}"
+
+
+def _in_chunks(values, size=BATCH_SIZE):
+    # IN 列表分批，避免几万个参数超过数据库的单条语句参数上限（SQLite 默认 32766）
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _has_returning_ids(model) -> bool:
+    # SQLite 3.35+/PostgreSQL/MariaDB 的 bulk_create 会回填主键，MySQL 不会，需要按唯一键回查
+    return connections[router.db_for_write(model)].features.can_return_rows_from_bulk_insert
+
+
+# ===================== 用例导入 =====================
+def import_testcases(project, records: list, strict=False) -> dict:
+    errors = []
+    valid = []
+
+    # 关键字名一次查询解析
+    keyword_names = {
+        kw.get('name')
+        for record in records if isinstance(record, dict)
+        for kw in (record.get('keywords') or []) if isinstance(kw, dict)
+    }
+    keyword_map = {
+        kw.name: kw
+        for chunk in _in_chunks(keyword_names)
+        for kw in KeyWord.objects.filter(project=project, name__in=chunk)
+    }
+
+    # 已存在的用例（project_case 唯一）批量查询
+    titles = {record.get('title') for record in records if isinstance(record, dict)}
+    existing_cases = {
+        project_case
+        for chunk in _in_chunks(f"{project.name}_{t}" for t in titles if t)
+        for project_case in Testcase.objects.filter(project_case__in=chunk).values_list('project_case', flat=True)
+    }
+    seen_cases = set()
+
+    for index, record in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise ValidationError("Record must be an object")
+            for field in TESTCASE_REQUIRED_FIELDS:
+                if field not in record:
+                    raise ValidationError(f"Missing required field: {field}")
+
+            project_case = f"{project.name}_{record['title']}"
+            if project_case in existing_cases:
+                raise ValidationError(f"Testcase '{record['title']}' already exists in project '{project.name}'")
+            if project_case in seen_cases:
+                raise ValidationError(f"Duplicate testcase title in import: {record['title']}")
+
+            testcase = Testcase(
+                project=project,
+                project_case=project_case,
+                title=record["title"],
+                name=record["name"],
+                level=record["level"],
+                precondition=record["precondition"],
+                test_precondition=record["test_precondition"],
+                expected_result=record["expected_result"],
+                type=record["type"],
+                auto_flag=record["auto_flag"],
+                description=record.get('description', ''),
+            )
+            testcase.clean_fields(exclude=['project'])
+
+            steps = []
+            orders = Counter(kw.get('order') for kw in record['keywords'])
+            duplicated = [order for order, count in orders.items() if count > 1]
+            if duplicated:
+                raise ValidationError(f"Duplicate keyword order: {duplicated}")
+            for keyword_data in record['keywords']:
+                keyword_name = keyword_data['name']
+                if keyword_name not in keyword_map:
+                    raise ValidationError(f"没匹配到合适的keyword: {keyword_name}")
+                _check_assertions(keyword_data.get('assertions', []), require_compared_value=True)
+                step = TestCaseKeyword(
+                    keyword=keyword_map[keyword_name],
+                    order=keyword_data['order'],
+                    url=keyword_data.get('url', ''),
+                    method=keyword_data.get('method', ''),
+                    params=keyword_data.get('params', {}),
+                    headers=keyword_data.get('headers', {}),
+                    body_type=keyword_data.get('body_type', ''),
+                    body=keyword_data.get('body', ''),
+                )
+                steps.append((step, keyword_data.get('assertions', [])))
+        except (ValidationError, KeyError, TypeError, ValueError, AttributeError) as e:
+            errors.append({"index": index, "title": record.get('title') if isinstance(record, dict) else None,
+                           "error": _error_message(e)})
+            continue
+
+        seen_cases.add(project_case)
+        valid.append((testcase, steps))
+
+    if strict and errors:
+        return {"total": len(records), "imported": 0, "failed": len(errors), "errors": errors}
+
+    with transaction.atomic(using=sharding.alias_for(project.id)):
+        cache.bump_project(project.id)
+        testcases = [testcase for testcase, _ in valid]
+        Testcase.objects.bulk_create(testcases, batch_size=BATCH_SIZE)
+        if testcases and not _has_returning_ids(Testcase):
+            ids = {}
+            for chunk in _in_chunks(tc.project_case for tc in testcases):
+                ids.update(Testcase.objects.filter(project_case__in=chunk).values_list('project_case', 'id'))
+            for tc in testcases:
+                tc.id = ids[tc.project_case]
+
+        all_steps = []
+        for testcase, steps in valid:
+            for step, _ in steps:
+                step.test_case = testcase
+                all_steps.append(step)
+        TestCaseKeyword.objects.bulk_create(all_steps, batch_size=BATCH_SIZE)
+        if all_steps and not _has_returning_ids(TestCaseKeyword):
+            # 新建用例的步骤以 (用例, order) 唯一定位
+            ids = {
+                (test_case_id, order): pk
+                for chunk in _in_chunks(tc.id for tc in testcases)
+                for pk, test_case_id, order in TestCaseKeyword.objects
+                .filter(test_case_id__in=chunk)
+                .values_list('id', 'test_case_id', 'order')
+            }
+            for step in all_steps:
+                step.id = ids[(step.test_case.id, step.order)]
+
+        assertions = [
+            Assertion(
+                target_value=assertion_data['target_value'],
+                operator=assertion_data['operator'],
+                compared_value=assertion_data['compared_value'],
+                testcase_keyword=step,
+            )
+            for _, steps in valid
+            for step, assertions_data in steps
+            for assertion_data in assertions_data or []
+        ]
+        Assertion.objects.bulk_create(assertions, batch_size=BATCH_SIZE)
+
+    # bulk_create 不触发 post_save，需要手动让搜索索引失效
+    search.invalidate(Testcase, project.id)
+    return {"total": len(records), "imported": len(valid), "failed": len(errors), "errors": errors}
+
+
+# ===================== 关键字导入 =====================
+def import_keywords(project, records: list, strict=False) -> dict:
+    errors = []
+    valid = []
+
+    names = {record.get('name') for record in records if isinstance(record, dict)}
+    existing_names = {
+        name
+        for chunk in _in_chunks(names)
+        for name in KeyWord.objects.filter(project=project, name__in=chunk).values_list('name', flat=True)
+    }
+    seen_names = set()
+
+    for index, record in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise ValidationError("Record must be an object")
+            for field in KEYWORD_REQUIRED_FIELDS:
+                if field not in record:
+                    raise ValidationError(f"Missing required field: {field}")
+            name = record['name']
+            if name in existing_names:
+                raise ValidationError(f"Keyword '{name}' already exists in project '{project.name}'")
+            if name in seen_names:
+                raise ValidationError(f"Duplicate keyword name in import: {name}")
+            _check_assertions(record.get('assertions', []), require_compared_value=False)
+
+            keyword = KeyWord(
+                name=name,
+                project=project,
+                project_keyword=f"{project.name}_{name}",
+                url=record['url'],
+                method=record['method'],
+                params=record['params'],
+                headers=record['headers'],
+                body_type=record['body_type'],
+                body=record['body'],
+            )
+            # url 与 create 接口保持一致不做格式校验（内网主机名等会被 URLValidator 拒绝）
+            keyword.clean_fields(exclude=['project', 'url'])
+        except (ValidationError, KeyError, TypeError, ValueError, AttributeError) as e:
+            errors.append({"index": index, "name": record.get('name') if isinstance(record, dict) else None,
+                           "error": _error_message(e)})
+            continue
+
+        seen_names.add(name)
+        valid.append((keyword, record.get('assertions', [])))
+
+    if strict and errors:
+        return {"total": len(records), "imported": 0, "failed": len(errors), "errors": errors}
+
+    with transaction.atomic(using=sharding.alias_for(project.id)):
+        cache.bump_project(project.id)
+        keywords = [keyword for keyword, _ in valid]
+        KeyWord.objects.bulk_create(keywords, batch_size=BATCH_SIZE)
+        if keywords and not _has_returning_ids(KeyWord):
+            ids = {}
+            for chunk in _in_chunks(kw.project_keyword for kw in keywords):
+                ids.update(KeyWord.objects.filter(project_keyword__in=chunk).values_list('project_keyword', 'id'))
+            for kw in keywords:
+                kw.id = ids[kw.project_keyword]
+
+        assertions = [
+            Assertion(
+                target_value=assertion_data['target_value'],
+                operator=assertion_data['operator'],
+                compared_value=assertion_data.get('compared_value'),
+                keyword=keyword,
+            )
+            for keyword, assertions_data in valid
+            for assertion_data in assertions_data or []
+        ]
+        Assertion.objects.bulk_create(assertions, batch_size=BATCH_SIZE)
+
+    search.invalidate(KeyWord, project.id)
+    return {"total": len(records), "imported": len(valid), "failed": len(errors), "errors": errors}
@@ -0,0 +1,266 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, close_old_connections, connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+"""
+run 的后台任务队列：run 请求带 queue=true 时只写一行 Job 并立即返回 job_id，由 manage.py run_workers 启动的
+worker 进程领取执行，结果照常写入 TestRun（run_results.py），show_job 查询进度。
+  - 领取：支持 SKIP LOCKED 的库（MySQL 8 / PostgreSQL）用 SELECT ... FOR UPDATE SKIP LOCKED，多个 worker 同时领取时
+    互相跳过已被锁住的行，不排队等锁；SQLite 没有行锁，先无锁读出候选，再以读到的状态为条件 UPDATE，影响 1 行才算领到
+  - 租约：领到的任务带 lease_owner / lease_expires_at，执行期间心跳线程每 lease/3 秒续租；worker 被 kill 或机器宕机后
+    租约过期，任务被其他 worker 重新领取（attempts + 1），超过 max_attempts 标记为 failed
+  - 结果只由持有租约的 worker 记录（所有状态更新都以 lease_owner + attempts 为条件）；租约被接管的那次执行不会覆盖任务状态
+    （它的 TestRun 照常保存），即同一任务至少执行一次、可能执行多次
+  - 扩容：worker 之间只通过数据库协调，在更多机器上启动 run_workers 即可
+"""
+
+logger = logging.getLogger('django')
+
+DEFAULT_LEASE = 60
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_MAX_ATTEMPTS = 3
+# 执行失败后的重试退避：第 n 次失败后等待 RETRY_DELAY * 2^(n-1) 秒
+RETRY_DELAY = 5
+# SQLite 领取时一次读出的候选数，前面的被别的 worker 抢走时依次尝试后面的
+CLAIM_CANDIDATES = 10
+ERROR_MAX_LENGTH = 4000
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def submit(project, parameters: dict, max_attempts=DEFAULT_MAX_ATTEMPTS) -> Job:
+    return Job.objects.create(project=project, parameters=parameters, max_attempts=max_attempts)
+
+
+# ===================== 领取 =====================
+def _claimable(now):
+    # 到期的排队任务，以及租约已过期（worker 已退出）的执行中任务
+    return Q(status="queued", available_at__lte=now) | Q(status="running", lease_expires_at__lt=now)
+
+
+def _transition(job: Job, owner: str, lease, now) -> dict:
+    """领取一个候选任务时要写入的字段；租约过期且已用完重试次数的任务直接标记失败"""
+    if job.status == "running" and job.attempts >= job.max_attempts:
+        return {
+            "status": "failed",
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "finished_at": now,
+            "error": f"lease of {job.lease_owner} expired after {job.attempts} attempts",
+        }
+    return {
+        "status": "running",
+        "attempts": job.attempts + 1,
+        "lease_owner": owner,
+        "lease_expires_at": now + timedelta(seconds=lease),
+        "heartbeat_at": now,
+        "started_at": now,
+    }
+
+
+def claim(owner: str, lease=DEFAULT_LEASE) -> Job | None:
+    using = router.db_for_write(Job)
+    if connections[using].features.has_select_for_update_skip_locked:
+        return _claim_skip_locked(using, owner, lease)
+    return _claim_compare_and_set(using, owner, lease)
+
+
+def _claim_skip_locked(using, owner, lease) -> Job | None:
+    while True:
+        now = timezone.now()
+        with transaction.atomic(using=using):
+            job = (
+                Job.objects.using(using)
+                .select_for_update(skip_locked=True)
+                .filter(_claimable(now))
+                .order_by("available_at", "id")
+                .first()
+            )
+            if job is None:
+                return None
+            changes = _transition(job, owner, lease, now)
+            for field, value in changes.items():
+                setattr(job, field, value)
+            job.save(using=using, update_fields=list(changes))
+        if job.status == "running":
+            return job
+
+
+def _claim_compare_and_set(using, owner, lease) -> Job | None:
+    now = timezone.now()
+    for job in Job.objects.using(using).filter(_claimable(now)).order_by("available_at", "id")[:CLAIM_CANDIDATES]:
+        changes = _transition(job, owner, lease, now)
+        # 条件包含读到的租约到期时间：读出之后被原 worker 续租过的任务不会被抢走
+        taken = Job.objects.using(using).filter(
+            id=job.id,
+            status=job.status,
+            attempts=job.attempts,
+            lease_expires_at=job.lease_expires_at,
+        ).update(**changes)
+        if not taken:
+            continue
+        for field, value in changes.items():
+            setattr(job, field, value)
+        if job.status == "running":
+            return job
+    return None
+
+
+# ===================== 租约 =====================
+def _owned(job: Job):
+    # 仍由本次领取持有的任务；租约被接管后 lease_owner / attempts 都会变化
+    return Job.objects.using(router.db_for_write(Job)).filter(
+        id=job.id, status="running", lease_owner=job.lease_owner, attempts=job.attempts)
+
+
+class Heartbeat(threading.Thread):
+    """执行期间定期续租；续租时发现租约已被接管则设置 lost 并停止"""
+
+    def __init__(self, job: Job, lease=DEFAULT_LEASE):
+        super().__init__(name=f"job-{job.id}-heartbeat", daemon=True)
+        self.job = job
+        self.lease = lease
+        self.lost = False
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            while not self._done.wait(self.lease / 3):
+                now = timezone.now()
+                try:
+                    renewed = _owned(self.job).update(heartbeat_at=now, lease_expires_at=now + timedelta(seconds=self.lease))
+                except DatabaseError:
+                    # 数据库暂时不可用：下次再试，租约过期前恢复即可
+                    logger.warning(f"job {self.job.id}: heartbeat failed", exc_info=True)
+                    continue
+                if not renewed:
+                    self.lost = True
+                    logger.warning(f"job {self.job.id}: lease of {self.job.lease_owner} was taken over")
+                    return
+        finally:
+            # 线程自己的数据库连接
+            connections.close_all()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def complete(job: Job, run) -> bool:
+    return bool(_owned(job).update(status="done", run=run, lease_expires_at=None, finished_at=timezone.now(), error=None))
+
+
+def fail(job: Job, error: str, retry=True) -> bool:
+    now = timezone.now()
+    if retry and job.attempts < job.max_attempts:
+        changes = {"status": "queued", "available_at": now + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))}
+    else:
+        changes = {"status": "failed", "finished_at": now}
+    return bool(_owned(job).update(lease_owner=None, lease_expires_at=None, error=error[-ERROR_MAX_LENGTH:], **changes))
+
+
+# ===================== worker =====================
+class Worker:
+    """
+    在一个进程里循环 领取 → 执行 → 记录结果；execute(job) 执行任务并返回保存的 TestRun。
+    SIGTERM 后不再领取新任务，当前任务执行完后返回。
+    ValidationError（参数错误、项目已删除等）不重试，其他异常按退避重试。
+    """
+
+    def __init__(self, execute, lease=DEFAULT_LEASE, poll_interval=DEFAULT_POLL_INTERVAL, max_jobs=None):
+        self.execute = execute
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_jobs = max_jobs
+        self._stopping = threading.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    def run(self, ready=None):
+        # fork 之后才能确定 pid
+        owner = worker_id()
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        if ready is not None:
+            ready()
+        processed = 0
+        try:
+            while not self._stopping.is_set():
+                close_old_connections()
+                try:
+                    job = claim(owner, self.lease)
+                except DatabaseError:
+                    logger.exception(f"job worker {owner}: claim failed")
+                    job = None
+                if job is None:
+                    self._stopping.wait(self.poll_interval)
+                    continue
+                self.process(job)
+                processed += 1
+                if self.max_jobs and processed >= self.max_jobs:
+                    return
+        finally:
+            connections.close_all()
+
+    def process(self, job: Job):
+        logger.info(f"job {job.id}: started by {job.lease_owner} (attempt {job.attempts}/{job.max_attempts})")
+        heartbeat = Heartbeat(job, self.lease)
+        heartbeat.start()
+        try:
+            run = self.execute(job)
+        except Exception as e:
+            heartbeat.stop()
+            recorded = fail(job, traceback.format_exc(), retry=not isinstance(e, ValidationError))
+            logger.warning(f"job {job.id}: attempt {job.attempts} failed: {e!r}")
+        else:
+            heartbeat.stop()
+            recorded = complete(job, run)
+            logger.info(f"job {job.id}: done, run {run.id if run else None}")
+        if not recorded:
+            logger.warning(f"job {job.id}: lease was taken over, attempt {job.attempts} is not recorded on the job")
+
+
+# ===================== 查询 =====================
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def job_data(job: Job) -> dict:
+    run = job.run
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "lease_owner": job.lease_owner,
+        "heartbeat_at": _iso(job.heartbeat_at),
+        "created_at": _iso(job.created_at),
+        "started_at": _iso(job.started_at),
+        "finished_at": _iso(job.finished_at),
+        "error": job.error,
+        "run_id": job.run_id,
+        "summary": None if run is None else {
+            "status": run.status,
+            "total": run.total,
+            "passed": run.passed,
+            "failed": run.failed,
+            "error": run.error,
+            "duration_ms": run.duration_ms,
+        },
+        "results": [] if run is None else list(
+            run.testcase_results.order_by("seq").values("testcase_id", "title", "name", "status", "duration_ms")
+        ),
+    }
@@ -0,0 +1,61 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from testplatform import benchmark
+
+
+class Command(BaseCommand):
+    help = ("在临时测试库里按指定规模造数，逐个计时 testcase / keyword / project 的每个 operate 与脚本生成器，"
+            "输出 p50/p95/p99、查询条数、峰值内存；--output 保存 JSON，--compare 与另一次结果对比")
+
+    def add_arguments(self, parser):
+        volumes = benchmark.DEFAULT_VOLUMES
+        parser.add_argument("--projects", type=int, default=volumes["projects"], help="项目数")
+        parser.add_argument("--testcases", type=int, default=volumes["testcases"], help="每个项目的用例数")
+        parser.add_argument("--steps", type=int, default=volumes["steps"], help="每个用例的步骤数")
+        parser.add_argument("--assertions", type=int, default=volumes["assertions"], help="每个步骤的断言数")
+        parser.add_argument("--keywords", type=int, default=volumes["keywords"], help="每个项目的关键字数")
+        parser.add_argument("--iterations", type=int, default=benchmark.DEFAULT_ITERATIONS, help="每项计时次数")
+        parser.add_argument("--warmup", type=int, default=benchmark.DEFAULT_WARMUP, help="每项预热次数（不计时）")
+        parser.add_argument("--only", nargs="+", help="只跑名称以这些前缀开头的项，如 testcase.show project")
+        parser.add_argument("--output", help="结果 JSON 的保存路径")
+        parser.add_argument("--compare", help="作为基线的另一份结果 JSON")
+        parser.add_argument("--threshold", type=float, default=benchmark.DEFAULT_THRESHOLD,
+                            help="p50 / p95 变慢超过该比例算退化，默认 0.2")
+        parser.add_argument("--fail-on-regression", action="store_true", help="有退化项时以非 0 退出（CI 使用）")
+        parser.add_argument("--keepdb", action="store_true", help="保留测试库（与 manage.py test --keepdb 相同）")
+
+    def handle(self, *args, **options):
+        volumes = {key: options[key] for key in benchmark.DEFAULT_VOLUMES}
+        if min(volumes.values()) < 1 or options["iterations"] < 1:
+            raise CommandError("volumes and --iterations must be at least 1")
+        baseline = benchmark.load(options["compare"]) if options["compare"] else None
+
+        self.stdout.write(f"Seeding {volumes} and timing {options['iterations']} iterations per operation ...")
+
+        def progress(name, result):
+            status = f"  {result['errors']} errors: {result.get('error')}" if result["errors"] else ""
+            self.stdout.write(f"  {name:<32} p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  "
+                              f"queries {result['queries']}{status}")
+
+        try:
+            report = benchmark.run(volumes, iterations=options["iterations"], warmup=options["warmup"],
+                                   only=options["only"], keepdb=options["keepdb"], progress=progress)
+        except (ValidationError, benchmark.BenchmarkError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write("")
+        self.stdout.write(benchmark.format_report(report))
+        if options["output"]:
+            benchmark.save(report, options["output"])
+            self.stdout.write(self.style.SUCCESS(f"Saved to {options['output']}"))
+
+        if baseline is None:
+            return
+        rows = benchmark.compare(baseline, report, threshold=options["threshold"])
+        self.stdout.write("")
+        self.stdout.write(f"Compared with {options['compare']} (commit {baseline['meta'].get('git_commit')}):")
+        self.stdout.write(benchmark.format_comparison(rows))
+        regressions = [row["name"] for row in rows if row["regression"]]
+        if regressions and options["fail_on_regression"]:
+            raise CommandError(f"{len(regressions)} regressions: {', '.join(regressions)}")
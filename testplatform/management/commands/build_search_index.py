@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.exceptions import ValidationError
+
+from testplatform import search
+
+
+class Command(BaseCommand):
+    help = "在 MySQL 上为用例（title/name/description）和关键字（name/url）建立 FULLTEXT ngram 索引"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default", help="数据库别名，默认 default")
+
+    def handle(self, *args, **options):
+        try:
+            created = search.create_fulltext_indexes(using=options["database"])
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+        if created:
+            self.stdout.write(self.style.SUCCESS(f"created: {', '.join(created)}"))
+        else:
+            self.stdout.write("all search indexes already exist")
@@ -0,0 +1,46 @@
+import json
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from testplatform import importer, sharding
+from testplatform.models import Project
+
+
+class Command(BaseCommand):
+    help = "从 JSON / JSON Lines / YAML 文件批量导入用例或关键字（格式同 create 接口的 parameters）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="导入文件路径")
+        parser.add_argument("--project", required=True, help="Project.name")
+        parser.add_argument("--type", choices=["testcase", "keyword"], default="testcase", help="导入对象，默认 testcase")
+        parser.add_argument("--format", choices=["json", "jsonl", "yaml"], help="文件格式，不传则按扩展名/内容判断")
+        parser.add_argument("--strict", action="store_true", help="有任何一条错误则整批不导入")
+
+    def handle(self, *args, **options):
+        path = Path(options["file"])
+        if not path.exists():
+            raise CommandError(f"File not found: {path}")
+        fmt = options["format"] or {".jsonl": "jsonl", ".yaml": "yaml", ".yml": "yaml", ".json": "json"}.get(path.suffix.lower())
+
+        project = Project.objects.filter(name=options["project"]).first()
+        if not project:
+            raise CommandError(f"Project '{options['project']}' not found")
+
+        try:
+            records = importer.parse_records(path.read_text(encoding="utf-8"), fmt)
+        except (ValidationError, ValueError) as e:
+            raise CommandError(f"Cannot parse {path}: {e}")
+
+        with sharding.use_project(project):
+            if options["type"] == "testcase":
+                summary = importer.import_testcases(project, records, strict=options["strict"])
+            else:
+                summary = importer.import_keywords(project, records, strict=options["strict"])
+
+        for error in summary["errors"]:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['imported']}/{summary['total']} imported, {summary['failed']} failed"
+        ))
@@ -0,0 +1,30 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from testplatform import sharding
+from testplatform.models import Project
+
+
+class Command(BaseCommand):
+    help = "把一个项目的用例 / 关键字 / 步骤 / 断言在线迁移到另一个分片（迁移期间该项目只读）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("project", help="Project.name")
+        parser.add_argument("target", help="目标分片的数据库别名，如 default / shard1")
+        parser.add_argument("--grace", type=float, default=2.0,
+                            help="标记迁移后等待在途写请求结束的秒数，默认 2")
+
+    def handle(self, *args, **options):
+        project = Project.objects.using(sharding.WRITER).filter(name=options["project"]).first()
+        if not project:
+            raise CommandError(f"Project '{options['project']}' not found")
+
+        source = sharding.alias_for(project.id)
+        self.stdout.write(f"Moving project '{project.name}' from '{source}' to '{options['target']}' ...")
+        try:
+            counts = sharding.move_project(project, options["target"], grace=options["grace"])
+        except ValidationError as e:
+            raise CommandError("; ".join(e.messages))
+        self.stdout.write(self.style.SUCCESS(json.dumps(counts, ensure_ascii=False)))
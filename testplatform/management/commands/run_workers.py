@@ -0,0 +1,53 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from testplatform import cache, jobs, views
+from utils import prefork_server
+
+
+class Command(BaseCommand):
+    help = ("启动 run 任务队列的 worker 进程：每个进程循环领取 queue=true 提交的任务并执行，按租约心跳；"
+            "主进程监管 worker，SIGTERM 等当前任务执行完后退出，SIGHUP 滚动重启 worker。可在多台机器上同时运行")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker 进程数，默认 CPU 核数")
+        parser.add_argument("--lease", type=float, default=jobs.DEFAULT_LEASE,
+                            help="租约秒数：worker 失联超过这个时间后任务由其他 worker 重新执行")
+        parser.add_argument("--poll-interval", type=float, default=jobs.DEFAULT_POLL_INTERVAL,
+                            help="队列为空时的轮询间隔秒数")
+        parser.add_argument("--graceful-timeout", type=float, default=600,
+                            help="停止 / 重启时等待当前任务执行完的最长秒数，超时强制结束（任务在租约过期后重新执行）")
+        parser.add_argument("--max-jobs", type=int, help="每个 worker 执行这么多个任务后退出并由主进程补齐（防止内存累积）")
+        parser.add_argument("--pid", help="主进程 pid 文件路径")
+
+    def handle(self, *args, **options):
+        if not hasattr(os, "fork"):
+            raise CommandError("run_workers requires os.fork (POSIX)")
+        if options["lease"] < 3 or options["poll_interval"] <= 0:
+            raise CommandError("--lease must be at least 3 and --poll-interval must be positive")
+        if not cache.is_shared():
+            # worker 与 API 服务不在同一个进程：服务端的写入必须能让 worker 里的缓存失效
+            raise CommandError(f"run_workers requires a cache shared with the API server, "
+                               f"but CACHES uses {settings.CACHES['default']['BACKEND']}")
+
+        def serve(sock, ready):
+            jobs.Worker(
+                views.execute_run_job,
+                lease=options["lease"],
+                poll_interval=options["poll_interval"],
+                max_jobs=options["max_jobs"],
+            ).run(ready)
+
+        # worker 各自建立数据库连接
+        connections.close_all()
+        self.stdout.write(f"Running {options['workers']} job workers, master pid {os.getpid()}")
+        prefork_server.run(
+            serve,
+            None,
+            options["workers"],
+            graceful_timeout=options["graceful_timeout"],
+            pidfile=options["pid"],
+        )
@@ -0,0 +1,113 @@
+import os
+import socket
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from testplatform import cache, metrics
+from utils import prefork_server
+
+
+class Command(BaseCommand):
+    help = ("生产环境启动：预加载应用后 fork 多个 worker 共用一个监听 socket；"
+            "SIGTERM 优雅退出，SIGHUP 滚动重启 worker，SIGUSR2 热升级（加载新代码）")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", default="0.0.0.0:8000", help="监听地址 host:port，默认 0.0.0.0:8000")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker 进程数，默认 CPU 核数")
+        parser.add_argument("--interface", choices=["wsgi", "asgi"], default="wsgi",
+                            help="wsgi：TestBench.wsgi + 多线程 worker；asgi：TestBench.asgi + uvicorn（异步视图）")
+        parser.add_argument("--graceful-timeout", type=float, default=prefork_server.DEFAULT_GRACEFUL_TIMEOUT,
+                            help="停止 / 重启时等待在途请求的最长秒数，超时强制结束 worker")
+        parser.add_argument("--keepalive", type=float, default=prefork_server.DEFAULT_KEEPALIVE,
+                            help="连接空闲超时秒数")
+        parser.add_argument("--threads", type=int, default=prefork_server.DEFAULT_THREADS,
+                            help="wsgi：每个 worker 的请求线程上限（keep-alive 的空闲连接也占一个线程）")
+        parser.add_argument("--backlog", type=int, default=prefork_server.BACKLOG, help="listen backlog")
+        parser.add_argument("--pid", help="主进程 pid 文件路径（start.sh 用它发送 SIGUSR2 升级）")
+        # 热升级时由旧主进程传入：继承的监听 socket 与就绪通知管道
+        parser.add_argument("--fd", type=int, help="(内部使用) 继承的监听 socket fd")
+        parser.add_argument("--ready-fd", type=int, help="(内部使用) 就绪后写入的管道 fd")
+
+    def handle(self, *args, **options):
+        if not hasattr(os, "fork"):
+            raise CommandError("serve requires os.fork (POSIX)")
+
+        if options["workers"] > 1 and not cache.is_shared():
+            # 进程内缓存的版本号只在本进程递增，其他 worker 的 LRU 永远不会失效
+            raise CommandError(f"--workers {options['workers']} requires a cache shared between processes, "
+                               f"but CACHES uses {settings.CACHES['default']['BACKEND']}; "
+                               "set TESTBENCH_REDIS_URL (or use the default file cache) or run with --workers 1")
+
+        interface = options["interface"]
+        if interface == "asgi":
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError("--interface asgi requires uvicorn, please `pip install uvicorn`")
+            # 与 TestBench/asgi.py 一致：ASGI 部署默认使用异步视图（settings 已加载，需在 URLconf 导入前设置）
+            settings.TESTBENCH_ASYNC_VIEWS = bool(os.environ.get("TESTBENCH_ASYNC_VIEWS", "1"))
+            from TestBench.asgi import application
+        else:
+            from TestBench.wsgi import application
+        application = prefork_server.preload(application)
+
+        if options["fd"] is not None:
+            sock = socket.socket(fileno=options["fd"])
+        else:
+            try:
+                sock = prefork_server.create_socket(options["bind"], options["backlog"])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"cannot listen on {options['bind']}: {e}")
+
+        # 各 worker 的指标快照目录：未配置时按监听地址取临时目录；冷启动清空，热升级（--fd）沿用旧进程的数据
+        if not settings.TESTBENCH_METRICS_DIR:
+            settings.TESTBENCH_METRICS_DIR = os.path.join(
+                tempfile.gettempdir(), "testbench-metrics-" + options["bind"].replace(":", "_").replace("/", "_"))
+        if options["fd"] is None:
+            metrics.reset_dir(settings.TESTBENCH_METRICS_DIR)
+        else:
+            os.makedirs(settings.TESTBENCH_METRICS_DIR, exist_ok=True)
+
+        keepalive = options["keepalive"]
+        graceful_timeout = options["graceful_timeout"]
+        threads = options["threads"]
+        if interface == "asgi":
+            def serve(sock, ready):
+                try:
+                    prefork_server.serve_asgi(application, sock, ready, keepalive=keepalive, graceful_timeout=graceful_timeout)
+                finally:
+                    metrics.flush_on_exit()
+        else:
+            def serve(sock, ready):
+                try:
+                    prefork_server.serve_wsgi(application, sock, ready, keepalive=keepalive, threads=threads)
+                finally:
+                    metrics.flush_on_exit()
+
+        upgrade_argv = [
+            sys.executable, os.path.abspath(sys.argv[0]), "serve",
+            "--bind", options["bind"],
+            "--workers", str(options["workers"]),
+            "--interface", interface,
+            "--graceful-timeout", str(graceful_timeout),
+            "--keepalive", str(keepalive),
+            "--threads", str(threads),
+            "--backlog", str(options["backlog"]),
+        ]
+        if options["pid"]:
+            upgrade_argv += ["--pid", options["pid"]]
+
+        self.stdout.write(f"Serving TestBench ({interface}) on {options['bind']} with {options['workers']} workers, "
+                          f"master pid {os.getpid()}")
+        prefork_server.run(
+            serve,
+            sock,
+            options["workers"],
+            graceful_timeout=graceful_timeout,
+            upgrade_argv=upgrade_argv,
+            pidfile=options["pid"],
+            ready_fd=options["ready_fd"],
+        )
@@ -0,0 +1,469 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+
+logger = logging.getLogger('django')
+
+"""
+按 接口 + operate 统计请求耗时，testcase / keyword / project 三个接口都是 POST 同一个 URL，只按 URL 统计区分不出具体操作。
+  - MetricsMiddleware：每个请求记录总耗时、数据库耗时、查询条数、响应字节数（流式响应在最后一块发送完后记录）
+  - 同一条 SQL（去掉字面量后的指纹）在一个请求里重复 N_PLUS_ONE_THRESHOLD 次以上视为 N+1，记 WARNING 并计数
+  - timed(name)：代码段计时（上下文管理器 / 装饰器），计入当前请求的 Server-Timing 和 tb_section_duration_seconds
+  - settings.TESTBENCH_SERVER_TIMING 打开时在响应头里返回 Server-Timing（浏览器开发者工具可直接查看）
+  - /testplatform/metrics/ 以 Prometheus 文本格式输出直方图与计数器
+指标保存在进程内；manage.py serve 多 worker 部署时每个进程定期把快照写到 TESTBENCH_METRICS_DIR，
+metrics 接口读取目录下所有进程的快照合并输出，任一 worker 响应抓取结果都一样。
+"""
+
+N_PLUS_ONE_THRESHOLD = getattr(settings, "TESTBENCH_METRICS_N_PLUS_ONE_THRESHOLD", 5)
+# 进程快照写入间隔（秒）
+FLUSH_INTERVAL = 5
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+
+# 带 operate 的接口（url_name）与 operate 取值白名单，标签取值固定，不会因为请求体内容膨胀
+OPERATE_ENDPOINTS = ("testcase", "keyword", "project")
+KNOWN_OPERATES = {
+    "create", "update", "delete", "show_all", "search", "show_testcase",
+    "testcase_detail", "run", "generate", "import", "rollup", "show_job",
+}
+_OPERATE_RE = re.compile(rb'"operate"\s*:\s*"([A-Za-z_]{1,32})"')
+# 只在请求体开头查找 operate，批量导入之类的大请求体不整体扫描
+_OPERATE_SCAN_BYTES = 65536
+
+
+# ===================== 指标存储 =====================
+class Registry:
+    """进程内的计数器与直方图：{指标名: {标签元组: 值}}，直方图的值为 [各桶计数..., sum, count]"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}
+        self.series = {}
+
+    def counter(self, name, help_text, labelnames):
+        self.meta[name] = ("counter", help_text, labelnames, None)
+        self.series[name] = {}
+
+    def histogram(self, name, help_text, labelnames, buckets):
+        self.meta[name] = ("histogram", help_text, labelnames, buckets)
+        self.series[name] = {}
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            series = self.series[name]
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self.meta[name][3]
+        with self.lock:
+            series = self.series[name]
+            row = series.get(labels)
+            if row is None:
+                row = series[labels] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                name: [[list(labels), value if isinstance(value, (int, float)) else list(value)]
+                       for labels, value in series.items()]
+                for name, series in self.series.items()
+            }
+
+    def render(self, snapshots) -> str:
+        """合并多个进程的快照，输出 Prometheus 文本格式（桶计数在这里才累加成 le 形式）"""
+        merged = {name: {} for name in self.meta}
+        for snapshot in snapshots:
+            for name, rows in snapshot.items():
+                if name not in merged:
+                    continue
+                target = merged[name]
+                for labels, value in rows:
+                    labels = tuple(labels)
+                    if isinstance(value, list):
+                        row = target.setdefault(labels, [0] * len(value))
+                        for i, v in enumerate(value):
+                            row[i] += v
+                    else:
+                        target[labels] = target.get(labels, 0) + value
+
+        lines = []
+        for name, (kind, help_text, labelnames, buckets) in self.meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(merged[name].items()):
+                pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, labels)]
+                if kind == "counter":
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    le = 'le="%s"' % _number(bound)
+                    lines.append(f"{name}_bucket{_labels(pairs + [le])} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{name}_bucket{_labels(pairs + [le])} {value[-1]}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-2])}")
+                lines.append(f"{name}_count{_labels(pairs)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+_REQUEST_LABELS = ("endpoint", "operate")
+registry.counter("tb_requests_total", "Requests by endpoint, operate and status code", _REQUEST_LABELS + ("status",))
+registry.histogram("tb_request_duration_seconds", "Wall time per request", _REQUEST_LABELS, LATENCY_BUCKETS)
+registry.histogram("tb_db_duration_seconds", "Time spent in SQL per request", _REQUEST_LABELS, LATENCY_BUCKETS)
+registry.histogram("tb_db_queries", "SQL queries per request", _REQUEST_LABELS, QUERY_BUCKETS)
+registry.histogram("tb_response_size_bytes", "Response body size", _REQUEST_LABELS, SIZE_BUCKETS)
+registry.counter("tb_duplicate_queries_total", "Queries repeating a fingerprint already seen in the same request",
+                 _REQUEST_LABELS)
+registry.counter("tb_n_plus_one_total", "Requests flagged as N+1", _REQUEST_LABELS)
+registry.histogram("tb_section_duration_seconds", "Time spent in metrics.timed() sections", ("section",),
+                   LATENCY_BUCKETS)
+
+
+# ===================== 单个请求的统计 =====================
+class RequestStats:
+    # parent：外层的统计（collect() 里再经过中间件时两层都要计入）
+    __slots__ = ("parent", "started", "db_time", "queries", "fingerprints", "sections", "response_bytes")
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = 0
+        self.fingerprints = Counter()
+        self.sections = {}
+        self.response_bytes = 0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def duplicates(self) -> int:
+        return sum(count - 1 for count in self.fingerprints.values())
+
+    def n_plus_one(self) -> list[tuple[str, int]]:
+        return [(fp, count) for fp, count in self.fingerprints.most_common()
+                if count >= N_PLUS_ONE_THRESHOLD and fp.startswith("SELECT")]
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("tb_metrics_request", default=None)
+
+_FINGERPRINT_SUBS = (
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s|\?"), "?"),
+    # IN (?, ?, ?) 的参数个数不同也算同一条语句
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?)"),
+    (re.compile(r"\s+"), " "),
+)
+
+
+def fingerprint(sql: str) -> str:
+    for pattern, repl in _FINGERPRINT_SUBS:
+        sql = pattern.sub(repl, sql)
+    return sql.strip()
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        fp = fingerprint(sql)
+        while stats is not None:
+            stats.db_time += elapsed
+            stats.queries += 1
+            stats.fingerprints[fp] += 1
+            stats = stats.parent
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    # 每个线程 / 每个库别名各有一个连接对象，建连时挂上计时 wrapper；请求归属由 contextvar 决定（sync_to_async 线程里同样可见）
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+def connect_signals():
+    from django.db.backends.signals import connection_created
+    connection_created.connect(_on_connection_created, dispatch_uid="tb_metrics_execute_wrapper")
+
+
+@contextmanager
+def collect():
+    """
+    在请求之外统计一段代码的查询：with metrics.collect() as stats: ...，之后读 stats.queries / db_time / fingerprints。
+    块内经过 MetricsMiddleware 的请求（测试客户端、benchmark 命令）同时计入请求自身和这里的 stats
+    """
+    stats = RequestStats(_current.get())
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """
+    代码段计时：with metrics.timed("search"): ... 或 @metrics.timed("load_plans")。
+    同一请求内同名代码段耗时累加，计入 Server-Timing；不在请求内（命令行、后台线程）只记直方图
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = _current.get()
+        if stats is not None:
+            stats.sections[name] = stats.sections.get(name, 0.0) + elapsed
+        registry.observe("tb_section_duration_seconds", (name,), elapsed)
+
+
+# ===================== 中间件 =====================
+def request_operate(request) -> str:
+    if request.method != "POST":
+        return request.method.lower()
+    match = _OPERATE_RE.search(request.body[:_OPERATE_SCAN_BYTES])
+    if match is None:
+        return "unknown"
+    operate = match.group(1).decode()
+    return operate if operate in KNOWN_OPERATES else "other"
+
+
+def _endpoint_labels(request) -> tuple[str, str]:
+    match = getattr(request, "resolver_match", None)
+    endpoint = match.url_name if match is not None and match.url_name else "other"
+    if endpoint not in OPERATE_ENDPOINTS:
+        return endpoint, ""
+    try:
+        return endpoint, request_operate(request)
+    except Exception:
+        # 请求体已被流式读取等情况
+        return endpoint, "unknown"
+
+
+class MetricsMiddleware:
+    """
+    放在 MIDDLEWARE 最前面，覆盖其余中间件和视图的耗时。
+    同时支持 WSGI 与 ASGI，异步视图经 sync_to_async 执行的查询也会计入本请求。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, "TESTBENCH_SERVER_TIMING", False)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats(_current.get())
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, stats, response)
+
+    async def __acall__(self, request):
+        stats = RequestStats(_current.get())
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, stats, response)
+
+    def _finish(self, request, stats, response):
+        labels = _endpoint_labels(request)
+        if self.server_timing:
+            response["Server-Timing"] = server_timing(stats)
+        if not response.streaming:
+            stats.response_bytes = len(response.content)
+            record(labels, response.status_code, stats)
+        elif response.is_async:
+            response.streaming_content = _astream(response.streaming_content, labels, response.status_code, stats)
+        else:
+            response.streaming_content = _stream(response.streaming_content, labels, response.status_code, stats)
+        return response
+
+
+def _stream(content, labels, status, stats):
+    # 流式响应的查询发生在逐块生成时：每取一块前后设置 / 还原 contextvar（同一帧内，不跨 yield）
+    iterator = iter(content)
+    try:
+        while True:
+            token = _current.set(stats)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                _current.reset(token)
+            stats.response_bytes += len(chunk)
+            yield chunk
+    finally:
+        record(labels, status, stats)
+
+
+async def _astream(content, labels, status, stats):
+    iterator = aiter(content)
+    try:
+        while True:
+            token = _current.set(stats)
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                break
+            finally:
+                _current.reset(token)
+            stats.response_bytes += len(chunk)
+            yield chunk
+    finally:
+        record(labels, status, stats)
+
+
+def server_timing(stats) -> str:
+    """视图返回时的耗时；流式响应之后生成的部分不在其中（响应头已经发出）"""
+    parts = [
+        f"total;dur={stats.elapsed() * 1000:.1f}",
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+    ]
+    parts += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stats.sections.items()]
+    for fp, count in stats.n_plus_one()[:1]:
+        desc = fp[:80].replace('"', "'").replace("\\", "")
+        parts.append(f'n_plus_one;desc="{count}x {desc}"')
+    return ", ".join(parts)
+
+
+def record(labels, status, stats):
+    elapsed = stats.elapsed()
+    registry.inc("tb_requests_total", labels + (str(status),))
+    registry.observe("tb_request_duration_seconds", labels, elapsed)
+    registry.observe("tb_db_duration_seconds", labels, stats.db_time)
+    registry.observe("tb_db_queries", labels, stats.queries)
+    registry.observe("tb_response_size_bytes", labels, stats.response_bytes)
+    duplicates = stats.duplicates()
+    if duplicates:
+        registry.inc("tb_duplicate_queries_total", labels, duplicates)
+    n_plus_one = stats.n_plus_one()
+    if n_plus_one:
+        registry.inc("tb_n_plus_one_total", labels)
+        fp, count = n_plus_one[0]
+        logger.warning(f"N+1 queries on {labels[0]}/{labels[1]}: {count}x {fp[:300]} "
+                       f"({stats.queries} queries, {stats.db_time * 1000:.1f}ms in db)")
+    _maybe_flush()
+
+
+# ===================== 多进程汇总 =====================
+_flush_state = {"at": 0.0}
+_flush_lock = threading.Lock()
+
+
+def _metrics_dir():
+    return getattr(settings, "TESTBENCH_METRICS_DIR", None)
+
+
+def _snapshot_path(directory, pid) -> str:
+    return os.path.join(directory, f"tb_metrics_{pid}.json")
+
+
+def _maybe_flush(force=False):
+    directory = _metrics_dir()
+    if not directory:
+        return
+    now = time.monotonic()
+    if not force and now - _flush_state["at"] < FLUSH_INTERVAL:
+        return
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        _flush_state["at"] = now
+        path = _snapshot_path(directory, os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"cannot write metrics snapshot to {directory}: {e}")
+    finally:
+        _flush_lock.release()
+
+
+def _snapshots() -> list[dict]:
+    """本进程的实时数据 + 目录下其他进程（含已退出 worker，计数器不能倒退）的快照"""
+    snapshots = [registry.snapshot()]
+    directory = _metrics_dir()
+    if not directory:
+        return snapshots
+    own = os.path.basename(_snapshot_path(directory, os.getpid()))
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return snapshots
+    for name in names:
+        if name == own or not (name.startswith("tb_metrics_") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def reset_dir(directory):
+    """manage.py serve 冷启动时清掉上一次运行留下的快照（热升级沿用，计数继续累加）"""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith("tb_metrics_"):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def flush_on_exit():
+    """worker 退出前调用，把最后一个刷新间隔内的数据写入快照"""
+    _maybe_flush(force=True)
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(_snapshots()), content_type="text/plain; version=0.0.4; charset=utf-8")
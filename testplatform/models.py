@@ -151,4 +151,139 @@ class Assertion(models.Model):
             raise ValidationError("Either 'keyword' or 'testcase_keyword' must be set.")
 
     def __str__(self):
-        return f"{self.target_value} {self.operator} {self.compared_value or ''}"
\ No newline at end of file
+        return f"{self.target_value} {self.operator} {self.compared_value or ''}"
+
+
+class ProjectShard(models.Model):
+    # 项目 → 分片（数据库别名）目录，只存放在 default 库；没有记录的项目在 default 分片
+    STATES = [
+        ("active", "正常"),
+        ("moving", "迁移中"),
+    ]
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, related_name='shard')
+    alias = models.CharField(max_length=50)
+    state = models.CharField(max_length=10, choices=STATES, default="active")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.project_id} -> {self.alias} ({self.state})"
+
+
+class TestRun(models.Model):
+    # 一次 run 操作的执行记录；结果只写 default 库，用例可能在其他分片，结果里只保存用例 id 与标题快照
+    STATUS = [
+        ("running", "执行中"),
+        ("passed", "通过"),
+        ("failed", "失败"),
+        ("error", "错误"),
+    ]
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='runs')
+    mode = models.CharField(max_length=20, default="thread")
+    status = models.CharField(max_length=10, choices=STATUS, default="running")
+    total = models.PositiveIntegerField(default=0)
+    passed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.PositiveIntegerField(default=0)
+    duration_ms = models.FloatField(null=True, blank=True)
+    started_at = models.DateTimeField(default=timezone.now, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"run {self.id} ({self.mode}, {self.status})"
+
+
+class TestcaseResult(models.Model):
+    run = models.ForeignKey(TestRun, on_delete=models.CASCADE, related_name='testcase_results')
+    # 在本次 run 内的序号：不支持 bulk_create 返回主键的数据库（MySQL）按 (run, seq) 取回 id
+    seq = models.PositiveIntegerField()
+    testcase_id = models.IntegerField()
+    title = models.CharField(max_length=50)
+    name = models.CharField(max_length=50)
+    status = models.CharField(max_length=10)
+    duration_ms = models.FloatField(null=True, blank=True)
+    finished_at = models.DateTimeField(default=timezone.now)
+    # mode=load 的压测报告（吞吐量、分位数、错误汇总），单次执行为 null
+    metrics = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('run', 'seq')
+        indexes = [models.Index(fields=['testcase_id', 'finished_at'])]
+
+    def __str__(self):
+        return f"{self.title} ({self.status})"
+
+
+class StepResult(models.Model):
+    testcase_result = models.ForeignKey(TestcaseResult, on_delete=models.CASCADE, related_name='step_results')
+    order = models.PositiveIntegerField()
+    keyword = models.CharField(max_length=100)
+    method = models.CharField(max_length=10)
+    url = models.URLField()
+    status = models.CharField(max_length=10)
+    status_code = models.IntegerField(null=True, blank=True)
+    duration_ms = models.FloatField(null=True, blank=True)
+    timing = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    assertions = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['order']
+
+    def __str__(self):
+        return f"{self.testcase_result_id} step {self.order} ({self.status})"
+
+
+class TestcaseDailyRollup(models.Model):
+    # 按 用例 + 天 汇总的结果，写入结果时增量更新；看板读这张表，不扫描原始结果
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='rollups')
+    testcase_id = models.IntegerField()
+    title = models.CharField(max_length=50)
+    day = models.DateField()
+    total = models.PositiveIntegerField(default=0)
+    passed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.PositiveIntegerField(default=0)
+    # 用例耗时直方图（utils.load_runner.LatencyHistogram.to_dict），可合并，分位数由它计算
+    durations = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('project', 'testcase_id', 'day')
+        indexes = [models.Index(fields=['project', 'day'])]
+
+    def __str__(self):
+        return f"{self.title} {self.day}: {self.passed}/{self.total}"
+
+
+class Job(models.Model):
+    # run 的后台任务队列（testplatform/jobs.py）：worker 进程按租约领取并定期心跳续租，租约过期视为 worker 已退出，任务重新领取
+    STATUS = [
+        ("queued", "排队中"),
+        ("running", "执行中"),
+        ("done", "已完成"),
+        ("failed", "失败"),
+    ]
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='jobs')
+    parameters = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS, default="queued")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # 排队中的任务到这个时间后才能被领取（失败重试的退避）
+    available_at = models.DateTimeField(default=timezone.now)
+    lease_owner = models.CharField(max_length=100, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    run = models.ForeignKey(TestRun, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+            models.Index(fields=['status', 'lease_expires_at']),
+        ]
+
+    def __str__(self):
+        return f"job {self.id} ({self.status}, attempt {self.attempts}/{self.max_attempts})"
@@ -0,0 +1,107 @@
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# 总数只用于前端展示"共 N 条"，允许短时间内不精确，换取不必每页都 COUNT(*) 全表
+COUNT_CACHE_TIMEOUT = 30
+
+"""
+show_all / search 的分页参数（均可选，不传 page_size 和 cursor 时保持原来的一次性全量返回）：
+{
+    "page_size": 100,        # 每页条数，最大 MAX_PAGE_SIZE
+    "cursor": 0,             # 上一页返回的 next_cursor，首页不传或传 0
+    "fields": ["title", "name"]   # 只返回这些字段
+}
+返回体中追加：
+"page": {"page_size": 100, "next_cursor": 1234, "has_more": true, "total": 40000}
+"""
+
+
+def get_fields(model, parameters):
+    # fields 投影：只允许模型上真实存在的字段名，避免把任意字符串拼进查询
+    fields = parameters.get("fields")
+    if not fields:
+        return None
+    if not isinstance(fields, list):
+        raise ValidationError("fields must be a list of field names")
+    valid = {f.name for f in model._meta.concrete_fields}
+    unknown = [f for f in fields if f not in valid]
+    if unknown:
+        raise ValidationError(f"Unknown fields for {model.__name__}: {unknown}")
+    return [f for f in fields if f != model._meta.pk.name]
+
+
+def _count_key(queryset) -> str:
+    return "tb:count:" + hashlib.md5(str(queryset.query).encode("utf-8")).hexdigest()
+
+
+def cached_count(queryset):
+    # 以 SQL 文本为 key 缓存 COUNT(*) 结果，同一筛选条件的翻页请求共用
+    return cache.get_or_set(_count_key(queryset), queryset.count, COUNT_CACHE_TIMEOUT)
+
+
+async def acached_count(queryset):
+    key = _count_key(queryset)
+    total = await cache.aget(key)
+    if total is None:
+        total = await queryset.acount()
+        await cache.aset(key, total, COUNT_CACHE_TIMEOUT)
+    return total
+
+
+def paginate(queryset, parameters):
+    """
+    基于 id 的游标（keyset）分页：WHERE id > cursor ORDER BY id LIMIT page_size + 1，
+    翻到再深的页也只走主键索引，不会像 OFFSET 那样越翻越慢。
+
+    返回 (当前页数据, 分页信息)；未传分页参数时返回 (原 queryset, None)
+    """
+    page_qs, page_size = _page_queryset(queryset, parameters)
+    if page_qs is None:
+        return queryset, None
+    rows = list(page_qs[:page_size + 1])
+    return _page(rows, page_size, cached_count(queryset))
+
+
+async def apaginate(queryset, parameters):
+    """paginate 的异步版本（异步 ORM）"""
+    page_qs, page_size = _page_queryset(queryset, parameters)
+    if page_qs is None:
+        return queryset, None
+    rows = [row async for row in page_qs[:page_size + 1]]
+    return _page(rows, page_size, await acached_count(queryset))
+
+
+def _page_queryset(queryset, parameters):
+    if "page_size" not in parameters and "cursor" not in parameters:
+        return None, None
+
+    try:
+        page_size = int(parameters.get("page_size") or DEFAULT_PAGE_SIZE)
+        cursor = int(parameters.get("cursor") or 0)
+    except (TypeError, ValueError):
+        raise ValidationError("page_size and cursor must be integers")
+    if page_size <= 0:
+        raise ValidationError("page_size must be a positive integer")
+    page_size = min(page_size, MAX_PAGE_SIZE)
+
+    fields = get_fields(queryset.model, parameters)
+    page_qs = queryset.filter(id__gt=cursor).order_by("id")
+    if fields:
+        page_qs = page_qs.only(*fields)
+    return page_qs, page_size
+
+
+def _page(rows, page_size, total):
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    page = {
+        "page_size": page_size,
+        "next_cursor": rows[-1].id if has_more else None,
+        "has_more": has_more,
+        "total": total,
+    }
+    return rows, page
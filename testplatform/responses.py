@@ -0,0 +1,151 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
+
+# 流式输出时每次从数据库游标取的行数，以及每次向客户端写出的行数
+ITERATOR_CHUNK_SIZE = 2000
+WRITE_BATCH_SIZE = 500
+
+_encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+
+def _serialized_fields(model, fields=None):
+    """
+    与 django.core.serializers 的 json 输出保持一致：只取本表字段（local_fields）中 serialize=True 的字段，
+    外键输出为 id（key 为字段名，取值用 attname），通过 through 表的多对多字段不输出。
+    返回 [(输出 key, values() 用的 attname), ...]
+    """
+    result = []
+    for field in model._meta.local_fields:
+        if not field.serialize:
+            continue
+        if fields is not None and field.name not in fields:
+            continue
+        result.append((field.name, field.attname))
+    return result
+
+
+def _row(label, pk, values, field_pairs) -> dict:
+    return {
+        "model": label,
+        "pk": pk,
+        "fields": {name: values[attname] for name, attname in field_pairs},
+    }
+
+
+def iter_rows(items, fields=None):
+    """
+    逐条产出与 serialize("json", ...) 中单个元素相同结构的 dict：
+      - QuerySet：直接 .values() + .iterator(chunk_size)，不构造模型实例，也不在内存里攒全量结果
+      - 模型实例列表（如分页结果）：按 attname 取值
+    """
+    if isinstance(items, QuerySet):
+        model = items.model
+        field_pairs = _serialized_fields(model, fields)
+        pk_attname = model._meta.pk.attname
+        label = model._meta.label_lower
+        attnames = [pk_attname] + [attname for _, attname in field_pairs]
+        for values in items.values(*attnames).iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+            yield _row(label, values[pk_attname], values, field_pairs)
+        return
+
+    for obj in items:
+        model = obj._meta.model
+        field_pairs = _serialized_fields(model, fields)
+        values = {attname: getattr(obj, attname) for _, attname in field_pairs}
+        yield _row(model._meta.label_lower, obj.pk, values, field_pairs)
+
+
+async def aiter_rows(items, fields=None):
+    """iter_rows 的异步版本：QuerySet 走 .aiterator()，事件循环不会被整段结果集的读取阻塞"""
+    if not isinstance(items, QuerySet):
+        for row in iter_rows(items, fields):
+            yield row
+        return
+    model = items.model
+    field_pairs = _serialized_fields(model, fields)
+    pk_attname = model._meta.pk.attname
+    label = model._meta.label_lower
+    attnames = [pk_attname] + [attname for _, attname in field_pairs]
+    async for values in items.values(*attnames).aiterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        yield _row(label, values[pk_attname], values, field_pairs)
+
+
+def _head(head: dict, key: str) -> bytes:
+    return (_encoder.encode(head)[:-1] + f', "{key}": [').encode("utf-8")
+
+
+def _batch(batch: list, first: bool) -> bytes:
+    return (("" if first else ",") + ",".join(batch)).encode("utf-8")
+
+
+def _tail(tail: dict) -> bytes:
+    suffix = "]"
+    if tail:
+        suffix += ", " + _encoder.encode(tail)[1:-1]
+    return (suffix + "}").encode("utf-8")
+
+
+def _iter_body(head: dict, key: str, items, fields, tail: dict):
+    # {"code": ..., "message": ..., "<key>": [ ...逐批写出... ], ...tail}
+    yield _head(head, key)
+    batch = []
+    first = True
+    for row in iter_rows(items, fields):
+        batch.append(_encoder.encode(row))
+        if len(batch) >= WRITE_BATCH_SIZE:
+            yield _batch(batch, first)
+            first = False
+            batch = []
+    if batch:
+        yield _batch(batch, first)
+    yield _tail(tail)
+
+
+async def _aiter_body(head: dict, key: str, items, fields, tail: dict):
+    yield _head(head, key)
+    batch = []
+    first = True
+    async for row in aiter_rows(items, fields):
+        batch.append(_encoder.encode(row))
+        if len(batch) >= WRITE_BATCH_SIZE:
+            yield _batch(batch, first)
+            first = False
+            batch = []
+    if batch:
+        yield _batch(batch, first)
+    yield _tail(tail)
+
+
+def model_list_response(key, items, code=200, message="", fields=None, extra=None, status=200, stream=False):
+    """
+    替代 JsonResponse({"code", "message", key: json.loads(serialize("json", items))}) 的三次序列化：
+    数据直接从 .values() 编码成字节，响应结构（model / pk / fields）不变。
+    stream=True 且 items 是未切片的 QuerySet（全量 show_all / search 等大结果）时走 StreamingHttpResponse，边读边写；
+    其余（分页结果、create/update 返回的单条记录）一次性拼好返回。
+    """
+    head = {"code": code, "message": message}
+    tail = extra or {}
+    body = _iter_body(head, key, items, fields, tail)
+    if stream and isinstance(items, QuerySet) and not items.query.is_sliced:
+        response = StreamingHttpResponse(body, content_type="application/json", status=status)
+    else:
+        response = HttpResponse(b"".join(body), content_type="application/json", status=status)
+    return response
+
+
+async def amodel_list_response(key, items, code=200, message="", fields=None, extra=None, status=200, stream=False):
+    """
+    model_list_response 的异步版本（异步视图使用）：QuerySet 通过异步 ORM 读取；
+    流式输出时 StreamingHttpResponse 使用异步迭代器，ASGI 下边读边写不占线程
+    """
+    head = {"code": code, "message": message}
+    body = _aiter_body(head, key, items, fields, extra or {})
+    if stream and isinstance(items, QuerySet) and not items.query.is_sliced:
+        return StreamingHttpResponse(body, content_type="application/json", status=status)
+    return HttpResponse(b"".join([chunk async for chunk in body]), content_type="application/json", status=status)
+
+
+def model_list_data(items, fields=None) -> list[dict]:
+    """需要把序列化结果嵌入其他结构时使用（与 json.loads(serialize(...)) 结果相同）"""
+    return list(iter_rows(items, fields))
@@ -0,0 +1,242 @@
+from django.db import OperationalError, connections, router, transaction
+from django.utils import timezone
+
+from .models import TestRun, TestcaseResult, StepResult, TestcaseDailyRollup
+from utils.load_runner import LatencyHistogram
+
+"""
+执行结果入库：run 结束后把 test_runner / async_runner / load_runner 返回的结果写入
+TestRun → TestcaseResult → StepResult，并增量更新按 用例 + 天 汇总的 TestcaseDailyRollup。
+  - ResultWriter 在内存里攒结果，攒够 BATCH_SIZE 个用例或 STEP_BATCH_SIZE 个步骤后在一个事务里 bulk_create 一批，
+    不逐行 insert；同一批在同一事务里合并进汇总表
+  - 汇总行按 (用例, 天) 排序逐行加锁，并发写入方按同一顺序拿锁；仍发生死锁时整批重试（见 update_rollups）
+  - 汇总表保存可合并的耗时直方图（LatencyHistogram.to_dict），通过率与分位数都从汇总行计算，看板不扫描原始结果
+  - mode=load 的结果（压测报告）保存在 TestcaseResult.metrics，不写步骤、不计入汇总（压测一次迭代的耗时与单次执行不可比）
+"""
+
+BATCH_SIZE = 200
+STEP_BATCH_SIZE = 1000
+# 一批结果因死锁被回滚后的重试次数
+DEADLOCK_RETRIES = 3
+ROLLUP_PERCENTILES = (50, 90, 99)
+
+
+def is_deadlock(exc: OperationalError) -> bool:
+    # MySQL 1213 ER_LOCK_DEADLOCK / PostgreSQL 40P01 deadlock_detected
+    code = exc.args[0] if exc.args else None
+    cause = exc.__cause__
+    return code == 1213 or getattr(cause, "pgcode", None) == "40P01" or getattr(cause, "sqlstate", None) == "40P01"
+
+
+def _run_status(summary: dict) -> str:
+    if summary["error"]:
+        return "error"
+    if summary["failed"]:
+        return "failed"
+    return "passed"
+
+
+# ===================== 写入 =====================
+class ResultWriter:
+    """
+    用法：
+        with ResultWriter(project, mode) as writer:
+            for result in results:
+                writer.add(result)
+            writer.finish(summary)
+    异常退出时已写入的批次保留，TestRun 标记为 error
+    """
+
+    def __init__(self, project, mode: str, batch_size=BATCH_SIZE, step_batch_size=STEP_BATCH_SIZE):
+        self.project = project
+        self.mode = mode
+        self.batch_size = batch_size
+        self.step_batch_size = step_batch_size
+        self.run = TestRun.objects.create(project=project, mode=mode)
+        self._pending: list[TestcaseResult] = []
+        self._pending_steps: list[list[dict]] = []
+        self._step_count = 0
+        self._seq = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.run.status == "running":
+            self.run.status = "error"
+            self.run.finished_at = timezone.now()
+            self.run.save(update_fields=["status", "finished_at"])
+        return False
+
+    def add(self, result: dict):
+        self._seq += 1
+        load = self.mode == "load"
+        self._pending.append(TestcaseResult(
+            run=self.run,
+            seq=self._seq,
+            testcase_id=result["testcase_id"],
+            title=result["title"],
+            name=result["name"],
+            status=result["status"],
+            duration_ms=result["duration_ms"],
+            finished_at=timezone.now(),
+            metrics={k: v for k, v in result.items() if k not in ("testcase_id", "title", "name", "status")} if load else None,
+        ))
+        steps = [] if load else result["steps"]
+        self._pending_steps.append(steps)
+        self._step_count += len(steps)
+        if len(self._pending) >= self.batch_size or self._step_count >= self.step_batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        rows, steps = self._pending, self._pending_steps
+        self._pending, self._pending_steps, self._step_count = [], [], 0
+
+        using = router.db_for_write(TestcaseResult)
+        for attempt in range(DEADLOCK_RETRIES + 1):
+            try:
+                self._write_batch(using, rows, steps)
+                return
+            except OperationalError as e:
+                # MySQL 死锁回滚的是整个事务：只有本批是最外层事务时才能重试
+                if attempt == DEADLOCK_RETRIES or not is_deadlock(e) or connections[using].in_atomic_block:
+                    raise
+                for row in rows:
+                    row.pk = None
+
+    def _write_batch(self, using, rows: list[TestcaseResult], steps: list[list[dict]]):
+        with transaction.atomic(using=using):
+            TestcaseResult.objects.bulk_create(rows)
+            self._fill_ids(rows)
+            StepResult.objects.bulk_create(
+                [
+                    StepResult(
+                        testcase_result=row,
+                        order=step["order"],
+                        keyword=step["keyword"],
+                        method=step["method"],
+                        url=step["url"],
+                        status=step["status"],
+                        status_code=step["status_code"],
+                        duration_ms=step["duration_ms"],
+                        timing=step.get("timing"),
+                        error=step["error"],
+                        assertions=step["assertions"],
+                    )
+                    for row, row_steps in zip(rows, steps)
+                    for step in row_steps
+                ],
+                batch_size=self.step_batch_size,
+            )
+            if self.mode != "load":
+                update_rollups(self.project, rows)
+
+    def _fill_ids(self, rows: list[TestcaseResult]):
+        # PostgreSQL / SQLite 3.35+ 的 bulk_create 会回填主键；MySQL 不会，按 (run, seq) 一次查回
+        if all(row.pk is not None for row in rows):
+            return
+        ids = dict(
+            TestcaseResult.objects.filter(run=self.run, seq__in=[row.seq for row in rows]).values_list("seq", "id")
+        )
+        for row in rows:
+            row.pk = ids[row.seq]
+
+    def finish(self, summary: dict) -> TestRun:
+        self.flush()
+        run = self.run
+        run.status = _run_status(summary)
+        run.total = summary["total"]
+        run.passed = summary["passed"]
+        run.failed = summary["failed"]
+        run.error = summary["error"]
+        run.duration_ms = summary["duration_ms"]
+        run.finished_at = timezone.now()
+        run.save(update_fields=["status", "total", "passed", "failed", "error", "duration_ms", "finished_at"])
+        return run
+
+
+def save_run(project, mode: str, results: list[dict], summary: dict) -> TestRun:
+    with ResultWriter(project, mode) as writer:
+        for result in results:
+            writer.add(result)
+        return writer.finish(summary)
+
+
+# ===================== 汇总表 =====================
+def _group_rollups(rows: list[TestcaseResult]) -> dict:
+    groups = {}
+    for row in rows:
+        key = (row.testcase_id, timezone.localdate(row.finished_at))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {"title": row.title, "passed": 0, "failed": 0, "error": 0,
+                                   "durations": LatencyHistogram()}
+        group["title"] = row.title
+        group[row.status] += 1
+        if row.duration_ms is not None:
+            group["durations"].record(row.duration_ms / 1000)
+    return groups
+
+
+def update_rollups(project, rows: list[TestcaseResult]):
+    """
+    把一批结果合并进汇总表（调用方在事务内）：
+      1. 缺少的汇总行先以空行插入，已存在的跳过（INSERT IGNORE / ON CONFLICT DO NOTHING），不需要先查再插；
+      2. 再按 (用例, 天) 排序，用唯一键等值查询逐行 select_for_update 后累加。
+    锁的都是已存在的记录（不做范围查询，MySQL 不加间隙锁），且所有写入方按同一顺序加锁，并发写入同一批用例时排队而不死锁；
+    仍然发生的死锁（例如与其他语句交错）由 ResultWriter.flush 整批重试
+    """
+    groups = _group_rollups(rows)
+    keys = sorted(groups)
+    TestcaseDailyRollup.objects.bulk_create(
+        [TestcaseDailyRollup(project=project, testcase_id=testcase_id, day=day, title=groups[testcase_id, day]["title"])
+         for testcase_id, day in keys],
+        ignore_conflicts=True,
+    )
+    for key in keys:
+        _merge_rollup(project, key, groups[key])
+
+
+def _merge_rollup(project, key: tuple, group: dict):
+    testcase_id, day = key
+    rollup = TestcaseDailyRollup.objects.select_for_update().get(project=project, testcase_id=testcase_id, day=day)
+    durations = LatencyHistogram.from_dict(rollup.durations)
+    durations.merge(group["durations"])
+    rollup.title = group["title"]
+    rollup.passed += group["passed"]
+    rollup.failed += group["failed"]
+    rollup.error += group["error"]
+    rollup.total = rollup.passed + rollup.failed + rollup.error
+    rollup.durations = durations.to_dict()
+    rollup.save(update_fields=["title", "total", "passed", "failed", "error", "durations", "updated_at"])
+
+
+# ===================== 读取 =====================
+def rollup_data(rollup: TestcaseDailyRollup) -> dict:
+    durations = LatencyHistogram.from_dict(rollup.durations)
+    percentiles = durations.percentiles(ROLLUP_PERCENTILES)
+    return {
+        "testcase_id": rollup.testcase_id,
+        "title": rollup.title,
+        "day": rollup.day.isoformat(),
+        "total": rollup.total,
+        "passed": rollup.passed,
+        "failed": rollup.failed,
+        "error": rollup.error,
+        "pass_rate": round(rollup.passed / rollup.total, 4) if rollup.total else None,
+        **{f"p{p}_ms": percentiles[p] for p in ROLLUP_PERCENTILES},
+        "max_ms": round(durations.max_us / 1000, 3) if durations.count else None,
+    }
+
+
+def rollups(project, titles=None, since=None, until=None) -> list[dict]:
+    qs = TestcaseDailyRollup.objects.filter(project=project).order_by("day", "title")
+    if titles:
+        qs = qs.filter(title__in=titles)
+    if since:
+        qs = qs.filter(day__gte=since)
+    if until:
+        qs = qs.filter(day__lte=until)
+    return [rollup_data(rollup) for rollup in qs]
@@ -0,0 +1,293 @@
+import re
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Testcase, KeyWord
+from . import cache, metrics
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, cached_count, acached_count
+
+"""
+用例 / 关键字的索引化搜索，替代 icontains 产生的 LIKE '%...%' 全表扫描：
+  - MySQL：FULLTEXT 索引 + ngram 分词器（中文标题无需空格分词），MATCH ... AGAINST 打分排序；
+    索引由 `python manage.py build_search_index` 创建
+  - 其他数据库（SQLite 本地开发）或 MySQL 尚未建索引：进程内 trigram 倒排索引，按项目懒加载，
+    写入时通过版本号失效（testplatform.cache 的共享版本号，多 worker 进程也能感知）。
+    索引只在进程内：每个 worker 各自保存一份（内存随 worker 数成倍增加），项目有写入后每个进程各自重建一次；
+    进程内最多保留 TESTBENCH_SEARCH_INDEX_CACHE_SIZE 个（项目, 模型）索引，按 LRU 淘汰
+两种方式都是子串匹配，与原 icontains 的结果一致：trigram / FULLTEXT 只用来缩小候选，候选再逐个核对是否包含查询串。
+结果按相关度排序，支持分页：page_size + cursor（cursor 为上一页返回的 next_cursor，即排名偏移量）
+"""
+
+# 每个模型参与搜索的字段，以及 MySQL 上对应的 FULLTEXT 索引名
+SEARCH_FIELDS = {
+    Testcase: ("title", "name", "description"),
+    KeyWord: ("name", "url"),
+}
+FULLTEXT_INDEX_NAMES = {
+    Testcase: "tb_testcase_fulltext",
+    KeyWord: "tb_keyword_fulltext",
+}
+NGRAM_SIZE = 3
+# MySQL ngram_token_size 默认值：更短的查询 FULLTEXT 查不到，改用 icontains
+MYSQL_NGRAM_TOKEN_SIZE = 2
+INDEX_CACHE_SIZE = getattr(settings, "TESTBENCH_SEARCH_INDEX_CACHE_SIZE", 64)
+# 字段之间的分隔符：归一化后的查询串里不会出现，查询不会跨字段匹配
+FIELD_SEPARATOR = "\n"
+
+
+# ===================== MySQL FULLTEXT =====================
+# 索引不存在时隔多少秒再查一次：build_search_index 建好索引后，运行中的 worker 不用重启也会切换过去
+FULLTEXT_RECHECK_SECONDS = 60
+# (alias, model) → 已建索引为 True；未建索引为下次重新检查的时刻（time.monotonic）
+_fulltext_ready = {}
+
+
+def fulltext_available(model) -> bool:
+    # 查 information_schema 的结果按 (alias, model) 缓存在进程内：已建索引一直有效，未建索引 FULLTEXT_RECHECK_SECONDS 秒后重查
+    alias = router.db_for_read(model)
+    connection = connections[alias]
+    if connection.vendor != "mysql":
+        return False
+    key = (alias, model)
+    state = _fulltext_ready.get(key)
+    if state is True:
+        return True
+    if state is not None and time.monotonic() < state:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+            [model._meta.db_table, FULLTEXT_INDEX_NAMES[model]],
+        )
+        ready = cursor.fetchone() is not None
+    _fulltext_ready[key] = True if ready else time.monotonic() + FULLTEXT_RECHECK_SECONDS
+    return ready
+
+
+def create_fulltext_indexes(using="default") -> list[str]:
+    """建立 FULLTEXT（ngram parser）索引，已存在则跳过；返回新建的索引名"""
+    connection = connections[using]
+    if connection.vendor != "mysql":
+        raise ValidationError("FULLTEXT ngram index is only supported on MySQL")
+    created = []
+    with connection.cursor() as cursor:
+        for model, fields in SEARCH_FIELDS.items():
+            index_name = FULLTEXT_INDEX_NAMES[model]
+            cursor.execute(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+                [model._meta.db_table, index_name],
+            )
+            if cursor.fetchone():
+                continue
+            columns = ", ".join(connection.ops.quote_name(f) for f in fields)
+            cursor.execute(
+                f"ALTER TABLE {connection.ops.quote_name(model._meta.db_table)} "
+                f"ADD FULLTEXT INDEX {connection.ops.quote_name(index_name)} ({columns}) WITH PARSER ngram"
+            )
+            created.append(index_name)
+    _fulltext_ready.clear()
+    return created
+
+
+def _fulltext_search(model, project, query):
+    query = str(query).strip()
+    fields = SEARCH_FIELDS[model]
+    # FULLTEXT 的 ngram 匹配只负责缩小候选，子串条件保证结果与 icontains 一致
+    contains = Q()
+    for field in fields:
+        contains |= Q(**{f"{field}__icontains": query})
+    qs = model.objects.filter(project=project).filter(contains)
+    phrase = query.replace('"', " ").strip()
+    if len(phrase) < MYSQL_NGRAM_TOKEN_SIZE:
+        return qs.order_by("id")
+    columns = ", ".join(fields)
+    return (
+        qs
+        .annotate(score=RawSQL(f"MATCH({columns}) AGAINST (%s IN BOOLEAN MODE)", (f'"{phrase}"',)))
+        .filter(score__gt=0)
+        .order_by("-score", "id")
+    )
+
+
+# ===================== 进程内 trigram 索引（SQLite / 兜底） =====================
+def _normalize(text) -> str:
+    return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+
+def _ngrams(text: str) -> set[str]:
+    if len(text) < NGRAM_SIZE:
+        return {text} if text else set()
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class TrigramIndex:
+    """一个项目、一个模型的倒排索引：trigram → {id}，以及 id → 归一化后的全文"""
+
+    def __init__(self, docs: dict[int, str]):
+        self.docs = docs
+        self.postings = defaultdict(set)
+        for pk, text in docs.items():
+            for gram in _ngrams(text):
+                self.postings[gram].add(pk)
+
+    def search(self, query: str) -> list[int]:
+        query = _normalize(query)
+        if not query:
+            return []
+        if len(query) < NGRAM_SIZE:
+            # 一两个字的查询（中文常见）没有 trigram 可用，直接在内存文本里做子串匹配
+            candidates = self.docs
+        else:
+            # 包含查询串的文档一定包含它的全部 trigram：从最短的倒排表开始求交集
+            postings = sorted((self.postings.get(gram, set()) for gram in _ngrams(query)), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+        # 交集只是必要条件（trigram 顺序 / 位置不同也会命中），逐个核对子串；匹配位置越靠前（标题优先）越相关
+        hits = [pk for pk in candidates if query in self.docs[pk]]
+        return sorted(hits, key=lambda pk: (self.docs[pk].find(query), pk))
+
+
+# (模型, 项目 id) → (版本号, 索引)
+_indexes = cache.LRUCache(INDEX_CACHE_SIZE)
+# 每个 (模型, 项目 id) 一把构建锁：同一个索引只构建一次，一个项目构建慢不阻塞其他项目的搜索；没有线程使用时随弱引用回收
+_build_locks = weakref.WeakValueDictionary()
+_build_locks_guard = threading.Lock()
+
+
+def _build_lock(key) -> threading.Lock:
+    with _build_locks_guard:
+        lock = _build_locks.get(key)
+        if lock is None:
+            lock = _build_locks[key] = threading.Lock()
+        return lock
+
+
+def _scope(model, project_id) -> str:
+    return f"search:{model._meta.label_lower}:{project_id}"
+
+
+def invalidate(model, project_id):
+    """
+    用例 / 关键字写入后调用（post_save / post_delete 信号已自动调用；bulk_create 等绕过信号的路径需手动调用）。
+    在事务内调用时提交后会再换一次版本号：提交前并发构建的索引（读不到未提交的写入）不会留在新版本下
+    """
+    cache.bump(_scope(model, project_id))
+
+
+def _trigram_index(model, project) -> TrigramIndex:
+    version = cache.version(_scope(model, project.id))
+    key = (model, project.id)
+    entry = _indexes.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    with _build_lock(key):
+        entry = _indexes.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        fields = SEARCH_FIELDS[model]
+        # 索引按版本号缓存，必须从写库构建，否则副本延迟期间的旧数据会一直留在新版本的索引里
+        docs = {
+            row[0]: FIELD_SEPARATOR.join(_normalize(v) for v in row[1:] if v)
+            for row in model.objects.using(router.db_for_write(model))
+            .filter(project=project).values_list("id", *fields).iterator()
+        }
+        index = TrigramIndex(docs)
+        _indexes.set(key, (version, index))
+        return index
+
+
+def _on_change(sender, instance, **kwargs):
+    invalidate(sender, instance.project_id)
+
+
+def connect_signals():
+    from django.db.models.signals import post_save, post_delete
+    for model in SEARCH_FIELDS:
+        post_save.connect(_on_change, sender=model, dispatch_uid=f"tb_search_{model.__name__}_save")
+        post_delete.connect(_on_change, sender=model, dispatch_uid=f"tb_search_{model.__name__}_delete")
+
+
+# ===================== 对外入口 =====================
+def _page_params(parameters):
+    try:
+        page_size = int(parameters.get("page_size") or 0)
+        offset = int(parameters.get("cursor") or 0)
+    except (TypeError, ValueError):
+        raise ValidationError("page_size and cursor must be integers")
+    if page_size < 0 or offset < 0:
+        raise ValidationError("page_size and cursor must not be negative")
+    return min(page_size, MAX_PAGE_SIZE), offset
+
+
+@metrics.timed("search")
+def search(model, project, query, parameters):
+    """
+    返回 (按相关度排序的模型实例列表, 分页信息)；没有命中时返回 ([], None)。
+    未传 page_size / cursor 时返回全部命中结果，page 为 None（与原接口行为一致）。
+    """
+    paged, page_size, offset = _page_args(parameters)
+
+    if fulltext_available(model):
+        qs = _fulltext_search(model, project, query)
+        total = cached_count(qs) if paged else None
+        rows = list(qs[offset:offset + page_size]) if paged else list(qs)
+    else:
+        ids, total = _ranked_ids(_trigram_index(model, project), query, paged, page_size, offset)
+        objects = model.objects.in_bulk(ids)
+        rows = [objects[pk] for pk in ids if pk in objects]
+    return _result(rows, paged, page_size, offset, total)
+
+
+async def asearch(model, project, query, parameters):
+    """search 的异步版本：取数走异步 ORM；查 information_schema 和构建 / 加锁读取 trigram 索引是同步逻辑，放到线程里"""
+    paged, page_size, offset = _page_args(parameters)
+
+    with metrics.timed("search"):
+        if await sync_to_async(fulltext_available)(model):
+            qs = _fulltext_search(model, project, query)
+            total = await acached_count(qs) if paged else None
+            rows = [row async for row in (qs[offset:offset + page_size] if paged else qs)]
+        else:
+            index = await sync_to_async(_trigram_index)(model, project)
+            ids, total = _ranked_ids(index, query, paged, page_size, offset)
+            objects = await model.objects.ain_bulk(ids)
+            rows = [objects[pk] for pk in ids if pk in objects]
+    return _result(rows, paged, page_size, offset, total)
+
+
+def _page_args(parameters):
+    paged = "page_size" in parameters or "cursor" in parameters
+    page_size, offset = _page_params(parameters)
+    if paged and not page_size:
+        page_size = DEFAULT_PAGE_SIZE
+    return paged, page_size, offset
+
+
+def _ranked_ids(index, query, paged, page_size, offset):
+    ids = index.search(query)
+    total = len(ids)
+    if paged:
+        ids = ids[offset:offset + page_size]
+    return ids, total
+
+
+def _result(rows, paged, page_size, offset, total):
+    if not paged:
+        return rows, None
+    has_more = offset + len(rows) < total
+    return rows, {
+        "page_size": page_size,
+        "next_cursor": offset + len(rows) if has_more else None,
+        "has_more": has_more,
+        "total": total,
+    }
@@ -0,0 +1,321 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .models import Project, ProjectShard, Testcase, KeyWord, TestCaseKeyword, Assertion
+from . import cache, search
+
+"""
+按项目分片：项目下的 Testcase / KeyWord / TestCaseKeyword / Assertion 存放在项目所属分片（数据库别名）上。
+  - 目录：ProjectShard（只在 default 库）记录 项目 → 分片 与迁移状态；没有记录的项目在 default
+  - Project 表以 default 为准（项目列表、按名称查找），项目所在的非 default 分片上保存一份同 id 的副本，供外键使用
+  - 路由：ShardRouter 排在 ReadWriteRouter 前面。视图按请求体里的 project_name 调用 activate()，
+    之后对上述模型的读写都发往该项目的分片；通过 project.testcases 等关联管理器访问时按实例所在分片路由。
+    项目在 default 分片时交给 ReadWriteRouter（可以读副本）
+  - 事务：写路径使用 transaction.atomic(using=alias_for(project.id))
+  - 迁移：move_project() / `python manage.py move_project`，见 move_project 的说明
+"""
+
+WRITER = DEFAULT_DB_ALIAS
+SHARDED_MODELS = (Testcase, KeyWord, TestCaseKeyword, Assertion)
+ACTIVE = "active"
+MOVING = "moving"
+BATCH_SIZE = 500
+# 目录在进程内的缓存时间（秒），过期后直接查 ProjectShard 表，不经过版本号缓存：
+# move_project 在另一个进程里运行，任何进程最多 DIRECTORY_TTL 秒后都会看到目录变化，不依赖缓存后端是否跨进程共享。
+# 迁移开始后等待的时间（move_project 的 grace）、切换分片后到清理源分片之间的等待都不小于这个值
+DIRECTORY_TTL = 1.0
+
+
+def shard_aliases() -> list[str]:
+    return [WRITER] + [alias for alias in getattr(settings, "TESTBENCH_DB_SHARDS", []) if alias in settings.DATABASES]
+
+
+def new_project_alias() -> str:
+    alias = getattr(settings, "TESTBENCH_NEW_PROJECT_SHARD", WRITER)
+    return alias if alias in shard_aliases() else WRITER
+
+
+# ===================== 目录 =====================
+_entries: dict[int, tuple[float, dict]] = {}
+_entries_lock = threading.Lock()
+
+
+def _load_entry(project_id) -> dict:
+    row = ProjectShard.objects.using(WRITER).filter(project_id=project_id).values("alias", "state").first()
+    return row or {"alias": WRITER, "state": ACTIVE}
+
+
+def directory_entry(project_id) -> dict:
+    """{"alias": 分片别名, "state": active / moving}"""
+    now = time.monotonic()
+    entry = _entries.get(project_id)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    value = _load_entry(project_id)
+    with _entries_lock:
+        _entries[project_id] = (now + DIRECTORY_TTL, value)
+    return value
+
+
+def alias_for(project_id) -> str:
+    return directory_entry(project_id)["alias"]
+
+
+def _set_entry(project, alias, state):
+    ProjectShard.objects.using(WRITER).update_or_create(project_id=project.id, defaults={"alias": alias, "state": state})
+    with _entries_lock:
+        _entries.pop(project.id, None)
+
+
+# ===================== 请求上下文 =====================
+_current_project = contextvars.ContextVar("tb_shard_project", default=None)
+
+
+def activate(project_name):
+    """视图解析出 project_name 后调用；项目不存在时不做处理，由后续逻辑报错"""
+    if not project_name:
+        return
+    try:
+        project = cache.get_project(project_name)
+    except ValidationError:
+        return
+    _current_project.set(project.id)
+
+
+async def aactivate(project_name):
+    """activate 的异步版本；顺带在线程里预热分片目录，之后路由通常直接命中进程内目录缓存"""
+    if not project_name:
+        return
+    try:
+        project = await cache.aget_project(project_name)
+    except ValidationError:
+        return
+    _current_project.set(project.id)
+    await sync_to_async(directory_entry)(project.id)
+
+
+@contextmanager
+def use_project(project):
+    """请求之外（管理命令、脚本）使用：块内对分片模型的访问发往该项目的分片"""
+    token = _current_project.set(project.id)
+    try:
+        yield alias_for(project.id)
+    finally:
+        _current_project.reset(token)
+
+
+class ShardContextMiddleware:
+    """每个请求在独立的 contextvars 上下文里执行，activate() 设置的项目不会带到同一线程处理的下一个请求"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return contextvars.copy_context().run(self.get_response, request)
+
+    async def __acall__(self, request):
+        # ASGI 下每个请求本来就运行在自己的 task（独立上下文）里
+        return await self.get_response(request)
+
+
+# ===================== Router =====================
+class ShardRouter:
+    def _project_id(self, hints):
+        instance = hints.get("instance")
+        if isinstance(instance, Project):
+            return instance.id
+        return _current_project.get()
+
+    def _alias(self, model, hints):
+        if model not in SHARDED_MODELS:
+            return None
+        instance = hints.get("instance")
+        if instance is not None and not isinstance(instance, Project) and instance._state.db:
+            return instance._state.db
+        project_id = self._project_id(hints)
+        if project_id is None:
+            return None
+        return alias_for(project_id)
+
+    def db_for_read(self, model, **hints):
+        alias = self._alias(model, hints)
+        # default 分片交给 ReadWriteRouter，以便使用读副本
+        return None if alias in (None, WRITER) else alias
+
+    def db_for_write(self, model, **hints):
+        if model in SHARDED_MODELS:
+            project_id = self._project_id(hints)
+            if project_id is not None and directory_entry(project_id)["state"] == MOVING:
+                raise ValidationError("Project is being moved to another shard, writes are temporarily disabled")
+        alias = self._alias(model, hints)
+        return None if alias in (None, WRITER) else alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if isinstance(obj1, Project) or isinstance(obj2, Project):
+            # Project 以 default 为准，项目所在分片上有同 id 副本
+            other = obj2 if isinstance(obj1, Project) else obj1
+            if isinstance(other, SHARDED_MODELS):
+                return True
+            return None
+        dbs = {obj1._state.db, obj2._state.db}
+        if len(dbs) > 1 and dbs & (set(shard_aliases()) - {WRITER}):
+            # 涉及非 default 分片的跨库关联
+            return False
+        return None
+
+
+# ===================== 项目增删改 =====================
+def place_project(project, alias=None):
+    """新建项目后调用：放到 TESTBENCH_NEW_PROJECT_SHARD（或指定分片）"""
+    alias = alias or new_project_alias()
+    if alias == WRITER:
+        return
+    Project.objects.using(alias).update_or_create(id=project.id, defaults={"name": project.name, "description": project.description})
+    _set_entry(project, alias, ACTIVE)
+
+
+def sync_project(project):
+    """项目改名 / 改描述后同步分片上的副本"""
+    alias = alias_for(project.id)
+    if alias != WRITER:
+        Project.objects.using(alias).filter(id=project.id).update(name=project.name, description=project.description)
+
+
+def drop_project(project):
+    """删除项目前调用：删掉分片上的副本（级联删除分片上的数据）"""
+    alias = alias_for(project.id)
+    if alias != WRITER:
+        Project.objects.using(alias).filter(id=project.id).delete()
+
+
+# ===================== 在线迁移 =====================
+def _clone(obj, **overrides):
+    model = type(obj)
+    data = {f.attname: getattr(obj, f.attname) for f in model._meta.concrete_fields if not f.primary_key}
+    data.update(overrides)
+    return model(**data)
+
+
+def _in_chunks(values, size=BATCH_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _copy_keywords(project, source, target, returning) -> dict[int, int]:
+    old = list(KeyWord.objects.using(source).filter(project_id=project.id).order_by("id"))
+    new = [_clone(kw) for kw in old]
+    KeyWord.objects.using(target).bulk_create(new, batch_size=BATCH_SIZE)
+    if not returning:
+        ids = dict(KeyWord.objects.using(target).filter(project_id=project.id).values_list("project_keyword", "id"))
+        for kw in new:
+            kw.id = ids[kw.project_keyword]
+    keyword_map = {o.id: n.id for o, n in zip(old, new)}
+
+    assertions = [
+        _clone(a, keyword_id=keyword_map[a.keyword_id])
+        for chunk in _in_chunks(keyword_map)
+        for a in Assertion.objects.using(source).filter(keyword_id__in=chunk).order_by("id")
+    ]
+    Assertion.objects.using(target).bulk_create(assertions, batch_size=BATCH_SIZE)
+    return keyword_map
+
+
+def _copy_testcases(chunk, source, target, keyword_map, returning) -> dict:
+    old_cases = list(Testcase.objects.using(source).filter(id__in=chunk).order_by("id"))
+    new_cases = [_clone(tc) for tc in old_cases]
+    Testcase.objects.using(target).bulk_create(new_cases, batch_size=BATCH_SIZE)
+    if not returning:
+        ids = dict(Testcase.objects.using(target)
+                   .filter(project_case__in=[tc.project_case for tc in new_cases])
+                   .values_list("project_case", "id"))
+        for tc in new_cases:
+            tc.id = ids[tc.project_case]
+    case_map = {o.id: n.id for o, n in zip(old_cases, new_cases)}
+
+    old_steps = list(TestCaseKeyword.objects.using(source).filter(test_case_id__in=chunk).order_by("test_case_id", "id"))
+    new_steps = [_clone(s, test_case_id=case_map[s.test_case_id], keyword_id=keyword_map[s.keyword_id]) for s in old_steps]
+    TestCaseKeyword.objects.using(target).bulk_create(new_steps, batch_size=BATCH_SIZE)
+    if new_steps and not returning:
+        # 步骤没有唯一键：新用例下只有刚插入的步骤，同一条 INSERT 分配的自增 id 递增，按 (用例, id) 排序即插入顺序
+        ids = list(TestCaseKeyword.objects.using(target)
+                   .filter(test_case_id__in=case_map.values())
+                   .order_by("test_case_id", "id").values_list("id", flat=True))
+        new_steps.sort(key=lambda s: s.test_case_id)
+        for step, pk in zip(new_steps, ids):
+            step.id = pk
+        old_steps.sort(key=lambda s: case_map[s.test_case_id])
+    step_map = {o.id: n.id for o, n in zip(old_steps, new_steps)}
+
+    assertions = [
+        _clone(a, testcase_keyword_id=step_map[a.testcase_keyword_id])
+        for step_chunk in _in_chunks(step_map)
+        for a in Assertion.objects.using(source).filter(testcase_keyword_id__in=step_chunk).order_by("id")
+    ]
+    Assertion.objects.using(target).bulk_create(assertions, batch_size=BATCH_SIZE)
+    return {"testcases": len(new_cases), "steps": len(new_steps), "assertions": len(assertions)}
+
+
+def _purge(project, alias):
+    if alias == WRITER:
+        Testcase.objects.using(alias).filter(project_id=project.id).delete()
+        KeyWord.objects.using(alias).filter(project_id=project.id).delete()
+    else:
+        Project.objects.using(alias).filter(id=project.id).delete()
+
+
+def move_project(project, target, grace=2.0) -> dict:
+    """
+    在线迁移一个项目到 target 分片：
+      1. 目录标记为 moving：该项目的写入被拒绝（报 ValidationError），读照常走源分片
+      2. 等待 grace 秒，让已经开始的写请求结束（需大于 DIRECTORY_TTL）
+      3. 在 target 的一个事务里复制项目副本、关键字、用例、步骤、断言（主键重新分配，外键按映射改写）
+      4. 目录切换到 target 并恢复 active，缓存 / 搜索索引失效
+      5. 再等待 DIRECTORY_TTL 秒（各进程都改读 target），删除源分片上的数据
+    复制失败时目录恢复为源分片 active，target 上的事务回滚。返回复制的行数
+    """
+    source = alias_for(project.id)
+    if target not in shard_aliases():
+        raise ValidationError(f"Unknown shard '{target}', available: {shard_aliases()}")
+    if target == source:
+        raise ValidationError(f"Project '{project.name}' is already on shard '{target}'")
+
+    _set_entry(project, source, MOVING)
+    time.sleep(max(grace, DIRECTORY_TTL))
+    returning = connections[target].features.can_return_rows_from_bulk_insert
+    try:
+        with transaction.atomic(using=target):
+            if target != WRITER:
+                Project.objects.using(target).update_or_create(
+                    id=project.id, defaults={"name": project.name, "description": project.description})
+            keyword_map = _copy_keywords(project, source, target, returning)
+            counts = {"keywords": len(keyword_map), "testcases": 0, "steps": 0, "assertions": 0}
+            case_ids = Testcase.objects.using(source).filter(project_id=project.id).order_by("id").values_list("id", flat=True)
+            for chunk in _in_chunks(case_ids):
+                for key, value in _copy_testcases(chunk, source, target, keyword_map, returning).items():
+                    counts[key] += value
+    except Exception:
+        _set_entry(project, source, ACTIVE)
+        raise
+
+    _set_entry(project, target, ACTIVE)
+    cache.bump_project(project.id)
+    search.invalidate(Testcase, project.id)
+    search.invalidate(KeyWord, project.id)
+    # 其他进程缓存的目录项（源分片）最多再用 DIRECTORY_TTL 秒，期间的读仍发往源分片，不能先清空
+    time.sleep(DIRECTORY_TTL)
+    _purge(project, source)
+    return counts
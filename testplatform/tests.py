@@ -1,3 +1,1489 @@
-from django.test import TestCase
+import asyncio
+import copy
+import json
+import logging
+import math
+import random
+import socket
+import subprocess
+import tempfile
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+from pathlib import Path
 
-# Create your tests here.
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from unittest import mock, skipUnless
+
+from . import async_views, cache, db_router, jobs, metrics, pagination, run_results, search, sharding, views
+from .models import Assertion, Job, KeyWord, Project, TestCaseKeyword, Testcase, TestcaseDailyRollup, TestcaseResult
+from utils import async_runner, custom_log_handler, load_runner, prefork_server, test_runner, test_script_generator
+from utils.test_script_generator import build_test_file_content, compile_target_value, parse_target_value
+
+"""
+单元测试：不依赖运行中的服务，TESTBENCH_DB_SQLITE=1 python manage.py test testplatform
+多进程用例在子进程里连上同一个测试库（settings 中 SQLite 测试库为文件）与同一个缓存
+"""
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+_CHILD_PRELUDE = """
+import json, os, sys
+sys.path.insert(0, {root!r})
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "TestBench.settings")
+import django
+django.setup()
+from django.conf import settings
+from django.db import OperationalError, connections
+settings.DATABASES.update(json.loads({extra!r}))
+settings.TESTBENCH_DB_SHARDS = json.loads({shards!r})
+for alias, name in json.loads({names!r}).items():
+    connections[alias].settings_dict["NAME"] = name
+"""
+# 测试里临时追加的数据库别名（见 add_test_database），子进程里同样注册
+_extra_databases: dict[str, dict] = {}
+
+
+def start_other_process(code: str) -> subprocess.Popen:
+    """在一个新的 Python 进程里执行 code（已 setup Django，并连到当前测试库）"""
+    names = json.dumps({conn.alias: str(conn.settings_dict["NAME"]) for conn in connections.all()})
+    source = _CHILD_PRELUDE.format(
+        root=str(PROJECT_ROOT),
+        extra=json.dumps(_extra_databases, default=str),
+        shards=json.dumps(list(settings.TESTBENCH_DB_SHARDS)),
+        names=names,
+    ) + code
+    return subprocess.Popen([sys.executable, "-c", source], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+def add_test_database(alias: str) -> None:
+    """追加一个与 default 同类型的测试库别名并建表（MIGRATION_MODULES 同 manage.py test），用完调用 remove_test_database"""
+    settings_dict = copy.deepcopy(connections[DEFAULT_DB_ALIAS].settings_dict)
+    if connections[DEFAULT_DB_ALIAS].vendor == "sqlite":
+        name = str(Path(tempfile.gettempdir()) / f"test_{alias}.sqlite3")
+    else:
+        name = f"{settings_dict['NAME']}_{alias}"
+    settings_dict["NAME"] = name
+    settings_dict["TEST"] = {**settings_dict["TEST"], "NAME": name, "MIRROR": None}
+    settings.DATABASES[alias] = _extra_databases[alias] = settings_dict
+    with override_settings(MIGRATION_MODULES={"testplatform": None}):
+        connections[alias].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+
+def remove_test_database(alias: str) -> None:
+    connection = connections[alias]
+    connection.creation.destroy_test_db(connection.settings_dict["NAME"], verbosity=0)
+    del connections[alias]
+    del settings.DATABASES[alias]
+    del _extra_databases[alias]
+
+
+def wait_other_process(proc: subprocess.Popen, timeout=60) -> str:
+    """等待子进程结束并返回标准输出，失败时抛出 AssertionError"""
+    stdout, stderr = proc.communicate(timeout=timeout)
+    if proc.returncode:
+        raise AssertionError(f"child process failed:\n{stderr}")
+    return stdout
+
+
+def run_in_other_process(code: str, timeout=60) -> str:
+    return wait_other_process(start_other_process(code), timeout)
+
+
+# ===================== 断言编译与判定 =====================
+def _response(status_code=200, body=b'{"data": [{"id": 7}], "message": "ok"}', headers=None):
+    return test_runner.StepResponse(status_code, headers or {"Content-Type": "application/json"}, body,
+                                    elapsed_ms=12.5, timing={"dns_ms": 1.0, "ttfb_ms": 8.0})
+
+
+def _evaluate(*assertions):
+    step = {"assertions": [test_runner._compile_assertion(*a) for a in assertions]}
+    return test_runner.evaluate_assertions(step, _response())
+
+
+class TargetValueTests(SimpleTestCase):
+    def test_parse_paths(self):
+        self.assertEqual(parse_target_value("${response}.code"), ("code", []))
+        self.assertEqual(parse_target_value("${response}.body"), ("body", []))
+        self.assertEqual(parse_target_value("${response}.body['data'][0]['id']"), ("body", ["data", 0, "id"]))
+        self.assertEqual(parse_target_value('${response}.body["data"][-1]'), ("body", ["data", -1]))
+        self.assertEqual(parse_target_value("${response}.headers['X-Id']"), ("headers", ["X-Id"]))
+        self.assertEqual(parse_target_value("response_time"), ("response_time", []))
+        self.assertEqual(parse_target_value("${response}.timing.ttfb"), ("timing", ["ttfb_ms"]))
+
+    def test_generated_expression_is_rebuilt_from_path(self):
+        self.assertEqual(compile_target_value('${response}.body["data"][0]'), "resp_body['data'][0]")
+        self.assertEqual(compile_target_value("${response}.headers['a']"), "resp.headers['a']")
+
+    def test_rejects_code_injection(self):
+        for target in [
+            "${response}.body or __import__('os').getpid()",
+            "${response}.body[__import__('os').getpid()]",
+            "${response}.body['a'].__class__",
+            "${response}.body.keys()",
+            "${response}.headers['a'](1)",
+            "${response}.body['a'] if True else 1",
+            "${response}.body[1:2]",
+            "${response}.body[True]",
+            "${response}.body\n['a']",
+            "${response}.bodyx",
+            "${response}.code + 1",
+        ]:
+            with self.subTest(target=target):
+                with self.assertRaises(ValueError):
+                    parse_target_value(target)
+                with self.assertRaises(ValueError):
+                    compile_target_value(target)
+                item = test_runner._compile_assertion(target, "equal", "1")
+                self.assertIsNotNone(item["error"])
+
+    def test_rejected_assertion_fails_without_evaluating(self):
+        result, = _evaluate(("${response}.body or __import__('os').getpid()", "equal", "1"))
+        self.assertFalse(result["passed"])
+        self.assertIsNone(result["actual"])
+        self.assertIn("Unsupported", result["message"])
+
+
+class EvaluateAssertionsTests(SimpleTestCase):
+    def test_operators(self):
+        results = _evaluate(
+            ("${response}.code", "equal", "200"),
+            ("${response}.code", "less_than", "300"),
+            ("${response}.body['data'][0]['id']", "greater_than", "6.5"),
+            ("${response}.body['message']", "equal_to", "ok"),
+            ("${response}.headers['Content-Type']", "contains", "json"),
+            ("response_time", "less_than", "100"),
+            ("${response}.timing.ttfb", "less_than", "10"),
+        )
+        self.assertEqual([r["passed"] for r in results], [True] * 7, results)
+        self.assertEqual(results[2]["actual"], 7)
+
+    def test_failures_are_reported(self):
+        wrong, missing, mistyped, bad_operator = _evaluate(
+            ("${response}.code", "equal", "201"),
+            ("${response}.body['nope']", "equal_to", "x"),
+            ("${response}.body['message']", "greater_than", "1"),
+            ("${response}.code", "matches", "1"),
+        )
+        self.assertEqual(wrong["message"], "assertion failed")
+        self.assertEqual(wrong["actual"], 200)
+        self.assertTrue(missing["message"].startswith("KeyError"))
+        self.assertTrue(mistyped["message"].startswith("TypeError"))
+        self.assertIn("Unsupported operator", bad_operator["message"])
+        self.assertFalse(any(r["passed"] for r in (wrong, missing, mistyped, bad_operator)))
+
+    def test_non_json_body(self):
+        step = {"assertions": [test_runner._compile_assertion("${response}.body['a']", "equal_to", "x")]}
+        result, = test_runner.evaluate_assertions(step, _response(body=b"<html>"))
+        self.assertIn("not JSON", result["message"])
+
+    def test_non_numeric_compared_value(self):
+        for value in ("abc", "nan", "inf", ""):
+            with self.subTest(value=value):
+                self.assertIsNotNone(test_runner._compile_assertion("${response}.code", "equal", value)["error"])
+
+
+class GeneratedScriptTests(SimpleTestCase):
+    def test_names_and_values_cannot_break_out_of_comments(self):
+        steps = [{
+            "url": "http://127.0.0.1/x",
+            "method": "GET",
+            "assertions": [{"target_py": "", "assert_line": "# ok"}],
+        }]
+        content = build_test_file_content("p\nimport os", "0001", "case\r\nos.system('id')", steps)
+        self.assertNotIn("\nimport os", content)
+        self.assertNotIn("\nos.system", content)
+        compile(content, "<generated>", "exec")
+
+
+# ===================== asyncio 模式的并发控制 =====================
+def _serve_http(delay: float) -> ThreadingHTTPServer:
+    """在后台线程启动一个本地 HTTP 服务，每个请求等待 delay 秒后返回 200"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _plan(testcase_id: int, url: str) -> dict:
+    step = {"order": 1, "keyword": "k", "method": "GET", "url": url, "headers": None, "params": None,
+            "body_type": "raw", "body_value": None, "assertions": []}
+    return {"testcase_id": testcase_id, "title": f"t{testcase_id}", "name": "n", "type": "api", "steps": [step]}
+
+
+@skipUnless(async_runner.aiohttp is not None, "needs aiohttp")
+class ConcurrencyLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.slow = _serve_http(0.5)
+        self.fast = _serve_http(0)
+        for server in (self.slow, self.fast):
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+
+    def test_slow_host_does_not_hold_global_slots(self):
+        slow_url = f"http://127.0.0.1:{self.slow.server_port}/"
+        fast_url = f"http://127.0.0.1:{self.fast.server_port}/"
+        # 慢 host 的用例排在前面；每 host 1 个名额，全局 2 个
+        plans = [_plan(i, slow_url) for i in range(4)] + [_plan(10 + i, fast_url) for i in range(4)]
+        results, summary = async_runner.run_plans(plans, global_limit=2, per_host_limit=1, timeout=10)
+
+        self.assertEqual([r["status"] for r in results], ["passed"] * 8, results)
+        slow, fast = results[:4], results[4:]
+        # 快 host 的用例不等慢 host：全部在第一个慢请求返回之前完成
+        self.assertLess(max(r["duration_ms"] for r in fast), 400, fast)
+        # 慢 host 仍按每 host 上限串行
+        self.assertGreaterEqual(max(r["duration_ms"] for r in slow), 4 * 500 * 0.9)
+
+    def test_unencodable_step_is_an_error_of_that_testcase(self):
+        fast_url = f"http://127.0.0.1:{self.fast.server_port}/"
+        bad_form, bad_json = _plan(1, fast_url), _plan(2, fast_url)
+        bad_form["steps"][0].update(body_type="application/x-www-form-urlencoded", body_value=[1, 2])
+        bad_json["steps"][0].update(body_value={1, 2})
+        results, summary = async_runner.run_plans([bad_form, bad_json, _plan(3, fast_url)], timeout=10)
+
+        self.assertEqual([r["status"] for r in results], ["error", "error", "passed"], results)
+        self.assertTrue(results[0]["steps"][0]["error"].startswith("TypeError"), results[0])
+        self.assertEqual((summary["error"], summary["passed"]), (2, 1))
+
+
+# ===================== 缓存失效 =====================
+@contextmanager
+def versions_expired():
+    """块内 testplatform.cache 看到的时间已超过进程内版本号的缓存时间：其他进程换过的版本号在块内生效"""
+    fake_time = mock.Mock(wraps=time)
+    fake_time.monotonic.return_value = time.monotonic() + cache.VERSION_TTL + 1
+    with mock.patch.object(cache, "time", fake_time):
+        yield
+
+
+@contextmanager
+def sticky_request():
+    """块内相当于处于读己之写窗口内的请求"""
+    token = db_router._request_state.set({"sticky": True, "wrote": False})
+    try:
+        yield
+    finally:
+        db_router._request_state.reset(token)
+
+
+class CacheInvalidationTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear_local()
+
+    @mock.patch.object(cache, "VERSION_TTL", 3600)
+    def test_write_in_other_process_invalidates_cache(self):
+        Project.objects.create(name="cache_p", description="old")
+        self.assertEqual(cache.get_project("cache_p").description, "old")
+        # 第二次读命中本进程 LRU，也不读共享缓存里的版本号
+        with self.assertNumQueries(0), mock.patch.object(cache.shared_cache, "get") as shared_get:
+            cache.get_project("cache_p")
+        shared_get.assert_not_called()
+
+        run_in_other_process(
+            "from testplatform.models import Project\n"
+            "project = Project.objects.get(name='cache_p')\n"
+            "project.description = 'new'\n"
+            "project.save()\n"
+        )
+        # 其他进程的写入在进程内版本号过期后生效；读己之写窗口内的请求立即生效
+        self.assertEqual(cache.get_project("cache_p").description, "old")
+        with sticky_request():
+            self.assertEqual(cache.get_project("cache_p").description, "new")
+        with versions_expired():
+            self.assertEqual(cache.get_project("cache_p").description, "new")
+
+    def test_bump_inside_transaction_invalidates_after_commit(self):
+        from django.db import transaction
+        project = Project.objects.create(name="cache_t", description="old")
+        cache.get_project("cache_t")
+        with transaction.atomic():
+            Project.objects.filter(id=project.id).update(description="new")
+            cache.bump_projects()
+            # 事务内的读只回源不回填
+            self.assertEqual(cache.get_project("cache_t").description, "new")
+        self.assertEqual(cache.get_project("cache_t").description, "new")
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_process_local_cache_refuses_multiple_processes(self):
+        self.assertFalse(cache.is_shared())
+        with self.assertRaisesMessage(CommandError, "shared between processes"):
+            call_command("serve", workers=2)
+        with self.assertRaisesMessage(CommandError, "shared with the API server"):
+            call_command("run_workers", workers=1)
+
+
+# ===================== 分片迁移 =====================
+_WRITER_LOOP = """
+import json, time
+from django.core.exceptions import ValidationError
+from testplatform import sharding
+from testplatform.models import KeyWord, Project
+project = Project.objects.get(name="move_p")
+created, rejected = [], 0
+deadline = time.time() + {seconds}
+while time.time() < deadline:
+    name = f"w{{len(created) + rejected}}"
+    try:
+        with sharding.use_project(project):
+            KeyWord.objects.create(project=project, name=name, url="http://127.0.0.1/", body_type="raw")
+        created.append(name)
+    except ValidationError:
+        rejected += 1
+    time.sleep(0.01)
+print(json.dumps({{"created": created, "rejected": rejected}}))
+"""
+
+
+class MoveProjectTests(TransactionTestCase):
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        # 没有配置第二个分片（TESTBENCH_DB_SQLITE_SHARDS / TESTBENCH_DB_SHARDS_HOSTS）时临时追加一个，默认的 manage.py test 也会运行
+        if len(sharding.shard_aliases()) < 2:
+            add_test_database("shard_move")
+            cls.addClassCleanup(remove_test_database, "shard_move")
+            cls.enterClassContext(override_settings(TESTBENCH_DB_SHARDS=["shard_move"]))
+        cls.target = sharding.shard_aliases()[1]
+        super().setUpClass()
+
+    def test_move_while_another_process_writes(self):
+        target = self.target
+        project = Project.objects.create(name="move_p")
+        with sharding.use_project(project):
+            KeyWord.objects.create(project=project, name="before", url="http://127.0.0.1/", body_type="raw")
+
+        writer = start_other_process(_WRITER_LOOP.format(seconds=6))
+        time.sleep(2)
+        sharding.move_project(project, target, grace=1.0)
+        result = json.loads(wait_other_process(writer))
+
+        # 迁移期间的写入被拒绝，其余写入一条不少地落在迁移后的分片上
+        self.assertGreater(result["rejected"], 0)
+        self.assertGreater(len(result["created"]), 0)
+        self.assertEqual(sharding.alias_for(project.id), target)
+        names = set(KeyWord.objects.using(target).filter(project_id=project.id).values_list("name", flat=True))
+        self.assertEqual(names, {"before", *result["created"]})
+        self.assertFalse(KeyWord.objects.using(sharding.WRITER).filter(project_id=project.id).exists())
+
+
+# ===================== 结果入库与每日汇总 =====================
+def _result(testcase_id: int, status="passed", duration_ms=10.0) -> dict:
+    return {"testcase_id": testcase_id, "title": f"t{testcase_id}", "name": "n", "status": status,
+            "duration_ms": duration_ms, "steps": []}
+
+
+def _summary(results: list[dict]) -> dict:
+    statuses = [r["status"] for r in results]
+    return {"total": len(results), "passed": statuses.count("passed"), "failed": statuses.count("failed"),
+            "error": statuses.count("error"), "duration_ms": 1.0}
+
+
+class RollupTests(TransactionTestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="rollup_p")
+
+    def _save(self, results, batch_size=run_results.BATCH_SIZE):
+        with run_results.ResultWriter(self.project, "thread", batch_size=batch_size) as writer:
+            for result in results:
+                writer.add(result)
+            return writer.finish(_summary(results))
+
+    def test_runs_merge_into_one_row_per_testcase_and_day(self):
+        self._save([_result(1), _result(2, "failed", 30.0), _result(1, "error", 20.0)], batch_size=2)
+        self._save([_result(1, duration_ms=40.0)])
+
+        rows = {row["testcase_id"]: row for row in run_results.rollups(self.project)}
+        self.assertEqual(TestcaseDailyRollup.objects.filter(project=self.project).count(), 2)
+        self.assertEqual((rows[1]["total"], rows[1]["passed"], rows[1]["error"]), (3, 2, 1))
+        self.assertEqual((rows[2]["total"], rows[2]["failed"]), (1, 1))
+        self.assertEqual(rows[1]["pass_rate"], round(2 / 3, 4))
+        self.assertAlmostEqual(rows[1]["max_ms"], 40.0, delta=1.0)
+        self.assertEqual(TestcaseDailyRollup.objects.get(testcase_id=1).durations["count"], 3)
+
+    def test_load_results_are_not_rolled_up(self):
+        run_results.save_run(self.project, "load", [_result(1)], _summary([_result(1)]))
+        self.assertFalse(TestcaseDailyRollup.objects.exists())
+
+    def test_deadlocked_batch_is_retried_once(self):
+        update_rollups = run_results.update_rollups
+        calls = []
+
+        def deadlock_once(project, rows):
+            calls.append(len(rows))
+            if len(calls) == 1:
+                raise OperationalError(1213, "Deadlock found when trying to get lock; try restarting transaction")
+            update_rollups(project, rows)
+
+        with mock.patch.object(run_results, "update_rollups", deadlock_once):
+            run = self._save([_result(1), _result(2)])
+
+        self.assertEqual(calls, [2, 2])
+        # 回滚的那次写入不留下任何行，重试只计一次
+        self.assertEqual(TestcaseResult.objects.filter(run=run).count(), 2)
+        self.assertEqual(sorted(TestcaseDailyRollup.objects.values_list("total", flat=True)), [1, 1])
+
+    def test_other_errors_are_not_retried(self):
+        with mock.patch.object(run_results, "update_rollups", side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                self._save([_result(1)])
+        self.assertFalse(TestcaseResult.objects.exists())
+
+
+# ===================== 批量导入的请求体上限 =====================
+class ImportRequestSizeTests(TestCase):
+    def setUp(self):
+        Project.objects.create(name="import_p")
+        cache.clear_local()
+
+    def _import(self, count: int, body_size: int):
+        records = [
+            {"name": f"k{i}", "url": "http://127.0.0.1/", "method": "POST", "params": {}, "headers": {},
+             "body_type": "raw", "body": "x" * body_size}
+            for i in range(count)
+        ]
+        body = json.dumps({"operate": "import", "project_name": "import_p", "parameters": {"records": records}})
+        return len(body), self.client.post("/testplatform/keyword/", body, content_type="application/json")
+
+    def test_import_larger_than_django_default_limit(self):
+        size, response = self._import(3000, 1000)
+        self.assertGreater(size, 2621440)
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        self.assertEqual(response.json()["imported"], 3000)
+        self.assertEqual(KeyWord.objects.filter(project__name="import_p").count(), 3000)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10_000)
+    def test_body_over_the_cap_is_rejected_with_413(self):
+        _, response = self._import(20, 1000)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("TESTBENCH_MAX_REQUEST_BYTES", response.json()["message"])
+        self.assertFalse(KeyWord.objects.filter(project__name="import_p").exists())
+
+
+# ===================== 搜索 =====================
+class TrigramIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = search.TrigramIndex({
+            1: "user login\nlogin with password",
+            2: "login user",
+            3: "logout\nuser",
+            4: "用户登录接口",
+            5: "order list",
+        })
+
+    def test_matches_substrings_only(self):
+        self.assertEqual(self.index.search("user login"), [1])
+        self.assertEqual(self.index.search("LOGIN"), [2, 1])
+        # 两个文档包含全部 trigram，但不包含查询串
+        self.assertEqual(self.index.search("login user x"), [])
+        self.assertEqual(self.index.search("log user"), [])
+
+    def test_does_not_match_across_fields(self):
+        self.assertEqual(self.index.search("logout user"), [])
+        self.assertEqual(self.index.search("out"), [3])
+
+    def test_short_queries(self):
+        self.assertEqual(self.index.search("登录"), [4])
+        self.assertEqual(self.index.search("  "), [])
+
+
+class SearchIndexCacheTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear_local()
+        search._indexes.clear()
+
+    def _titles(self, project, query):
+        rows, _ = search.search(Testcase, project, query, {})
+        return [row.title for row in rows]
+
+    def _create(self, project, title):
+        return Testcase.objects.create(project=project, title=title, name=title, level=1)
+
+    def test_write_in_other_process_invalidates_index(self):
+        project = Project.objects.create(name="search_p")
+        self._create(project, "login ok")
+        self.assertEqual(self._titles(project, "login"), ["login ok"])
+
+        run_in_other_process(
+            "from testplatform.models import Project, Testcase\n"
+            "project = Project.objects.get(name='search_p')\n"
+            "Testcase.objects.create(project=project, title='login fail', name='n', level=1)\n"
+        )
+        with versions_expired():
+            self.assertEqual(self._titles(project, "login"), ["login ok", "login fail"])
+
+    def test_indexes_are_bounded(self):
+        with mock.patch.object(search._indexes, "maxsize", 2):
+            for i in range(4):
+                project = Project.objects.create(name=f"search_{i}")
+                self._create(project, f"case {i}")
+                self.assertEqual(self._titles(project, "case"), [f"case {i}"])
+            self.assertEqual(len(search._indexes), 2)
+
+    def test_slow_build_does_not_block_other_projects(self):
+        slow, other = Project.objects.create(name="search_slow"), Project.objects.create(name="search_other")
+        self._create(other, "login ok")
+        build = search.TrigramIndex
+        started, release = threading.Event(), threading.Event()
+
+        def blocking_build(docs):
+            if threading.current_thread().name == "slow-build":
+                started.set()
+                release.wait(10)
+            return build(docs)
+
+        def in_thread(func):
+            # 线程自己的数据库连接用完关闭
+            def run():
+                try:
+                    func()
+                finally:
+                    connections.close_all()
+            return run
+
+        with mock.patch.object(search, "TrigramIndex", blocking_build):
+            slow_thread = threading.Thread(target=in_thread(lambda: search._trigram_index(Testcase, slow)),
+                                           name="slow-build")
+            slow_thread.start()
+            self.addCleanup(slow_thread.join)
+            self.addCleanup(release.set)
+            self.assertTrue(started.wait(10))
+            titles = []
+            other_thread = threading.Thread(target=in_thread(lambda: titles.extend(self._titles(other, "login"))))
+            other_thread.start()
+            other_thread.join(5)
+            self.assertFalse(other_thread.is_alive(), "search in another project waited for the slow build")
+            self.assertEqual(titles, ["login ok"])
+
+
+class FulltextDetectionTests(SimpleTestCase):
+    def setUp(self):
+        self.connection = mock.Mock(vendor="mysql")
+        alias = search.router.db_for_read(KeyWord)
+        patcher = mock.patch.object(search, "connections", {alias: self.connection})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        search._fulltext_ready.clear()
+        self.addCleanup(search._fulltext_ready.clear)
+
+    def _available(self, row):
+        self.connection.cursor.return_value = _FakeCursor(row)
+        return search.fulltext_available(KeyWord)
+
+    def test_missing_index_is_rechecked_after_the_ttl(self):
+        self.assertFalse(self._available(None))
+        # TTL 内不再查询
+        self.assertFalse(self._available((1,)))
+        self.assertEqual(self.connection.cursor.call_count, 1)
+
+        with mock.patch.object(search, "FULLTEXT_RECHECK_SECONDS", 0):
+            search._fulltext_ready.clear()
+            self.assertFalse(self._available(None))
+            # build_search_index 在别的进程建好索引后，过期即切换，之后不再查询
+            self.assertTrue(self._available((1,)))
+            self.assertTrue(self._available(None))
+        self.assertEqual(self.connection.cursor.call_count, 3)
+
+
+# ===================== 读己之写 =====================
+class ReadYourWritesTests(TransactionTestCase):
+    def setUp(self):
+        Project.objects.create(name="ryw_p")
+        cache.clear_local()
+
+    def _post(self, operate, parameters):
+        body = json.dumps({"operate": operate, "project_name": "ryw_p", "parameters": parameters})
+        return self.client.post("/testplatform/keyword/", body, content_type="application/json")
+
+    def _keyword(self, name, **extra):
+        return {"name": name, "url": "http://127.0.0.1/", "method": "GET", "params": {}, "headers": {},
+                "body_type": "raw", "body": "", **extra}
+
+    def test_reads_do_not_mark_writes(self):
+        for operate, parameters in [("show_all", {}), ("search", {"name": "k"}), ("show_all", {"page_size": 10})]:
+            with self.subTest(operate=operate):
+                response = self._post(operate, parameters)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn(db_router.STICKY_COOKIE, response.cookies)
+
+    def test_committed_writes_mark_the_session(self):
+        response = self._post("create", self._keyword("k1"))
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIn(db_router.STICKY_COOKIE, response.cookies)
+        # bulk_create 不发 post_save 信号，同样要记录
+        self.client.cookies.clear()
+        response = self._post("import", {"records": [self._keyword("k2"), self._keyword("k3")]})
+        self.assertEqual(response.json()["imported"], 2)
+        self.assertIn(db_router.STICKY_COOKIE, response.cookies)
+
+    def test_rolled_back_writes_do_not_mark(self):
+        response = self._post("create", self._keyword("k4", assertions=[{"target_value": "${response}.code"}]))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(KeyWord.objects.filter(name="k4").exists())
+        self.assertNotIn(db_router.STICKY_COOKIE, response.cookies)
+
+
+
+class _FakeCursor:
+    description = [("Seconds_Behind_Source",)]
+
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+
+    def fetchone(self):
+        return self.outcome
+
+
+class ReplicaLagTests(SimpleTestCase):
+    def setUp(self):
+        self.replica = mock.Mock(vendor="mysql")
+        patcher = mock.patch.object(db_router, "connections", {"replica1": self.replica})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(db_router._lag_unknown.clear)
+
+    def _measure(self, outcome):
+        self.replica.cursor.return_value = _FakeCursor(outcome)
+        return db_router._measure_lag("replica1")
+
+    def test_unreadable_lag_is_logged_once_until_it_recovers(self):
+        denied = OperationalError(1227, "Access denied; you need the REPLICATION CLIENT privilege")
+        with self.assertLogs("django", "WARNING") as logs:
+            self.assertIsNone(self._measure(denied))
+            self.assertIsNone(self._measure(denied))
+            self.assertEqual(self._measure((2,)), 2.0)
+            self.assertIsNone(self._measure((None,)))
+            self.assertIsNone(self._measure(None))
+        self.assertEqual(len(logs.records), 2, logs.output)
+        self.assertIn("REPLICATION CLIENT", logs.output[0])
+        self.assertIn("replication is not running", logs.output[1])
+
+# ===================== 脚本生成清单 =====================
+class ManifestAdoptionTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(test_script_generator, "CASEFILE_DIR", Path(tmp.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.project = Project.objects.create(name="gen_p")
+        self.project_dir = Path(tmp.name) / "gen_p"
+        self.project_dir.mkdir()
+
+    def _testcase(self, title, name):
+        return Testcase.objects.create(project=self.project, title=title, name=name, level=1)
+
+    def _files(self):
+        return sorted(p.name for p in self.project_dir.glob("test_*.py"))
+
+    def test_files_generated_without_manifest_are_adopted(self):
+        a = self._testcase("ta", "a")
+        b = self._testcase("tb", "b")
+        # 旧版本每次生成都分配新序号：a 生成过两次，gone 的用例已删除
+        for name in ("test_gen_p_0001_a.py", "test_gen_p_0002_b.py", "test_gen_p_0003_a.py", "test_gen_p_0004_gone.py"):
+            (self.project_dir / name).write_text("# old\n", encoding="utf-8")
+
+        result = test_script_generator.create_test_scripts("gen_p")
+        self.assertEqual(self._files(), ["test_gen_p_0002_b.py", "test_gen_p_0003_a.py"])
+        self.assertEqual(sorted(Path(p).name for p in result["removed"]), ["test_gen_p_0001_a.py", "test_gen_p_0004_gone.py"])
+        self.assertEqual(len(result["generated"]), 2)
+        self.assertIn("def test_gen_p_0003_a(", (self.project_dir / "test_gen_p_0003_a.py").read_text(encoding="utf-8"))
+        manifest = json.loads((self.project_dir / test_script_generator.MANIFEST_NAME).read_text(encoding="utf-8"))
+        self.assertEqual({k: v["seq"] for k, v in manifest["testcases"].items()}, {str(a.id): "0003", str(b.id): "0002"})
+
+        # 之后照常增量生成：内容没变不重写，新用例从最大序号之后分配
+        self._testcase("tc", "c")
+        result = test_script_generator.create_test_scripts("gen_p")
+        self.assertEqual([Path(p).name for p in result["generated"]], ["test_gen_p_0005_c.py"])
+        self.assertEqual(len(result["unchanged"]), 2)
+
+    def test_same_name_testcases_claim_separate_files(self):
+        self._testcase("t1", "same")
+        self._testcase("t2", "same")
+        for name in ("test_gen_p_0001_same.py", "test_gen_p_0002_same.py"):
+            (self.project_dir / name).write_text("# old\n", encoding="utf-8")
+
+        result = test_script_generator.create_test_scripts("gen_p")
+        self.assertEqual(self._files(), ["test_gen_p_0001_same.py", "test_gen_p_0002_same.py"])
+        self.assertEqual(result["removed"], [])
+
+    def test_partial_generate_keeps_unmatched_files_until_a_full_generate(self):
+        self._testcase("ta", "a")
+        self._testcase("tb", "b")
+        old = ["test_gen_p_0001_a.py", "test_gen_p_0002_b.py", "test_gen_p_0003_a.py", "test_gen_p_0004_gone.py"]
+        for name in old:
+            (self.project_dir / name).write_text("# old\n", encoding="utf-8")
+
+        # 只生成一个用例：没认领到的文件一个都不删，记为 orphans
+        path = test_script_generator.create_test_script("gen_p", "tb")
+        self.assertEqual(Path(path).name, "test_gen_p_0002_b.py")
+        result = test_script_generator.create_test_scripts("gen_p", ["ta"])
+        self.assertEqual(result["removed"], [])
+        self.assertEqual(self._files(), old)
+        manifest = json.loads((self.project_dir / test_script_generator.MANIFEST_NAME).read_text(encoding="utf-8"))
+        self.assertEqual(manifest["orphans"], ["test_gen_p_0001_a.py", "test_gen_p_0004_gone.py"])
+        self.assertEqual(manifest["next_seq"], 5)
+
+        result = test_script_generator.create_test_scripts("gen_p")
+        self.assertEqual(sorted(Path(p).name for p in result["removed"]), ["test_gen_p_0001_a.py", "test_gen_p_0004_gone.py"])
+        self.assertEqual(self._files(), ["test_gen_p_0002_b.py", "test_gen_p_0003_a.py"])
+        manifest = json.loads((self.project_dir / test_script_generator.MANIFEST_NAME).read_text(encoding="utf-8"))
+        self.assertNotIn("orphans", manifest)
+
+
+# ===================== 服务进程 =====================
+class WSGIWorkerThreadsTests(SimpleTestCase):
+    def test_concurrent_requests_are_capped(self):
+        lock = threading.Lock()
+        active = [0, 0]  # 当前并发数，最大并发数
+
+        def application(environ, start_response):
+            with lock:
+                active[0] += 1
+                active[1] = max(active[1], active[0])
+            time.sleep(0.2)
+            with lock:
+                active[0] -= 1
+            start_response("200 OK", [("Content-Length", "2")])
+            return [b"ok"]
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(16)
+        server = prefork_server.SharedSocketWSGIServer(sock, application, threads=2)
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        url = f"http://127.0.0.1:{sock.getsockname()[1]}/"
+        statuses = []
+
+        def get():
+            # urllib 每个请求都带 Connection: close，不占用 keep-alive 线程
+            from urllib.request import urlopen
+            with urlopen(url, timeout=10) as response:
+                statuses.append(response.status)
+
+        clients = [threading.Thread(target=get) for _ in range(6)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        self.assertEqual(statuses, [200] * 6)
+        self.assertEqual(active[1], 2)
+
+
+class AsyncViewThreadTests(SimpleTestCase):
+    def test_long_sync_call_does_not_block_others(self):
+        release = threading.Event()
+
+        def long_run():
+            # 模拟 mode=thread 的 run：等另一个请求执行后才结束
+            return release.wait(5)
+
+        def write():
+            release.set()
+            return "written"
+
+        async def main():
+            run = asyncio.ensure_future(async_views._in_thread(long_run)())
+            await asyncio.sleep(0.1)
+            written = await asyncio.wait_for(async_views._in_thread(write)(), 2)
+            return await run, written
+
+        self.assertEqual(asyncio.run(main()), (True, "written"))
+
+
+# ===================== 日志 =====================
+class QueuedLogHandlerTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.log_dir = Path(tmp.name)
+
+    def _handler(self, **kwargs):
+        handler = custom_log_handler.QueuedRotatingFileHandler("t", str(self.log_dir), encoding="utf-8", **kwargs)
+        handler.setFormatter(logging.Formatter("%(levelname)s | %(message)s"))
+        self.addCleanup(handler.close)
+        return handler
+
+    def _record(self, msg, *args, exc_info=None):
+        return logging.LogRecord("django", logging.ERROR, __file__, 1, msg, args, exc_info)
+
+    def _read(self, handler):
+        handler.flush()
+        return Path(handler.target.baseFilename).read_text(encoding="utf-8")
+
+    def test_record_is_formatted_in_the_calling_thread(self):
+        handler = self._handler()
+        handler.handle(self._record("warm up"))
+        handler.flush()
+        values = [1]
+        # 后台线程写不了文件时入队：之后参数再变化、异常已处理完，日志内容仍是记录时的样子
+        handler.target.acquire()
+        try:
+            try:
+                raise ValueError("boom")
+            except ValueError:
+                handler.handle(self._record("values %s", values, exc_info=sys.exc_info()))
+            values.append(2)
+        finally:
+            handler.target.release()
+        text = self._read(handler)
+        self.assertIn("ERROR | values [1]\nTraceback", text)
+        self.assertIn("ValueError: boom", text)
+        self.assertEqual(text.count("ERROR |"), 2)
+
+    def test_full_queue_drops_and_reports(self):
+        handler = self._handler(queue_size=2)
+        handler.handle(self._record("first"))
+        handler.flush()
+        # 每批 1 条：写线程最多取走 1 条后卡在文件锁上，队列容量 2，之后的记录被丢弃
+        handler.listener.batch_size = 1
+        handler.target.acquire()
+        try:
+            for i in range(10):
+                handler.handle(self._record(f"r{i}"))
+            self.assertGreaterEqual(handler.dropped, 1)
+        finally:
+            handler.target.release()
+        handler.flush()
+        handler.handle(self._record("after"))
+        text = self._read(handler)
+        self.assertIn("records dropped", text)
+        self.assertTrue(text.rstrip().endswith("after"))
+
+    def test_queued_records_are_written_in_batches(self):
+        handler = self._handler()
+        handler.handle(self._record("warm up"))
+        handler.flush()
+        with mock.patch.object(handler.target, "write_records", wraps=handler.target.write_records) as write_records:
+            handler.target.acquire()
+            try:
+                for i in range(50):
+                    handler.handle(self._record(f"r{i}"))
+            finally:
+                handler.target.release()
+            handler.flush()
+        # 卡住期间写线程最多拿着一批，其余的在下一批里一次写完
+        self.assertLessEqual(write_records.call_count, 2)
+        self.assertEqual(sum(len(call.args[0]) for call in write_records.call_args_list), 50)
+        self.assertEqual(self._read(handler).count("ERROR |"), 51)
+
+    def test_old_files_are_removed_by_timestamp(self):
+        now = datetime.now()
+        old = f"t_{(now - timedelta(days=31)).strftime(custom_log_handler.FILENAME_TIMESTAMP)}.log"
+        recent = f"t_{(now - timedelta(days=29)).strftime(custom_log_handler.FILENAME_TIMESTAMP)}.log"
+        other = f"tx_{(now - timedelta(days=90)).strftime(custom_log_handler.FILENAME_TIMESTAMP)}.log"
+        for name in (old, recent, other, "t_manual.log"):
+            (self.log_dir / name).write_text("", encoding="utf-8")
+        # 即使文件数远少于 30 个，超过 30 天的也删除
+        self._handler(retention_days=30)
+        names = {p.name for p in self.log_dir.iterdir()}
+        self.assertNotIn(old, names)
+        self.assertTrue({recent, other, "t_manual.log"} <= names)
+
+
+class LogPayloadTests(SimpleTestCase):
+    @override_settings(TESTBENCH_LOG_PAYLOAD_SAMPLE_RATE=1.0, TESTBENCH_LOG_PAYLOAD_MAX_BYTES=20)
+    def test_truncates_without_shared_state(self):
+        self.assertTrue(custom_log_handler.log_payload(b"x" * 100).endswith("<truncated, 100 bytes>"))
+        text = custom_log_handler.log_payload({"records": ["y" * 100] * 3})
+        self.assertLessEqual(len(text), 20 + len("...<truncated>"))
+        with override_settings(TESTBENCH_LOG_PAYLOAD_MAX_BYTES=1000):
+            self.assertIn("y" * 100, custom_log_handler.log_payload({"records": ["y" * 100]}))
+        # 上一次调用的限长不会留到下一次
+        self.assertLessEqual(len(custom_log_handler.log_payload({"records": ["y" * 100]})), 20 + len("...<truncated>"))
+
+
+# ===================== keyset 分页 =====================
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="page_p")
+        KeyWord.objects.bulk_create([
+            KeyWord(project=self.project, name=f"k{i:02d}", project_keyword=f"page_p_k{i:02d}", url="http://127.0.0.1/",
+                    body_type="raw")
+            for i in range(25)
+        ])
+        self.queryset = KeyWord.objects.filter(project=self.project)
+
+    def _walk(self, page_size, between_pages=None):
+        ids, cursor = [], 0
+        while True:
+            rows, page = pagination.paginate(self.queryset, {"page_size": page_size, "cursor": cursor})
+            ids.extend(row.id for row in rows)
+            if not page["has_more"]:
+                self.assertIsNone(page["next_cursor"])
+                return ids
+            cursor = page["next_cursor"]
+            if between_pages:
+                between_pages()
+                between_pages = None
+
+    def test_pages_cover_every_row_once_in_id_order(self):
+        all_ids = list(self.queryset.order_by("id").values_list("id", flat=True))
+        for page_size in (1, 7, 25, 100):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self._walk(page_size), all_ids)
+
+    def test_writes_between_pages_do_not_skip_or_repeat(self):
+        first_page = list(self.queryset.order_by("id").values_list("id", flat=True)[:10])
+
+        def write():
+            # 删掉已翻过的行、插入新行：OFFSET 分页会跳过或重复，游标不会
+            KeyWord.objects.filter(id__in=first_page[:5]).delete()
+            KeyWord.objects.create(project=self.project, name="new", url="http://127.0.0.1/", body_type="raw")
+
+        ids = self._walk(10, between_pages=write)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(ids[10:], list(self.queryset.filter(id__gt=first_page[-1]).order_by("id").values_list("id", flat=True)))
+
+    def test_each_page_is_one_query_once_the_total_is_cached(self):
+        pagination.paginate(self.queryset, {"page_size": 10})
+        with self.assertNumQueries(1):
+            rows, page = pagination.paginate(self.queryset, {"page_size": 10, "cursor": 0})
+        self.assertEqual((len(rows), page["total"]), (10, 25))
+
+    def test_parameters(self):
+        self.assertEqual(pagination.paginate(self.queryset, {}), (self.queryset, None))
+        _, page = pagination.paginate(self.queryset, {"page_size": 10 ** 6})
+        self.assertEqual(page["page_size"], pagination.MAX_PAGE_SIZE)
+        for parameters in ({"page_size": -1}, {"cursor": "x"}, {"page_size": 5, "fields": ["nope"]}, {"cursor": 0, "fields": "name"}):
+            with self.subTest(parameters=parameters):
+                with self.assertRaises(ValidationError):
+                    pagination.paginate(self.queryset, parameters)
+
+    def test_show_all_page_through_the_api(self):
+        body = json.dumps({"operate": "show_all", "project_name": "page_p",
+                           "parameters": {"page_size": 20, "fields": ["name"]}})
+        response = self.client.post("/testplatform/keyword/", body, content_type="application/json")
+        data = json.loads(response.getvalue())
+        self.assertEqual(len(data["keyword"]), 20)
+        self.assertEqual(set(data["keyword"][0]["fields"]), {"name"})
+        self.assertEqual(data["page"]["total"], 25)
+        self.assertTrue(data["page"]["has_more"])
+
+
+class UpdateTestcaseDiffTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="diff_p")
+        for name in ("login", "query", "logout"):
+            KeyWord.objects.create(project=self.project, name=name, url="http://127.0.0.1/", body_type="raw")
+        self.testcase = Testcase.objects.create(project=self.project, title="diff_case", name="diff", level=1)
+        self.keywords = [
+            {"name": "login", "order": 1, "url": "http://127.0.0.1/login", "method": "POST", "body_type": "raw",
+             "assertions": [{"target_value": "status_code", "operator": "==", "compared_value": 200}]},
+            {"name": "query", "order": 2, "url": "http://127.0.0.1/query", "method": "GET", "body_type": "raw",
+             "assertions": [{"target_value": "status_code", "operator": "==", "compared_value": 200},
+                            {"target_value": "body.data", "operator": "!=", "compared_value": "null"}]},
+        ]
+        self._update(self.keywords)
+
+    def _update(self, keywords):
+        views.update_testcase("diff_p", {"update_source_title": "diff_case", "keywords": json.loads(json.dumps(keywords))})
+
+    def _state(self):
+        steps = TestCaseKeyword.objects.filter(test_case=self.testcase).select_related("keyword").order_by("order")
+        return {
+            (step.keyword.name, step.order): (step.id, list(step.assertions.order_by("id").values_list("id", "compared_value")))
+            for step in steps
+        }
+
+    def _diff(self, keywords):
+        return views.diff_steps(self.project, self.testcase, json.loads(json.dumps(keywords)))
+
+    def test_unchanged_steps_produce_no_writes(self):
+        diff = self._diff(self.keywords)
+        self.assertEqual({key: value for key, value in diff.items() if key != "kept_step_ids" and value}, {})
+        before = self._state()
+        # 差量为空时步骤与断言表不产生任何语句，再次保存后 id 也都不变
+        with self.assertNumQueries(0):
+            views.apply_steps_diff(self.testcase, diff)
+        self._update(self.keywords)
+        self.assertEqual(self._state(), before)
+
+    def test_numeric_and_string_compared_values_are_equal(self):
+        keywords = json.loads(json.dumps(self.keywords))
+        keywords[0]["assertions"][0]["compared_value"] = "200"
+        self.assertEqual(self._diff(keywords)["update_assertions"], [])
+
+    def test_only_changed_rows_are_written(self):
+        before = self._state()
+        keywords = json.loads(json.dumps(self.keywords))
+        keywords[1]["method"] = "POST"
+        keywords[1]["assertions"][1]["compared_value"] = "[]"
+        diff = self._diff(keywords)
+        self.assertEqual([step.id for step in diff["update_steps"]], [before[("query", 2)][0]])
+        self.assertEqual([a.id for a in diff["update_assertions"]], [before[("query", 2)][1][1][0]])
+        self.assertEqual(diff["create_steps"] + diff["create_assertions"], [])
+        self.assertEqual(diff["delete_step_ids"] + diff["delete_assertion_ids"], [])
+
+        self._update(keywords)
+        after = self._state()
+        self.assertEqual(after[("login", 1)], before[("login", 1)])
+        self.assertEqual(after[("query", 2)][0], before[("query", 2)][0])
+        self.assertEqual([pk for pk, _ in after[("query", 2)][1]], [pk for pk, _ in before[("query", 2)][1]])
+        self.assertEqual(after[("query", 2)][1][1][1], "[]")
+        self.assertEqual(TestCaseKeyword.objects.get(id=before[("query", 2)][0]).method, "POST")
+
+    def test_added_and_removed_steps_and_assertions(self):
+        before = self._state()
+        keywords = json.loads(json.dumps(self.keywords))
+        # 删除 query 的第二条断言、删除 login 步骤、新增 logout 步骤（带一条断言）
+        keywords[1]["assertions"].pop()
+        keywords[0] = {"name": "logout", "order": 3, "url": "http://127.0.0.1/logout", "method": "POST", "body_type": "raw",
+                       "assertions": [{"target_value": "status_code", "operator": "==", "compared_value": 204}]}
+        self._update(keywords)
+        after = self._state()
+        self.assertEqual(set(after), {("query", 2), ("logout", 3)})
+        self.assertEqual(after[("query", 2)][0], before[("query", 2)][0])
+        self.assertEqual(after[("query", 2)][1], before[("query", 2)][1][:1])
+        self.assertEqual([value for _, value in after[("logout", 3)][1]], ["204"])
+        self.assertFalse(Assertion.objects.filter(id=before[("login", 1)][1][0][0]).exists())
+
+    def test_unknown_keyword_writes_nothing(self):
+        before = self._state()
+        keywords = self.keywords + [{"name": "missing", "order": 3, "url": "http://127.0.0.1/", "body_type": "raw"}]
+        with self.assertRaises(ValidationError):
+            self._update(keywords)
+        self.assertEqual(self._state(), before)
+
+
+class JobLeaseTests(TransactionTestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="job_p")
+
+    def _expire(self, job):
+        Job.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_claim_takes_each_job_once_until_the_lease_expires(self):
+        submitted = jobs.submit(self.project, {"testcases": []})
+        job = jobs.claim("a", lease=60)
+        self.assertEqual((job.id, job.status, job.attempts, job.lease_owner), (submitted.id, "running", 1, "a"))
+        self.assertIsNone(jobs.claim("b", lease=60))
+
+        self._expire(job)
+        taken = jobs.claim("b", lease=60)
+        self.assertEqual((taken.id, taken.attempts, taken.lease_owner), (job.id, 2, "b"))
+        # 原 worker 的结果不再记录，只有接管者能结束任务
+        self.assertFalse(jobs.complete(job, None))
+        self.assertFalse(jobs.fail(job, "late"))
+        self.assertTrue(jobs.complete(taken, None))
+        self.assertEqual(Job.objects.get(id=job.id).status, "done")
+
+    def test_expired_lease_after_max_attempts_fails_the_job(self):
+        job = jobs.submit(self.project, {}, max_attempts=1)
+        jobs.claim("a", lease=60)
+        self._expire(job)
+        self.assertIsNone(jobs.claim("b", lease=60))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.lease_owner), ("failed", 1, None))
+        self.assertIn("expired after 1 attempts", job.error)
+
+    def test_fail_retries_with_backoff_until_max_attempts(self):
+        job = jobs.submit(self.project, {}, max_attempts=3)
+        for attempt in (1, 2):
+            claimed = jobs.claim("a", lease=60)
+            self.assertEqual(claimed.attempts, attempt)
+            before = timezone.now()
+            self.assertTrue(jobs.fail(claimed, "boom"))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.lease_owner), ("queued", None))
+            delay = (job.available_at - before).total_seconds()
+            self.assertAlmostEqual(delay, jobs.RETRY_DELAY * 2 ** (attempt - 1), delta=1)
+            # 退避期间不会被领取
+            self.assertIsNone(jobs.claim("a", lease=60))
+            Job.objects.filter(id=job.id).update(available_at=before)
+        claimed = jobs.claim("a", lease=60)
+        self.assertTrue(jobs.fail(claimed, "boom"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 3))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_heartbeat_renews_and_detects_takeover(self):
+        jobs.submit(self.project, {})
+        job = jobs.claim("a", lease=0.6)
+        heartbeat = jobs.Heartbeat(job, lease=0.6)
+        heartbeat.start()
+        try:
+            time.sleep(0.9)
+            # 续租过的任务没有过期，不会被接管
+            self.assertIsNone(jobs.claim("b", lease=60))
+            self.assertFalse(heartbeat.lost)
+            self._expire(job)
+            self.assertEqual(jobs.claim("b", lease=60).lease_owner, "b")
+            deadline = time.monotonic() + 5
+            while not heartbeat.lost and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertTrue(heartbeat.lost)
+        finally:
+            heartbeat.stop()
+        self.assertEqual(Job.objects.get(id=job.id).lease_owner, "b")
+
+    def test_worker_does_not_retry_validation_errors(self):
+        def execute(job):
+            raise ValidationError("project deleted")
+
+        job = jobs.submit(self.project, {})
+        jobs.Worker(execute).process(jobs.claim("a"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 1))
+        self.assertIn("project deleted", job.error)
+
+    def test_worker_retries_other_errors(self):
+        def execute(job):
+            raise RuntimeError("connection reset")
+
+        job = jobs.submit(self.project, {})
+        jobs.Worker(execute).process(jobs.claim("a"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.lease_owner), ("queued", 1, None))
+        self.assertIn("connection reset", job.error)
+
+
+# ===================== 压测 =====================
+def _exact_percentile(values_ms: list[float], p: float) -> float:
+    ordered = sorted(values_ms)
+    return ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1]
+
+
+def _load_plan(url: str, stats_assertions=(), assertions=()) -> dict:
+    plan = _plan(1, url)
+    plan["type"] = load_runner.PERFORMANCE_TYPE
+    plan["steps"][0]["assertions"] = [test_runner._compile_assertion(*a) for a in assertions]
+    plan["steps"][0]["stats_assertions"] = [test_runner._compile_stats_assertion(*a) for a in stats_assertions]
+    return plan
+
+
+def _profile(**parameters) -> dict:
+    return load_runner.load_profile({"timeout": 10, **parameters})
+
+
+class LatencyHistogramTests(SimpleTestCase):
+    Hist = load_runner.LatencyHistogram
+
+    def test_buckets_are_contiguous_and_narrow(self):
+        previous_high = -1
+        for index in range(self.Hist.SIZE):
+            low, high = self.Hist._bounds(index)
+            self.assertEqual(low, previous_high + 1, index)
+            if low >= self.Hist.LINEAR_LIMIT:
+                self.assertLessEqual((high - low + 1) / low, 1 / 64, index)
+            previous_high = high
+        self.assertGreaterEqual(previous_high, self.Hist.MAX_US)
+
+    def test_index_and_bounds_agree(self):
+        values = list(range(300)) + [2 ** n + d for n in range(7, 32) for d in (-1, 0, 1)] + [self.Hist.MAX_US]
+        for value in values:
+            index = self.Hist._index(value)
+            low, high = self.Hist._bounds(index)
+            self.assertTrue(low <= value <= high, (value, index, low, high))
+            self.assertLess(index, self.Hist.SIZE)
+
+    def _assert_percentiles(self, samples_s: list[float]):
+        hist = self.Hist()
+        for seconds in samples_s:
+            hist.record(seconds)
+        # 与直方图相同的截断（整微秒），再按 nearest-rank 精确计算
+        values_ms = [int(seconds * 1_000_000) / 1000 for seconds in samples_s]
+        got = hist.percentiles([50, 90, 99, 99.9, 100])
+        for p, value in got.items():
+            exact = _exact_percentile(values_ms, p)
+            self.assertLessEqual(abs(value - exact), exact / 64 + 0.001, (p, value, exact))
+        self.assertEqual(hist.summary()["max_ms"], max(values_ms))
+        self.assertEqual(hist.summary()["min_ms"], min(values_ms))
+        return hist
+
+    def test_percentiles_of_a_uniform_distribution(self):
+        hist = self._assert_percentiles([ms / 1000 for ms in range(1, 10001)])
+        self.assertEqual(hist.count, 10000)
+
+    def test_percentiles_of_a_long_tailed_distribution(self):
+        rng = random.Random(7)
+        self._assert_percentiles([rng.lognormvariate(math.log(0.05), 1.2) for _ in range(20000)])
+
+    def test_merge_and_round_trip(self):
+        rng = random.Random(11)
+        samples = [rng.expovariate(1 / 0.02) for _ in range(5000)]
+        whole, first, second = self.Hist(), self.Hist(), self.Hist()
+        for index, seconds in enumerate(samples):
+            whole.record(seconds)
+            (first if index % 3 else second).record(seconds)
+        first.merge(self.Hist.from_dict(json.loads(json.dumps(second.to_dict()))))
+        self.assertEqual(first.to_dict(), whole.to_dict())
+        self.assertEqual(first.percentiles([50, 99]), whole.percentiles([50, 99]))
+        self.assertEqual(self.Hist().percentiles([50]), {50: None})
+
+
+class LoadScheduleTests(SimpleTestCase):
+    def test_arrivals_without_ramp_up_are_evenly_spaced(self):
+        self.assertEqual([load_runner._arrival_time(k, 4, 0) for k in range(4)], [0, 0.25, 0.5, 0.75])
+
+    def test_ramp_up_is_linear_in_rate(self):
+        rps, ramp_up = 10, 2
+        times = [load_runner._arrival_time(k, rps, ramp_up) for k in range(60)]
+        self.assertEqual(times, sorted(times))
+        # 加压期间到达 rps·ramp_up/2 = 10 次，此后每秒 rps 次
+        self.assertAlmostEqual(times[10], ramp_up)
+        self.assertAlmostEqual(times[20], ramp_up + 1)
+        self.assertEqual(sum(1 for t in times if t < 1), 3)
+        self.assertEqual(sum(1 for t in times if 1 <= t < 2), 7)
+
+    def test_open_loop_behind_schedule_still_runs_iterations(self):
+        calls = []
+
+        async def run_one(scheduled):
+            calls.append(scheduled)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            # 整个计划都已落后：不让出事件循环时在途迭代永远不结束，几乎全部被丢弃
+            start = loop.time() - 2
+            profile = {"rps": 100, "ramp_up": 0, "warmup": 0, "max_inflight": 5}
+            await load_runner._open_loop(run_one, stats, profile, start, start + 1)
+
+        stats = load_runner.LoadStats({"steps": []})
+        asyncio.run(main())
+        self.assertEqual((len(calls), stats.dropped), (100, 0))
+
+
+@skipUnless(async_runner.aiohttp is not None, "needs aiohttp")
+class LoadRunTests(SimpleTestCase):
+    def setUp(self):
+        self.server = _serve_http(0)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def _run(self, plan, **parameters):
+        results, summary = asyncio.run(load_runner.run_plans_async([plan], _profile(**parameters)))
+        return results[0]
+
+    def test_open_loop_iteration_counts(self):
+        result = self._run(_load_plan(self.url), rps=20, duration=1, warmup=0.5)
+        # 计划时刻 k/20 < 1.5 共 30 次，其中前 0.5 秒的 10 次为预热
+        self.assertEqual(result["iterations"],
+                         {"total": 20, "passed": 20, "failed": 0, "error": 0, "dropped": 0, "warmup": 10})
+        self.assertEqual(result["status"], "passed")
+        self.assertEqual(result["latency"]["count"], 20)
+        self.assertEqual(result["throughput"]["iterations_per_s"], 20)
+
+    def test_unexpected_exception_is_one_error_iteration(self):
+        run_plan = async_runner.run_plan
+        calls = []
+
+        async def flaky(plan, *args):
+            calls.append(plan)
+            if len(calls) % 4 == 0:
+                raise RuntimeError("boom")
+            return await run_plan(plan, *args)
+
+        with mock.patch.object(async_runner, "run_plan", flaky):
+            result = self._run(_load_plan(self.url), rps=20, duration=1)
+        self.assertEqual(result["iterations"]["total"], 20)
+        self.assertEqual((result["iterations"]["passed"], result["iterations"]["error"]), (15, 5))
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(result["errors"], [{"message": "step 1 RuntimeError: boom", "count": 5}])
+
+
+class StatsAssertionTests(SimpleTestCase):
+    def _hist(self, *values_ms):
+        hist = load_runner.LatencyHistogram()
+        for ms in values_ms:
+            hist.record(ms / 1000)
+        return hist
+
+    def test_scope_stats(self):
+        stats = load_runner.scope_stats(self._hist(*range(1, 101)), failures=5, duration=2, metrics={"p50", "p99.9"})
+        self.assertEqual((stats["count"], stats["min"], stats["max"], stats["mean"]), (100, 1, 100, 50.5))
+        self.assertEqual((stats["rps"], stats["error_rate"]), (50, 0.05))
+        self.assertAlmostEqual(stats["p50"], 50, delta=50 / 64)
+        self.assertAlmostEqual(stats["p99.9"], 100, delta=100 / 64)
+        # 只算断言里用到的分位数
+        self.assertNotIn("p90", stats)
+        empty = load_runner.scope_stats(self._hist(), failures=0, duration=2, metrics={"p99"})
+        self.assertEqual((empty["count"], empty["rps"], empty["p99"], empty["error_rate"]), (0, 0, None, None))
+
+    def test_evaluate(self):
+        assertions = [
+            test_runner._compile_stats_assertion(*a) for a in (
+                ("${stats}.p99", "less_than", "200"),
+                ("${stats}.testcase.max", "less_than", "50"),
+                ("${stats}.error_rate", "less_than", "0.01"),
+                ("${stats}.p99", "less_than", "x"),
+                ("${stats}.nope", "less_than", "1"),
+            )
+        ]
+        by_scope = {"step": {"p99": 120.0, "error_rate": None}, "testcase": {"max": 80.0}}
+        p99, testcase_max, error_rate, bad_value, bad_metric = load_runner.evaluate_stats_assertions(assertions, by_scope)
+        self.assertEqual((p99["passed"], p99["actual"]), (True, 120.0))
+        self.assertEqual((testcase_max["passed"], testcase_max["message"]), (False, "assertion failed"))
+        self.assertEqual((error_rate["passed"], error_rate["message"]), (False, "no samples"))
+        self.assertFalse(bad_value["passed"])
+        self.assertIsNotNone(bad_value["message"])
+        self.assertIn("Unsupported stats expression", bad_metric["message"])
+
+
+@skipUnless(async_runner.aiohttp is not None, "needs aiohttp")
+class StatsAssertionRunTests(SimpleTestCase):
+    def setUp(self):
+        self.server = _serve_http(0.02)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def _run(self, plan):
+        results, summary = asyncio.run(load_runner.run_plans_async([plan], _profile(concurrency=2, duration=0.5)))
+        return results[0]
+
+    def test_p99_pass_and_fail(self):
+        passing = self._run(_load_plan(self.url, [("${stats}.p99", "less_than", "5000")]))
+        self.assertEqual(passing["status"], "passed")
+        assertion, = passing["steps"][0]["assertions"]
+        self.assertTrue(assertion["passed"])
+        # 每个请求至少 20ms
+        self.assertGreaterEqual(assertion["actual"], 20 * 63 / 64)
+        self.assertGreater(passing["iterations"]["total"], 0)
+        self.assertEqual(passing["iterations"]["total"], passing["iterations"]["passed"])
+
+        failing = self._run(_load_plan(self.url, [("${stats}.p99", "less_than", "10")]))
+        self.assertEqual(failing["status"], "failed")
+        self.assertEqual(failing["iterations"]["failed"], 0)
+        self.assertFalse(failing["steps"][0]["assertions"][0]["passed"])
+
+    def test_error_rate_assertion_decides_on_failed_iterations(self):
+        wrong_code = [("${response}.code", "equal", "500")]
+        # 没有 error_rate 断言：任何失败迭代都使用例不通过
+        strict = self._run(_load_plan(self.url, [("${stats}.p99", "less_than", "5000")], wrong_code))
+        self.assertEqual(strict["status"], "failed")
+        self.assertEqual(strict["iterations"]["failed"], strict["iterations"]["total"])
+        self.assertEqual(strict["error_rate"], 1)
+
+        tolerant = self._run(_load_plan(self.url, [("${stats}.error_rate", "less_than", "1.01")], wrong_code))
+        self.assertEqual(tolerant["status"], "passed")
+        too_many = self._run(_load_plan(self.url, [("${stats}.error_rate", "less_than", "0.5")], wrong_code))
+        self.assertEqual(too_many["status"], "failed")
+        self.assertEqual(too_many["steps"][0]["error_rate"], 1)
+
+
+# ===================== 请求指标 =====================
+def _scrape(client) -> dict:
+    """metrics/ 的输出解析成 {序列: 值}，序列保留标签原文，如 tb_n_plus_one_total{endpoint="project",operate="delete"}"""
+    response = client.get("/testplatform/metrics/")
+    values = {}
+    for line in response.content.decode().splitlines():
+        if line and not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            values[series] = float(value)
+    return values
+
+
+@override_settings(TESTBENCH_METRICS_DIR=None, TESTBENCH_SERVER_TIMING=False)
+class MetricsMiddlewareTests(TestCase):
+    # 指标存放在进程内，其他测试的请求也会计入：断言都比较请求前后的差值
+
+    def setUp(self):
+        self.project = Project.objects.create(name="metrics_p")
+        cache.clear_local()
+
+    def _post(self, endpoint, operate, parameters, client=None):
+        body = json.dumps({"operate": operate, "project_name": "metrics_p", "parameters": parameters})
+        response = (client or self.client).post(f"/testplatform/{endpoint}/", body, content_type="application/json")
+        # 流式响应在最后一块发送完后才记录
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def _delta(self, before, after, series):
+        return after.get(series, 0) - before.get(series, 0)
+
+    def test_each_operate_gets_its_own_labels(self):
+        keyword = {"name": "k1", "url": "http://127.0.0.1/", "method": "GET", "params": {}, "headers": {},
+                   "body_type": "raw", "body": ""}
+        before = _scrape(self.client)
+        created, _ = self._post("keyword", "create", keyword)
+        listed, listed_content = self._post("keyword", "show_all", {})
+        rejected, _ = self._post("keyword", "no_such_operate", {})
+        after = _scrape(self.client)
+        self.assertEqual((created.status_code, listed.status_code, rejected.status_code), (200, 200, 400))
+        self.assertTrue(listed.streaming)
+
+        for operate, status in (("create", 200), ("show_all", 200), ("other", 400)):
+            with self.subTest(operate=operate):
+                series = f'tb_requests_total{{endpoint="keyword",operate="{operate}",status="{status}"}}'
+                self.assertEqual(self._delta(before, after, series), 1)
+        labels = 'endpoint="keyword",operate="show_all"'
+        self.assertEqual(self._delta(before, after, f"tb_request_duration_seconds_count{{{labels}}}"), 1)
+        self.assertEqual(self._delta(before, after, f"tb_response_size_bytes_sum{{{labels}}}"), len(listed_content))
+        self.assertGreaterEqual(self._delta(before, after, f"tb_db_queries_sum{{{labels}}}"), 1)
+
+        # 直方图的桶是累加的，+Inf 桶等于 _count
+        buckets = [value for series, value in after.items()
+                   if series.startswith(f"tb_request_duration_seconds_bucket{{{labels},le=")]
+        self.assertEqual(len(buckets), len(metrics.LATENCY_BUCKETS) + 1)
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(after[f'tb_request_duration_seconds_bucket{{{labels},le="+Inf"}}'],
+                         after[f"tb_request_duration_seconds_count{{{labels}}}"])
+        # 不带 operate 的接口 operate 标签为空
+        self.assertIn('tb_requests_total{endpoint="metrics",operate="",status="200"}', after)
+
+    def test_server_timing_header(self):
+        response, _ = self._post("keyword", "show_all", {})
+        self.assertNotIn("Server-Timing", response)
+
+        with override_settings(TESTBENCH_SERVER_TIMING=True):
+            # 中间件在客户端第一次请求时实例化，打开设置后换一个客户端
+            response, _ = self._post("keyword", "show_all", {}, client=self.client_class())
+        header = response["Server-Timing"]
+        self.assertRegex(header, r"^total;dur=\d+\.\d, db;dur=\d+\.\d;desc=\"[1-9]\d* queries\"")
+        self.assertNotIn("n_plus_one", header)
+
+    def test_repeated_select_is_flagged_as_n_plus_one(self):
+        names = [f"metrics_del{i}" for i in range(metrics.N_PLUS_ONE_THRESHOLD + 1)]
+        Project.objects.bulk_create([Project(name=name) for name in names])
+        series = 'tb_n_plus_one_total{endpoint="project",operate="delete"}'
+
+        before = _scrape(self.client)
+        self._post("project", "delete", {"delete_list": names[:1]})
+        self.assertEqual(self._delta(before, _scrape(self.client), series), 0)
+
+        before = _scrape(self.client)
+        with override_settings(TESTBENCH_SERVER_TIMING=True), self.assertLogs("django", "WARNING") as logs:
+            # delete_list 里每个名字各查一次项目
+            response, _ = self._post("project", "delete", {"delete_list": names[1:]}, client=self.client_class())
+        after = _scrape(self.client)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._delta(before, after, series), 1)
+        self.assertGreater(self._delta(before, after, 'tb_duplicate_queries_total{endpoint="project",operate="delete"}'),
+                           0)
+        self.assertTrue(any("N+1 queries on project/delete" in line for line in logs.output), logs.output)
+        self.assertRegex(response["Server-Timing"], r'n_plus_one;desc="\d+x SELECT ')
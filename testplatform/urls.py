@@ -1,12 +1,17 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import views, async_views, metrics
+
+# ASGI 部署时 CRUD 接口换成异步视图，其余页面两种部署方式相同
+api = async_views if settings.TESTBENCH_ASYNC_VIEWS else views
 
 urlpatterns = [
-    path("testcase/", views.testcase, name="testcase"),
-    path("keyword/", views.keyword, name="keyword"),
-    path("project/", views.project, name="project"),
+    path("testcase/", api.testcase, name="testcase"),
+    path("keyword/", api.keyword, name="keyword"),
+    path("project/", api.project, name="project"),
     path("healthz/", views.healthz, name="healthz"),
+    path("metrics/", metrics.metrics_view, name="metrics"),
 
     path("ui/project/", views.ui_project, name="ui_project"),
     path("ui/keyword/", views.ui_keyword, name="ui_keyword"),
@@ -4,16 +4,35 @@ import traceback
 
 from django.shortcuts import render
 from .models import Testcase, KeyWord, TestCaseKeyword, Project, Assertion
+from django.conf import settings
 from django.http import HttpResponse, JsonResponse
-from django.core.serializers import serialize
-from django.core.exceptions import ValidationError
+from django.core.exceptions import RequestDataTooBig, ValidationError
 from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import render
 from .serializers import ProjectSerializer
+from .pagination import paginate, get_fields
+from .responses import model_list_response, model_list_data
+from . import search, importer, cache, db_router, sharding, run_results, jobs
+from utils import test_runner, async_runner, load_runner, test_script_generator
+from utils.custom_log_handler import log_payload
 
 logger = logging.getLogger('django')
 
 
+def request_too_large(e: RequestDataTooBig) -> JsonResponse:
+    # 请求体超过 DATA_UPLOAD_MAX_MEMORY_SIZE（settings.TESTBENCH_MAX_REQUEST_BYTES）
+    logger.error(f"Request body too large: {e}")
+    return JsonResponse(
+        {
+            "code": 413,
+            "message": f"Request body exceeds {settings.DATA_UPLOAD_MAX_MEMORY_SIZE} bytes, raise TESTBENCH_MAX_REQUEST_BYTES "
+                       f"or import the file with `python manage.py import_records`",
+        },
+        status=413
+    )
+
+
 def ui_project(request):  
     return render(request, "tb_project.html")
 
@@ -34,7 +53,7 @@ def healthz(request):
 
 """
 {
-    "operate": "create/update/delete/show_all/search",
+    "operate": "create/update/delete/show_all/search/show_testcase/testcase_detail/run/generate/import",
     "project_name": "projectA",
     "parameters": {
         "title": "title",
@@ -47,6 +66,7 @@ def healthz(request):
         "auto_flag": "auto_flag",
         "update_source_title": "update_source_title",
         "delete_title_list": [],
+        "title_list": [],
         "description": "description",
         "keywords": [
             {
@@ -72,47 +92,57 @@ def testcase(request):
     # create update delete show_all search
     if request.method == 'POST':
         try:
-            logger.info(request.body.decode('utf-8'))
+            logger.info(log_payload(request.body))
             source_data = json.loads(request.body)
             operate = source_data["operate"]
             project_name = source_data.get("project_name")
             parameters = source_data["parameters"]
+            # 项目下的数据按项目所在分片路由
+            sharding.activate(project_name)
+            page = None
+            fields = None
             if operate == "create":
                 code = 200
                 message = "create testcase success"
                 testcases = create_testcase(project_name, parameters)
-                logger.info(f"Creating testcase for project '{project_name}' with parameters: {parameters}")
+                logger.info(f"Creating testcase for project '{project_name}' with parameters: {log_payload(parameters)}")
             elif operate == "update":
                 code = 200
                 message = "update testcase success"
                 testcases = update_testcase(project_name, parameters)
-                logger.info(f"Updating testcase for project '{project_name}' with parameters: {parameters}")
+                logger.info(f"Updating testcase for project '{project_name}' with parameters: {log_payload(parameters)}")
             elif operate == "delete":
                 # delete逻辑正常，那么返回的testcases就为空，如果有值的话，这段逻辑就有问题了
                 code = 200
                 message = "delete testcase success"
                 testcases = delete_testcase(project_name, parameters)
-                logger.info(f"Deleting testcase for project '{project_name}' with parameters: {parameters}")
+                logger.info(f"Deleting testcase for project '{project_name}' with parameters: {log_payload(parameters)}")
             elif operate == "show_all":
-                testcases = show_all_testcases(project_name, parameters)
+                # 只读查询走副本；流式输出在视图返回后才求值，需要绑定到当前路由到的库
+                with db_router.replica_reads():
+                    testcases, page = paginate(db_router.bind(show_all_testcases(project_name, parameters)), parameters)
+                fields = get_fields(Testcase, parameters)
                 code = 200
                 message = "search all testcases successfully"
-                logger.info(f"Showing all testcase for project '{project_name}' with parameters: {parameters}")
+                logger.info(f"Showing all testcase for project '{project_name}' with parameters: {log_payload(parameters)}")
             elif operate == "search":
-                testcases = search_testcase(project_name, parameters)
+                with db_router.replica_reads():
+                    testcases, page = search_testcase(project_name, parameters)
                 code = 200
                 if testcases is None:
                     message = "no testcases match"
                     testcases = []
                 else:
                     message = "search testcases successfully"
-                logger.info(f"Searching testcase for project '{project_name}' with parameters: {parameters}")
+                    fields = get_fields(Testcase, parameters)
+                logger.info(f"Searching testcase for project '{project_name}' with parameters: {log_payload(parameters)}")
             elif operate == "show_testcase":
-                testcase, testcase_keywords, keyword_assertions = show_testcase(project_name, parameters)
+                with db_router.replica_reads():
+                    testcase, testcase_keywords, keyword_assertions = show_testcase(project_name, parameters)
                 code = 200
                 message = "show testcase successfully"
-                testcase_data = json.loads(serialize("json", [testcase]))[0]
-                testcase_keywords_data = json.loads(serialize("json", testcase_keywords))
+                testcase_data = model_list_data([testcase])[0]
+                testcase_keywords_data = model_list_data(testcase_keywords)
                 response_data = {
                     "code": code,
                     "message": message,
@@ -120,8 +150,93 @@ def testcase(request):
                     "testcase_keywords": testcase_keywords_data,
                     "keyword_assertions": keyword_assertions,
                 }
-                logger.info(f"Showing testcase for project '{project_name}' with parameters: {parameters}")
+                logger.info(f"Showing testcase for project '{project_name}' with parameters: {log_payload(parameters)}")
                 return JsonResponse(response_data, status=200)
+            elif operate == "testcase_detail":
+                with db_router.replica_reads():
+                    detail = show_testcase_detail(project_name, parameters)
+                logger.info(f"Showing testcase detail for project '{project_name}' with parameters: {log_payload(parameters)}")
+                return JsonResponse(
+                    {
+                        "code": 200,
+                        "message": "show testcase detail successfully",
+                        **detail,
+                    },
+                    status=200
+                )
+            elif operate == "run" and parameters.get("queue"):
+                job = submit_run_job(project_name, parameters)
+                logger.info(f"Queued run job {job.id} for project '{project_name}' with parameters: {log_payload(parameters)}")
+                return JsonResponse(
+                    {
+                        "code": 200,
+                        "message": "run job queued",
+                        "job_id": job.id,
+                    },
+                    status=200
+                )
+            elif operate == "run":
+                results, summary = run_testcase(project_name, parameters)
+                run = save_run_results(project_name, parameters, results, summary)
+                logger.info(f"Running testcase for project '{project_name}' with parameters: {log_payload(parameters)}, summary: {summary}")
+                return JsonResponse(
+                    {
+                        "code": 200,
+                        "message": "run testcases finished",
+                        "run_id": run.id if run else None,
+                        "summary": summary,
+                        "results": results,
+                    },
+                    status=200
+                )
+            elif operate == "show_job":
+                # 任务状态一直在变，不走副本
+                data = show_job(project_name, parameters)
+                return JsonResponse(
+                    {
+                        "code": 200,
+                        "message": "show job successfully",
+                        **data,
+                    },
+                    status=200
+                )
+            elif operate == "rollup":
+                with db_router.replica_reads():
+                    rollups = show_rollups(project_name, parameters)
+                logger.info(f"Showing rollups for project '{project_name}' with parameters: {log_payload(parameters)}")
+                return JsonResponse(
+                    {
+                        "code": 200,
+                        "message": "show rollups successfully",
+                        "rollups": rollups,
+                    },
+                    status=200
+                )
+            elif operate == "import":
+                summary = import_testcase(project_name, parameters)
+                logger.info(f"Importing testcases for project '{project_name}': {summary['imported']} imported, {summary['failed']} failed")
+                return JsonResponse(
+                    {
+                        "code": 200,
+                        "message": "import testcases finished",
+                        **summary,
+                    },
+                    status=200
+                )
+            elif operate == "generate":
+                files = generate_testcase_scripts(project_name, parameters)
+                logger.info(f"Generating scripts for project '{project_name}' with parameters: {log_payload(parameters)}, "
+                            f"{len(files['generated'])} generated, {len(files['unchanged'])} unchanged")
+                return JsonResponse(
+                    {
+                        "code": 200,
+                        "message": "generate testcase scripts success",
+                        "generated": files["generated"],
+                        "unchanged": files["unchanged"],
+                        "removed": files["removed"],
+                    },
+                    status=200
+                )
             else:
                 code = 400
                 message = "Unsupported operation"
@@ -134,20 +249,23 @@ def testcase(request):
                     status=code
                 )
 
+        except RequestDataTooBig as e:
+            return request_too_large(e)
         except Exception as e:
             logger.error(f"except:{e}, type:{type(e)}")
             logger.error(traceback.format_exc())
             return JsonResponse({'error': f"Exception: {e}, Type: {type(e)}, Traceback: {traceback.format_exc()}"}, status=400)
         else:
-            # serialize函数:Django的serialize函数可以将QuerySet对象序列化为JSON格式，适合用于API响应。
+            # 直接从 .values() 编码为 model/pk/fields 结构，不再 serialize → json.loads → JsonResponse 三次处理
             logger.info(f"Operation '{operate}' completed successfully for project '{project_name}'")
-            return JsonResponse(
-                {
-                    "code": code,
-                    "message": message,
-                    "testcases": json.loads(serialize("json", testcases)),
-                },
-                status=200
+            return model_list_response(
+                "testcases",
+                testcases,
+                code=code,
+                message=message,
+                fields=fields,
+                extra={"page": page} if page is not None else None,
+                stream=operate in ("show_all", "search"),
             )
     else:
         logger.error("Received non-POST request")
@@ -156,10 +274,7 @@ def testcase(request):
 
 def show_all_testcases(project_name, parameters):
     # 应该要展示数量（可否由前端控制？）
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
 
     testcases = Testcase.objects.filter(project=project)
     return testcases
@@ -177,17 +292,13 @@ def search_testcase(project_name, parameters):
         raise ValidationError('Must provide title for searching')
 
     # 查找匹配的项目
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
 
-    # 生成 project_case 字段
-    project_case = f"{project_name}_{title}"
-    testcase_query = Testcase.objects.filter(project_case__icontains=project_case)
-    if not testcase_query.exists():
-        return None
-    return testcase_query
+    # 按 title / name / description 索引搜索（MySQL FULLTEXT ngram，SQLite 用进程内 trigram 索引），按相关度排序
+    testcases, page = search.search(Testcase, project, title, parameters)
+    if not testcases:
+        return None, None
+    return testcases, page
 
 
 def create_testcase(project_name, parameters):
@@ -197,14 +308,14 @@ def create_testcase(project_name, parameters):
             raise ValidationError(f"Missing required field: {field}")
 
     # 查找匹配的项目
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
 
     # transaction.atomic() 创建了一个原子事务块。块内的所有操作要么全部成功，要么全部失败。如果在事务块内引发异常（例如，如果未找到关键字），则事务将回滚，并且不会保存任何更改。
     # 这确保了 Testcase 和 TestCaseKeyword 对象的创建是原子的，要么全部完成，要么全部不完成。
-    with transaction.atomic():
+    # 关键字目录走缓存，不再每个步骤查一次
+    keyword_map = cache.keyword_catalog(project)
+    with transaction.atomic(using=sharding.alias_for(project.id)):
+        cache.bump_project(project.id)
         new_testcase = Testcase(
             project=project,
             title=parameters["title"],
@@ -231,9 +342,8 @@ def create_testcase(project_name, parameters):
             method = keyword_data.get('method', '')
             body_type = keyword_data.get('body_type', '')
             # 查找匹配的 keyword
-            try:
-                this_keyword = KeyWord.objects.get(name=keyword_name)
-            except KeyWord.DoesNotExist:
+            this_keyword = keyword_map.get(keyword_name)
+            if this_keyword is None:
                 raise ValidationError(f"没匹配到合适的keyword: {keyword_name}")
 
             testcase_keyword = TestCaseKeyword.objects.create(
@@ -272,16 +382,14 @@ def update_testcase(project_name, parameters):
     # 修改用例逻辑：用户操作，在用例展示界面，修改字段值，点击保存，即可修改
     # 接口逻辑：展示界面，会拿到用例所有字段信息，修改字段，请求过去即更改
     # 前端用例界面进行修改，用例原标题用缓存先保留，发生update事件后，传值update_source_title，project字段由当前用例所属project赋值
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
 
     try:
         new_testcase = Testcase.objects.get(project=project, title=parameters["update_source_title"])
     except Testcase.DoesNotExist:
         raise ValidationError('Testcase not found')
-    with transaction.atomic():
+    with transaction.atomic(using=sharding.alias_for(project.id)):
+        cache.bump_project(project.id)
         new_testcase.title = parameters.get("title", new_testcase.title)
         new_testcase.name = parameters.get("name", new_testcase.name)
         new_testcase.level = parameters.get("level", new_testcase.level)
@@ -299,137 +407,173 @@ def update_testcase(project_name, parameters):
         # 如果原始数据中有相同的name - order，则比较其值，判断是否需要修改；如果原始数据中没有这个
         # name - order，则写入；如果原始数据中存在但请求中没有，则删除这个 name - order。
         # 前端要对传入keyword进行负责：首先是排序，order不能乱，必须要连续；其次保证格式，这个由前端组成来控制，后端只校验keyword是否存在
+        # 步骤和断言都做真正的差量：一次 prefetch 读出现状，算出增 / 改 / 删，再用 bulk_create / bulk_update / 单条 delete 落库，
+        # 没有变化的步骤和断言不产生任何写操作
         keywords_data = parameters['keywords']
-        current_keywords = list(
-            TestCaseKeyword.objects.filter(test_case=new_testcase).values('keyword__name', 'order', 'params', 'headers',
-                                                                          'body', 'url', 'body_type', 'method'))
-        # 创建当前关键字数据字典
-        current_keywords_dict = {}
-        for keyword in current_keywords:
-            key = (keyword['keyword__name'], keyword['order'])
-            current_keywords_dict[key] = {
-                'params': keyword['params'],
-                'headers': keyword['headers'],
-                'body': keyword['body'],
-                'url': keyword['url'],
-                'method': keyword['method'],
-                'body_type': keyword['body_type']
-            }
+        apply_steps_diff(new_testcase, diff_steps(project, new_testcase, keywords_data))
 
-        # 创建请求关键字数据字典
-        request_keywords_dict = {}
-        for keyword_data in keywords_data:
-            key = (keyword_data['name'], keyword_data['order'])
-            request_keywords_dict[key] = {
-                'params': keyword_data.get('params', {}),
-                'headers': keyword_data.get('headers', {}),
-                'body': keyword_data.get('body', ''),
-                'url': keyword_data.get('url', ''),
-                'method': keyword_data.get('method', ''),
-                'body_type': keyword_data.get('body_type', ''),
-                'assertions': keyword_data.get('assertions', [])
-            }
+        # 验证每个字段的值是否符合该字段的验证规则
+        new_testcase.full_clean()
+        new_testcase.save()
 
-        # 比较请求中的关键字与当前关键字，找出新增或修改的关键字（先找，而不是进行修改，避免影响到找这个步骤）
-        to_delete_keywords = []
-        to_add_or_update_keywords = []
-        unchanged_keywords = []
+    new_testcase_query = Testcase.objects.filter(id=new_testcase.id)
+    return new_testcase_query
 
-        for key in current_keywords_dict:
-            if key not in request_keywords_dict:
-                to_delete_keywords.append(key)
 
-        for key, value in request_keywords_dict.items():
-            if key not in current_keywords_dict or current_keywords_dict[key] != value:
-                to_add_or_update_keywords.append((key, value))
-            else:
-                unchanged_keywords.append(key)
-
-
-            # 删除不存在的关键字关联
-        for keyword, order in to_delete_keywords:
-            TestCaseKeyword.objects.filter(test_case=new_testcase, keyword__name=keyword, order=order).delete()
-
-        # 添加或更新关键字
-        for (keyword_name, order), value in to_add_or_update_keywords:
-            params = value['params']
-            headers = value['headers']
-            body = value['body']
-            url = value['url']
-            method = value['method']
-            body_type = value['body_type']
-            try:
-                # 查找匹配的 keyword
-                this_keyword = KeyWord.objects.get(name=keyword_name)
-            except KeyWord.DoesNotExist:
-                raise ValidationError(f"没匹配到合适的keyword: {keyword_name}")
+STEP_DIFF_FIELDS = ['params', 'headers', 'body', 'url', 'method', 'body_type']
+ASSERTION_DIFF_FIELDS = ['target_value', 'operator', 'compared_value']
 
-            testcase_keyword, created = TestCaseKeyword.objects.update_or_create(
-                test_case=new_testcase,
-                keyword=this_keyword,
-                order=order,
-                defaults={
-                    'params': params,
-                    'headers': headers,
-                    'body': body,
-                    'body_type': body_type,
-                    'url': url,
-                    'method': method
-                }
-            )
 
-            # 处理断言
-            testcase_keyword.assertions.all().delete()
-            assertions_data = value.get('assertions', [])
-            for assertion_data in assertions_data:
-                target_value = assertion_data.get('target_value')
-                operator = assertion_data.get('operator')
-                compared_value = assertion_data.get('compared_value')
-                if not target_value or not operator or compared_value is None:
-                    raise ValidationError(
-                        "All of 'target_value', 'operator' and 'compared_value' are required and cannot be empty for each assertion")
-                Assertion.objects.create(
-                    target_value=target_value,
-                    operator=operator,
-                    compared_value=compared_value,
-                    testcase_keyword=testcase_keyword
-                )
-        # 刷新未改动关键字的断言
-        for keyword_name, order in unchanged_keywords:
-            testcase_keyword = TestCaseKeyword.objects.get(test_case=new_testcase, keyword__name=keyword_name, order=order)
-            testcase_keyword.assertions.all().delete()
+def _desired_assertions(assertions_data):
+    desired = []
+    for assertion_data in assertions_data:
+        target_value = assertion_data.get('target_value')
+        operator = assertion_data.get('operator')
+        compared_value = assertion_data.get('compared_value')
+        if not target_value or not operator or compared_value is None:
+            raise ValidationError(
+                "All of 'target_value', 'operator' and 'compared_value' are required and cannot be empty for each assertion")
+        desired.append({'target_value': target_value, 'operator': operator, 'compared_value': compared_value})
+    return desired
 
-            assertions_data = request_keywords_dict[(keyword_name, order)].get('assertions', [])
-            for assertion_data in assertions_data:
-                target_value = assertion_data.get('target_value')
-                operator = assertion_data.get('operator')
-                compared_value = assertion_data.get('compared_value')
-                if not target_value or not operator or compared_value is None:
-                    raise ValidationError(
-                        "All of 'target_value', 'operator' and 'compared_value' are required and cannot be empty for each assertion")
-                Assertion.objects.create(
-                    target_value=target_value,
-                    operator=operator,
-                    compared_value=compared_value,
-                    testcase_keyword=testcase_keyword
-                )
 
-        # 验证每个字段的值是否符合该字段的验证规则
-        new_testcase.full_clean()
-        new_testcase.save()
+def _same_value(current, wanted):
+    # compared_value 等 CharField 从库里读出来是字符串，请求里可能是数字，按字符串比较避免每次都判定为修改
+    if current == wanted:
+        return True
+    return current is not None and wanted is not None and str(current) == str(wanted)
+
+
+def _diff_assertions(existing, desired, diff, testcase_keyword):
+    # 断言按顺序一一对应：前 min(n, m) 条逐字段比较，有差异才更新；多出的新增，缺少的删除
+    for current, wanted in zip(existing, desired):
+        changed = False
+        for field in ASSERTION_DIFF_FIELDS:
+            if not _same_value(getattr(current, field), wanted[field]):
+                setattr(current, field, wanted[field])
+                changed = True
+        if changed:
+            diff['update_assertions'].append(current)
+    for wanted in desired[len(existing):]:
+        diff['create_assertions'].append((testcase_keyword, Assertion(**wanted)))
+    diff['delete_assertion_ids'].extend(a.id for a in existing[len(desired):])
 
-    new_testcase_query = Testcase.objects.filter(id=new_testcase.id)
-    return new_testcase_query
+
+def diff_steps(project, testcase, keywords_data):
+    """
+    计算用例步骤和断言的差量（只读，不写库）：
+      steps：(keyword name, order) 为键，新增 / 字段有变化的更新 / 请求中不存在的删除
+      assertions：每个步骤内按顺序比较
+    """
+    current_steps = (
+        TestCaseKeyword.objects
+        .filter(test_case=testcase)
+        .select_related('keyword')
+        .prefetch_related(Prefetch('assertions', queryset=Assertion.objects.order_by('id')))
+    )
+    current = {}
+    diff = {
+        'create_steps': [],
+        'update_steps': [],
+        'delete_step_ids': [],
+        'kept_step_ids': [],
+        'create_assertions': [],
+        'update_assertions': [],
+        'delete_assertion_ids': [],
+    }
+    for step in current_steps:
+        key = (step.keyword.name, step.order)
+        if key in current:
+            # 历史数据中重复的 name - order，只保留一条
+            diff['delete_step_ids'].append(step.id)
+        else:
+            current[key] = step
+
+    # 请求中同一个 name - order 以最后一条为准（与原 dict 覆盖逻辑一致）；先整体校验，再计算差量
+    requested = {}
+    for keyword_data in keywords_data:
+        requested[(keyword_data['name'], keyword_data['order'])] = (
+            {
+                'params': keyword_data.get('params', {}),
+                'headers': keyword_data.get('headers', {}),
+                'body': keyword_data.get('body', ''),
+                'url': keyword_data.get('url', ''),
+                'method': keyword_data.get('method', ''),
+                'body_type': keyword_data.get('body_type', ''),
+            },
+            _desired_assertions(keyword_data.get('assertions', [])),
+        )
+
+    # 新增步骤用到的 keyword 一次查询
+    new_names = {name for name, order in requested if (name, order) not in current}
+    keyword_map = {kw.name: kw for kw in KeyWord.objects.filter(project=project, name__in=new_names)}
+    missing = new_names - set(keyword_map)
+    if missing:
+        raise ValidationError(f"没匹配到合适的keyword: {', '.join(sorted(missing))}")
+
+    for key, step in current.items():
+        if key not in requested:
+            diff['delete_step_ids'].append(step.id)
+
+    for (keyword_name, order), (values, desired) in requested.items():
+        step = current.get((keyword_name, order))
+        if step is None:
+            step = TestCaseKeyword(test_case=testcase, keyword=keyword_map[keyword_name], order=order, **values)
+            diff['create_steps'].append(step)
+            _diff_assertions([], desired, diff, step)
+            continue
+        diff['kept_step_ids'].append(step.id)
+        changed = False
+        for field in STEP_DIFF_FIELDS:
+            if not _same_value(getattr(step, field), values[field]):
+                setattr(step, field, values[field])
+                changed = True
+        if changed:
+            diff['update_steps'].append(step)
+        _diff_assertions(list(step.assertions.all()), desired, diff, step)
+    return diff
+
+
+def apply_steps_diff(testcase, diff):
+    """按差量落库：每张表最多一次 delete、一次 bulk_update、一次 bulk_create"""
+    if diff['delete_step_ids']:
+        # 级联删除步骤下的断言
+        TestCaseKeyword.objects.filter(id__in=diff['delete_step_ids']).delete()
+    if diff['delete_assertion_ids']:
+        Assertion.objects.filter(id__in=diff['delete_assertion_ids']).delete()
+    if diff['update_steps']:
+        TestCaseKeyword.objects.bulk_update(diff['update_steps'], STEP_DIFF_FIELDS)
+    if diff['update_assertions']:
+        Assertion.objects.bulk_update(diff['update_assertions'], ASSERTION_DIFF_FIELDS)
+
+    new_steps = diff['create_steps']
+    if new_steps:
+        TestCaseKeyword.objects.bulk_create(new_steps)
+        if new_steps[0].id is None:
+            # MySQL 的 bulk_create 不回填主键：用例内 (keyword, order) 唯一，按此回查新步骤 id
+            ids = {
+                (keyword_id, order): pk
+                for pk, keyword_id, order in TestCaseKeyword.objects
+                .filter(test_case=testcase)
+                .exclude(id__in=diff['kept_step_ids'])
+                .values_list('id', 'keyword_id', 'order')
+            }
+            for step in new_steps:
+                step.id = ids[(step.keyword_id, step.order)]
+
+    if diff['create_assertions']:
+        assertions = []
+        for testcase_keyword, assertion in diff['create_assertions']:
+            assertion.testcase_keyword = testcase_keyword
+            assertions.append(assertion)
+        Assertion.objects.bulk_create(assertions)
 
 
 def delete_testcase(project_name, parameters):
     # 在 TestCaseKeyword 模型中已经设置了 on_delete=models.CASCADE，
     # 当删除 Testcase 对象时，所有与之关联的 TestCaseKeyword 对象将会被自动删除。
     # 查找指定项目
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
 
     # 验证删除列表是否提供
     delete_title_list = parameters.get("delete_title_list", [])
@@ -439,7 +583,9 @@ def delete_testcase(project_name, parameters):
     testcases_to_delete = Testcase.objects.filter(project=project, title__in=parameters["delete_title_list"])
     if not testcases_to_delete:
         raise ValidationError('No matching testcases found for delete')
-    testcases_to_delete.delete()
+    with transaction.atomic(using=sharding.alias_for(project.id)):
+        cache.bump_project(project.id)
+        testcases_to_delete.delete()
     remaining_testcases = Testcase.objects.filter(title__in=parameters["delete_title_list"])
     return remaining_testcases
 
@@ -449,82 +595,292 @@ def show_testcase(project_name, parameters):
     if not title:
         raise ValidationError("Title must be provided for show_case operation")
 
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
     project_case = f"{project_name}_{title}"
 
-    try:
-        testcase = Testcase.objects.get(project_case=project_case)
-    except Testcase.DoesNotExist:
+    result = cache.testcase_entry(project, "show_testcase", title, lambda: _load_testcase(project_case))
+    if result is None:
         raise ValidationError(f"Testcase with project_case '{project_case}' not found")
+    return result
+
+
+def _load_testcase(project_case):
+    testcase = Testcase.objects.filter(project_case=project_case).first()
+    if testcase is None:
+        return None
+
+    # 断言随步骤一次 prefetch，不再每个步骤单独查一次
+    testcase_keywords = list(testcase_keywords_queryset(testcase))
+    return testcase, testcase_keywords, keyword_assertions(testcase_keywords)
+
+
+# show_testcase / testcase_detail 的查询与结果组装，同步视图和 async_views 共用
+def _assertions_prefetch():
+    return Prefetch('assertions', queryset=Assertion.objects.order_by('id'))
+
+
+def testcase_keywords_queryset(testcase):
+    return TestCaseKeyword.objects.filter(test_case=testcase).prefetch_related(_assertions_prefetch())
 
-    testcase_keywords = TestCaseKeyword.objects.filter(test_case=testcase)
 
-    keyword_assertions = []
-    for tk in testcase_keywords:
-        assertions = Assertion.objects.filter(testcase_keyword=tk).values('id', 'keyword_id', 'testcase_keyword_id', 'target_value', 'operator', 'compared_value')
-        keyword_assertions.extend(list(assertions))
+def keyword_assertions(testcase_keywords):
+    return [
+        {
+            'id': a.id,
+            'keyword_id': a.keyword_id,
+            'testcase_keyword_id': a.testcase_keyword_id,
+            'target_value': a.target_value,
+            'operator': a.operator,
+            'compared_value': a.compared_value,
+        }
+        for tk in testcase_keywords
+        for a in tk.assertions.all()
+    ]
 
-    return testcase, testcase_keywords, keyword_assertions
+
+def testcase_detail_queryset(project, project_case):
+    steps_qs = TestCaseKeyword.objects.select_related('keyword').prefetch_related(_assertions_prefetch())
+    return (
+        Testcase.objects
+        .filter(project=project, project_case=project_case)
+        .prefetch_related(Prefetch('testcasekeyword_set', queryset=steps_qs))
+    )
+
+
+def testcase_detail_data(testcase):
+    testcase_keywords = list(testcase.testcasekeyword_set.all())
+    steps = []
+    for tk, step_data in zip(testcase_keywords, model_list_data(testcase_keywords)):
+        step_data["keyword_name"] = tk.keyword.name
+        step_data["assertions"] = [
+            {
+                'id': a.id,
+                'target_value': a.target_value,
+                'operator': a.operator,
+                'compared_value': a.compared_value,
+            }
+            for a in tk.assertions.all()
+        ]
+        steps.append(step_data)
+
+    return {
+        "testcase": model_list_data([testcase])[0],
+        "steps": steps,
+    }
+
+
+def show_testcase_detail(project_name, parameters):
+    """
+    用例详情（嵌套结构）：固定 4 次查询（project、testcase、步骤 join keyword、断言），与步骤数无关；结果按项目版本号缓存
+    {
+        "testcase": {"model", "pk", "fields"},
+        "steps": [{"model", "pk", "fields", "keyword_name", "assertions": [{"id", "target_value", "operator", "compared_value"}]}]
+    }
+    """
+    title = parameters.get("title")
+    if not title:
+        raise ValidationError("Title must be provided for testcase_detail operation")
+
+    project = cache.get_project(project_name)
+    project_case = f"{project_name}_{title}"
+
+    detail = cache.testcase_entry(project, "testcase_detail", title, lambda: _load_testcase_detail(project, project_case))
+    if detail is None:
+        raise ValidationError(f"Testcase with project_case '{project_case}' not found")
+    return detail
+
+
+def _load_testcase_detail(project, project_case):
+    testcase = testcase_detail_queryset(project, project_case).first()
+    if testcase is None:
+        return None
+    return testcase_detail_data(testcase)
+
+
+def run_testcase(project_name, parameters):
+    # 进程内执行：不生成脚本文件，直接按 DB 中的步骤发请求并校验断言
+    # title_list 为空则执行整个项目；timeout 为单步请求超时（秒）
+    # mode=thread（默认）：线程池执行，max_workers 控制并发用例数
+    # mode=async：单事件循环执行，global_limit / per_host_limit 控制全局与每个 host 的在途请求数
+    # mode=load：性能用例压测，rps 或 concurrency + duration / warmup / ramp_up，返回吞吐量与耗时分位数
+    if not project_name:
+        raise ValidationError('Must provide project_name for running')
+
+    title_list = parameters.get("title_list", [])
+    timeout = parameters.get("timeout", test_runner.DEFAULT_TIMEOUT)
+    mode = parameters.get("mode", "thread")
+    if mode == "thread":
+        max_workers = parameters.get("max_workers", test_runner.DEFAULT_MAX_WORKERS)
+        return test_runner.run_testcases(project_name, title_list, max_workers=max_workers, timeout=timeout)
+    if mode == "async":
+        return async_runner.run_testcases(
+            project_name,
+            title_list,
+            global_limit=parameters.get("global_limit", async_runner.DEFAULT_GLOBAL_LIMIT),
+            per_host_limit=parameters.get("per_host_limit", async_runner.DEFAULT_PER_HOST_LIMIT),
+            timeout=timeout,
+        )
+    if mode == "load":
+        return load_runner.run_testcases(project_name, title_list, parameters)
+    raise ValidationError(f"Unsupported run mode: {mode}")
+
+
+def save_run_results(project_name, parameters, results, summary):
+    # 执行结果入库（TestRun / TestcaseResult / StepResult，并增量更新每日汇总）；save=false 时不保存
+    if not parameters.get("save", True):
+        return None
+    return run_results.save_run(cache.get_project(project_name), parameters.get("mode", "thread"), results, summary)
+
+
+RUN_MODES = ("thread", "async", "load")
+
+
+def submit_run_job(project_name, parameters):
+    # queue=true：写入任务队列后立即返回，由 manage.py run_workers 的 worker 进程执行；参数在提交时校验，结果总是入库
+    if not project_name:
+        raise ValidationError('Must provide project_name for running')
+    mode = parameters.get("mode", "thread")
+    if mode not in RUN_MODES:
+        raise ValidationError(f"Unsupported run mode: {mode}")
+    if mode == "load":
+        load_runner.load_profile(parameters)
+    max_attempts = parameters.get("max_attempts", jobs.DEFAULT_MAX_ATTEMPTS)
+    if not isinstance(max_attempts, int) or max_attempts < 1:
+        raise ValidationError("max_attempts must be a positive integer")
+    return jobs.submit(cache.get_project(project_name), parameters, max_attempts=max_attempts)
+
+
+def execute_run_job(job):
+    # worker 进程里执行一个任务：与同步 run 相同的执行逻辑，结果写入 TestRun
+    project = job.project
+    with sharding.use_project(project):
+        results, summary = run_testcase(project.name, job.parameters)
+    return run_results.save_run(project, job.parameters.get("mode", "thread"), results, summary)
+
+
+def show_job(project_name, parameters):
+    if not project_name:
+        raise ValidationError('Must provide project_name for showing job')
+    job_id = parameters.get("job_id")
+    if not isinstance(job_id, int):
+        raise ValidationError('Must provide job_id as an integer')
+    project = cache.get_project(project_name)
+    job = project.jobs.select_related("run").filter(id=job_id).first()
+    if job is None:
+        raise ValidationError(f"Job '{job_id}' not found in project '{project_name}'")
+    return jobs.job_data(job)
+
+
+def show_rollups(project_name, parameters):
+    # 按天汇总的通过率与耗时分位数：title_list 为空则返回项目下全部用例；since / until 为 YYYY-MM-DD（含）
+    if not project_name:
+        raise ValidationError('Must provide project_name for showing rollups')
+    return run_results.rollups(
+        cache.get_project(project_name),
+        titles=parameters.get("title_list", []),
+        since=parameters.get("since"),
+        until=parameters.get("until"),
+    )
+
+
+def _import_records(parameters):
+    # records：直接传记录列表；或 content + format（json / jsonl / yaml），content 为原始文本
+    if "records" in parameters:
+        records = parameters["records"]
+        if not isinstance(records, list):
+            raise ValidationError("records must be a list")
+        return records
+    if "content" in parameters:
+        return importer.parse_records(parameters["content"], parameters.get("format"))
+    raise ValidationError("Must provide records or content for importing")
+
+
+def import_testcase(project_name, parameters):
+    # 批量导入：关键字一次查询解析，bulk_create 写入，逐条返回错误；strict=True 时有错误则整批不导入
+    project = cache.get_project(project_name)
+    return importer.import_testcases(project, _import_records(parameters), strict=bool(parameters.get("strict", False)))
+
+
+def generate_testcase_scripts(project_name, parameters):
+    # 批量生成 pytest 脚本：title_list 为空则生成整个项目，一次 prefetch、并行写文件
+    # 按清单增量生成，内容未变的用例不重写；force=True 时全部重写
+    if not project_name:
+        raise ValidationError('Must provide project_name for generating')
+
+    title_list = parameters.get("title_list", [])
+    force = bool(parameters.get("force", False))
+    return test_script_generator.create_test_scripts(project_name, title_list, force=force)
 
 
 def keyword(request):
     if request.method == 'POST':
         try:
-            logger.info(f"Received POST request: {request.body.decode('utf-8')}")
+            logger.info(f"Received POST request: {log_payload(request.body)}")
             source_data = json.loads(request.body)
             operate = source_data["operate"]
             parameters = source_data["parameters"]
             project_name = source_data.get("project_name")
+            sharding.activate(project_name)
+            page = None
+            fields = None
             if operate == "create":
-                logger.info(f"Creating keyword for project '{project_name}' with parameters: {parameters}")
+                logger.info(f"Creating keyword for project '{project_name}' with parameters: {log_payload(parameters)}")
                 code = 200
                 message = "create keyword success"
                 keywords = create_keyword(project_name, parameters)
             elif operate == "update":
-                logger.info(f"Updating keyword for project '{project_name}' with parameters: {parameters}")
+                logger.info(f"Updating keyword for project '{project_name}' with parameters: {log_payload(parameters)}")
                 code = 200
                 message = "update keyword success"
                 keywords = update_keyword(project_name, parameters)
             elif operate == "delete":
-                logger.info(f"Deleting keyword for project '{project_name}' with parameters: {parameters}")
+                logger.info(f"Deleting keyword for project '{project_name}' with parameters: {log_payload(parameters)}")
                 code = 200
                 message = "delete keyword success"
                 keywords = delete_keyword(project_name, parameters)
+            elif operate == "import":
+                summary = import_keyword(project_name, parameters)
+                logger.info(f"Importing keywords for project '{project_name}': {summary['imported']} imported, {summary['failed']} failed")
+                return JsonResponse({"code": 200, "message": "import keywords finished", **summary}, status=200)
             elif operate == "show_all":
                 logger.info(f"Showing all keywords for project '{project_name}'")
-                keywords = show_all_keyword(project_name, parameters)
+                with db_router.replica_reads():
+                    keywords, page = paginate(db_router.bind(show_all_keyword(project_name, parameters)), parameters)
+                fields = get_fields(KeyWord, parameters)
                 code = 200
                 message = "search all keyword successfully"
             elif operate == "search":
-                logger.info(f"Searching keywords for project '{project_name}' with parameters: {parameters}")
-                keywords = search_keyword(project_name, parameters)
+                logger.info(f"Searching keywords for project '{project_name}' with parameters: {log_payload(parameters)}")
+                with db_router.replica_reads():
+                    keywords, page = search_keyword(project_name, parameters)
                 code = 200
                 if keywords is None:
                     message = "no keywords match"
                     keywords = []
                 else:
                     message = "search keywords successfully"
+                    fields = get_fields(KeyWord, parameters)
             else:
                 logger.error(f"Unsupported operation '{operate}' in request")
                 code = 400
                 message = "Unsupported operation"
                 return JsonResponse({"code": code, "message": message}, status=code)
+        except RequestDataTooBig as e:
+            return request_too_large(e)
         except Exception as e:
             logger.error(f"Exception occurred: {e}", exc_info=True)
             return JsonResponse({'error': f"except:{e}, type:{type(e)}"}, status=400)
         else:
-            # serialize返回的字符串是json数组，所以再通过json.loads转换
+            # 直接从 .values() 编码为 model/pk/fields 结构，不再 serialize → json.loads → JsonResponse 三次处理
             logger.info(f"Operation '{operate}' completed successfully for project '{project_name}'")
-            return JsonResponse(
-                {
-                    "code": code,
-                    "message": message,
-                    "keyword": json.loads(serialize("json", keywords)),
-                },
-                status=200
+            return model_list_response(
+                "keyword",
+                keywords,
+                code=code,
+                message=message,
+                fields=fields,
+                extra={"page": page} if page is not None else None,
+                stream=operate in ("show_all", "search"),
             )
     else:
         logger.error("Received non-POST request")
@@ -538,12 +894,10 @@ def create_keyword(project_name, parameters):
         if field not in parameters:
             raise ValidationError(f"Missing required field: {field}")
 
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
 
-    with transaction.atomic():
+    with transaction.atomic(using=sharding.alias_for(project.id)):
+        cache.bump_project(project.id)
         # 设置关键字
         new_keyword = KeyWord.objects.create(
             name=parameters['name'],
@@ -579,10 +933,7 @@ def create_keyword(project_name, parameters):
 def update_keyword(project_name, parameters):
     # 修改是针对已有的keyword进行修改，先根据源信息找到要修改的对象new_keyword
     # name为空，即修改本keyword；name不为空，则是要把本keyword的name修改掉
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
 
     new_keyword = KeyWord.objects.filter(project=project, name=parameters['update_source_name']).first()
     if not new_keyword:
@@ -596,29 +947,31 @@ def update_keyword(project_name, parameters):
     new_keyword.headers = parameters.get("headers", new_keyword.headers)
     new_keyword.body = parameters.get("body", new_keyword.body)
 
-    new_keyword.full_clean()
-    new_keyword.save()
+    with transaction.atomic(using=sharding.alias_for(project.id)):
+        cache.bump_project(project.id)
+        new_keyword.full_clean()
+        new_keyword.save()
 
-    # 处理断言
-    assertions_data = parameters.get('assertions', [])
-    if assertions_data:
-        # 清除现有的断言，然后每个断言重新配置一遍
-        new_keyword.assertions.all().delete()
-        for assertion_data in assertions_data:
-            target_value = assertion_data.get('target_value')
-            operator = assertion_data.get('operator')
-            if not target_value or not operator:
-                raise ValidationError(
-                    "Both 'target_value' and 'operator' are required and cannot be empty for each assertion")
+        # 处理断言
+        assertions_data = parameters.get('assertions', [])
+        if assertions_data:
+            # 清除现有的断言，然后每个断言重新配置一遍
+            new_keyword.assertions.all().delete()
+            for assertion_data in assertions_data:
+                target_value = assertion_data.get('target_value')
+                operator = assertion_data.get('operator')
+                if not target_value or not operator:
+                    raise ValidationError(
+                        "Both 'target_value' and 'operator' are required and cannot be empty for each assertion")
 
-            compared_value = assertion_data.get('compared_value', None)
+                compared_value = assertion_data.get('compared_value', None)
 
-            Assertion.objects.create(
-                target_value=target_value,
-                operator=operator,
-                compared_value=compared_value,
-                keyword=new_keyword
-            )
+                Assertion.objects.create(
+                    target_value=target_value,
+                    operator=operator,
+                    compared_value=compared_value,
+                    keyword=new_keyword
+                )
 
     new_keyword_query = KeyWord.objects.filter(id=new_keyword.id)
     return new_keyword_query
@@ -626,10 +979,7 @@ def update_keyword(project_name, parameters):
 
 def delete_keyword(project_name, parameters):
     # delete操作，暂时对齐前端勾选逻辑
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
 
     delete_name_list = parameters.get('delete_name_list', [])
     for name in delete_name_list:
@@ -638,32 +988,34 @@ def delete_keyword(project_name, parameters):
     keyword_to_delete = KeyWord.objects.filter(project=project, name__in=parameters['delete_name_list'])
     if not keyword_to_delete.exists():
         raise ValidationError("No matching keywords found for delete")
-    keyword_to_delete.delete()
+    with transaction.atomic(using=sharding.alias_for(project.id)):
+        cache.bump_project(project.id)
+        keyword_to_delete.delete()
     remaining_keywords = KeyWord.objects.filter(name__in=parameters['delete_name_list'])
     return remaining_keywords
 
 
+def import_keyword(project_name, parameters):
+    project = cache.get_project(project_name)
+    return importer.import_keywords(project, _import_records(parameters), strict=bool(parameters.get("strict", False)))
+
+
 def show_all_keyword(project_name, parameters):
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
     return KeyWord.objects.filter(project=project)
 
 
 def search_keyword(project_name, parameters):
-    try:
-        project = Project.objects.get(name=project_name)
-    except Project.DoesNotExist:
-        raise ValidationError(f"Project '{project_name}' not found")
+    project = cache.get_project(project_name)
 
     name = parameters.get("name")
     if not name:
         raise ValidationError('Must provide keyword name for searching')
-    keywords = KeyWord.objects.filter(project=project, name__icontains=name)
-    if not keywords.exists():
-        return None  # 返回 None 表示没有找到对应的关键字
-    return keywords
+    # 按 name / url 索引搜索，按相关度排序
+    keywords, page = search.search(KeyWord, project, name, parameters)
+    if not keywords:
+        return None, None  # 返回 None 表示没有找到对应的关键字
+    return keywords, page
 
 
 """
@@ -681,7 +1033,7 @@ def project(request):
     # create update delete show_all search
     if request.method == 'POST':
         try:
-            logger.info(request.body.decode('utf-8'))
+            logger.info(log_payload(request.body))
             source_data = json.loads(request.body)
             operate = source_data["operate"]
             parameters = source_data["parameters"]
@@ -692,7 +1044,9 @@ def project(request):
             elif operate == "delete":
                 code, message, projects = delete_project(parameters)
             elif operate == "show_all":
-                code, message, projects = show_all_project(parameters)
+                with db_router.replica_reads():
+                    code, message, projects = show_all_project(parameters)
+                    projects = db_router.bind(projects)
             else:
                 code = 400
                 message = "Unsupported operation"
@@ -703,19 +1057,13 @@ def project(request):
                     },
                     status=code
                 )
+        except RequestDataTooBig as e:
+            return request_too_large(e)
         except Exception as e:
             logger.info(f"except:{e}, type:{type(e)}")
             return JsonResponse({'error': f"except:{e}, type:{type(e)}"}, status=400)
         else:
-        # serialize函数:Django的serialize函数可以将QuerySet对象序列化为JSON格式，适合用于API响应。
-            return JsonResponse(
-                {
-                    "code": code,
-                    "message": message,
-                    "testcases": json.loads(serialize("json", projects)),
-                },
-                status=200
-            )
+            return model_list_response("testcases", projects, code=code, message=message, stream=operate == "show_all")
 
     else:
         return JsonResponse({'error': 'Only POST requests are allowed'}, status=405)
@@ -724,7 +1072,11 @@ def project(request):
 def create_project(parameters):
     serializer = ProjectSerializer(data=parameters)
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            cache.bump_projects()
+            serializer.save()
+        # 新项目放到 TESTBENCH_NEW_PROJECT_SHARD 指定的分片
+        sharding.place_project(serializer.instance)
         return 200, "create project success", Project.objects.filter(id=serializer.instance.id)
     return 400, serializer.errors, []
 
@@ -738,7 +1090,10 @@ def update_project(parameters):
     update_data = {k: v for k, v in parameters.items() if k in ["name", "description"]}
     serializer = ProjectSerializer(project, data=update_data, partial=True)
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            cache.bump_projects()
+            serializer.save()
+        sharding.sync_project(serializer.instance)
         return 200, "update project success", Project.objects.filter(id=serializer.instance.id)
     return 400, serializer.errors, []
 
@@ -756,11 +1111,15 @@ def delete_project(parameters):
         try:
             # 检查项目是否包含自动化用例，虽然级联了用例表，但这样操作，可以减少数据库操作，不是依赖数据库级联删除
             project = Project.objects.get(name=name)
-            if Testcase.objects.filter(project=project).exists():
+            # 通过关联管理器查询，路由到项目所在分片
+            if project.testcases.exists():
                 failed_to_delete_projects.append(name)
                 logger.info(f"Project '{name}' has automated test cases and cannot be deleted")
             else:
-                project.delete()
+                sharding.drop_project(project)
+                with transaction.atomic():
+                    cache.bump_projects()
+                    project.delete()
                 deleted_projects.append(project)
         except Project.DoesNotExist:
             logger.info(f"Project '{name}' not found")
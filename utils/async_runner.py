@@ -0,0 +1,197 @@
+# async_runner.py
+"""
+asyncio 执行模式：在一个事件循环上并发执行成千上万个用例，用例内部仍按 order 顺序执行步骤。
+并发由两级信号量控制：全局在途请求上限 + 每个目标 host 的在途请求上限；
+执行计划、断言编译与结果结构与 test_runner（线程池模式）完全一致。
+
+依赖 aiohttp（见 requirements.txt）。
+"""
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - 仅在未安装 aiohttp 时触发
+    aiohttp = None
+
+from utils.test_runner import (
+    DEFAULT_TIMEOUT, StepResponse, StepTiming, load_plans, new_step_results, plan_result, record_error,
+    record_response, request_kwargs, summarize,
+)
+
+DEFAULT_GLOBAL_LIMIT = 500
+DEFAULT_PER_HOST_LIMIT = 50
+
+
+# ===================== 并发控制：全局 + 每 host 信号量 =====================
+class ConcurrencyLimiter:
+    """
+    每个请求先拿 host 名额再拿全局名额：排在已满 host 后面的请求不占全局名额，慢 host 不会拖住其他 host；
+    host 信号量按 scheme://host:port 懒创建
+    """
+
+    def __init__(self, global_limit=DEFAULT_GLOBAL_LIMIT, per_host_limit=DEFAULT_PER_HOST_LIMIT):
+        self.per_host_limit = per_host_limit
+        self._global = asyncio.Semaphore(global_limit)
+        self._hosts: dict[tuple, asyncio.Semaphore] = {}
+
+    def host(self, url: str) -> asyncio.Semaphore:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        sem = self._hosts.get(key)
+        if sem is None:
+            # 单线程事件循环内，get/set 之间不会被切换，无需加锁
+            sem = self._hosts[key] = asyncio.Semaphore(self.per_host_limit)
+        return sem
+
+    @property
+    def global_(self) -> asyncio.Semaphore:
+        return self._global
+
+
+# ===================== 分阶段耗时：aiohttp TraceConfig =====================
+def _trace_timing(params_ctx) -> StepTiming | None:
+    return params_ctx.trace_request_ctx
+
+
+async def _on_connection_create_start(session, ctx, params):
+    ctx.create_started = time.perf_counter()
+
+
+async def _on_dns_resolvehost_start(session, ctx, params):
+    ctx.dns_started = time.perf_counter()
+
+
+async def _on_dns_resolvehost_end(session, ctx, params):
+    timing = _trace_timing(ctx)
+    if timing is not None:
+        timing.dns = time.perf_counter() - ctx.dns_started
+
+
+async def _on_connection_create_end(session, ctx, params):
+    timing = _trace_timing(ctx)
+    if timing is not None:
+        timing.ready = time.perf_counter()
+        timing.reused = False
+        # aiohttp 的建连（loop.create_connection）包含 TLS 握手，无法单独测量
+        timing.connect = timing.ready - ctx.create_started - timing.dns
+        if ctx.secure:
+            timing.tls = None
+
+
+async def _on_connection_reuseconn(session, ctx, params):
+    timing = _trace_timing(ctx)
+    if timing is not None:
+        timing.ready = time.perf_counter()
+        timing.reused = True
+
+
+async def _on_request_start(session, ctx, params):
+    ctx.secure = params.url.scheme == "https"
+
+
+async def _on_request_end(session, ctx, params):
+    # 在读完响应头之后触发
+    timing = _trace_timing(ctx)
+    if timing is not None:
+        timing.headers_at = time.perf_counter()
+
+
+def timing_trace_config():
+    """记录 StepTiming 的 TraceConfig；请求通过 trace_request_ctx 传入各自的 StepTiming"""
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    trace.on_connection_create_start.append(_on_connection_create_start)
+    trace.on_dns_resolvehost_start.append(_on_dns_resolvehost_start)
+    trace.on_dns_resolvehost_end.append(_on_dns_resolvehost_end)
+    trace.on_connection_create_end.append(_on_connection_create_end)
+    trace.on_connection_reuseconn.append(_on_connection_reuseconn)
+    trace.on_request_end.append(_on_request_end)
+    return trace
+
+
+def _params_items(params: dict) -> list[tuple[str, str]]:
+    """与 requests 一致的 query 编码：None 丢弃，list/tuple 展开为重复 key，其他值转字符串"""
+    items = []
+    for k, v in (params or {}).items():
+        if v is None:
+            continue
+        values = v if isinstance(v, (list, tuple)) else [v]
+        items.extend((str(k), str(x)) for x in values if x is not None)
+    return items
+
+
+async def _send(session, step: dict, timeout, limiter: ConcurrencyLimiter) -> StepResponse:
+    kwargs = request_kwargs(step)
+    headers = {str(k): str(v) for k, v in (kwargs["headers"] or {}).items()}
+    async with limiter.host(kwargs["url"]), limiter.global_:
+        started = time.perf_counter()
+        timing = StepTiming(started)
+        async with session.request(
+            kwargs["method"],
+            kwargs["url"],
+            headers=headers,
+            params=_params_items(kwargs["params"]),
+            json=kwargs["json"],
+            data=kwargs["data"],
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            trace_request_ctx=timing,
+        ) as raw:
+            content = await raw.read()
+        timing.finished = time.perf_counter()
+        elapsed_ms = round((timing.finished - started) * 1000, 3)
+    return StepResponse(raw.status, raw.headers, content, raw.charset, elapsed_ms, timing.as_dict())
+
+
+async def run_plan(plan: dict, session, limiter: ConcurrencyLimiter, timeout=DEFAULT_TIMEOUT) -> dict:
+    started = time.perf_counter()
+    step_results = new_step_results(plan)
+    status = "passed"
+
+    for step, result in zip(plan["steps"], step_results):
+        step_started = time.perf_counter()
+        try:
+            resp = await _send(session, step, timeout, limiter)
+        except Exception as e:
+            # 除网络错误外，aiohttp 对无法编码的 body / data 抛 TypeError 等：与线程模式一样记为该步 error，不影响其他用例
+            record_error(result, e, step_started)
+            status = "error"
+            break
+
+        result["duration_ms"] = resp.elapsed_ms
+        if not record_response(result, step, resp):
+            status = "failed"
+            break
+
+    return plan_result(plan, status, step_results, started)
+
+
+async def run_plans_async(plans: list[dict], global_limit=DEFAULT_GLOBAL_LIMIT,
+                          per_host_limit=DEFAULT_PER_HOST_LIMIT, timeout=DEFAULT_TIMEOUT):
+    if aiohttp is None:
+        raise RuntimeError("async mode requires aiohttp, please `pip install aiohttp`")
+
+    global_limit = max(1, int(global_limit))
+    per_host_limit = max(1, min(int(per_host_limit), global_limit))
+    limiter = ConcurrencyLimiter(global_limit, per_host_limit)
+    # 连接池与信号量同规格；DummyCookieJar 保持"每步不带 cookie"的语义
+    connector = aiohttp.TCPConnector(limit=global_limit, limit_per_host=per_host_limit)
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(),
+                                     trace_configs=[timing_trace_config()]) as session:
+        results = await asyncio.gather(*(run_plan(plan, session, limiter, timeout) for plan in plans))
+    return list(results), summarize(results, (time.perf_counter() - started) * 1000)
+
+
+def run_plans(plans: list[dict], global_limit=DEFAULT_GLOBAL_LIMIT, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+              timeout=DEFAULT_TIMEOUT):
+    """同步入口：在新事件循环里跑完所有用例，返回 (results, summary)"""
+    return asyncio.run(run_plans_async(plans, global_limit, per_host_limit, timeout))
+
+
+# ===================== 主入口 =====================
+def run_testcases(project_name: str, titles=None, global_limit=DEFAULT_GLOBAL_LIMIT,
+                  per_host_limit=DEFAULT_PER_HOST_LIMIT, timeout=DEFAULT_TIMEOUT):
+    plans = load_plans(project_name, titles)
+    return run_plans(plans, global_limit=global_limit, per_host_limit=per_host_limit, timeout=timeout)
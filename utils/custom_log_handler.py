@@ -1,29 +1,278 @@
+import logging
 import os
-from datetime import datetime
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import reprlib
+import time
+import weakref
+from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+DEFAULT_QUEUE_SIZE = 10000
+# 后台线程一次最多取出并写入的记录数
+BATCH_SIZE = 500
+# flush 时等待后台线程写完队列里已有记录的最长秒数
+FLUSH_TIMEOUT = 5
+# 日志文件名里的时间戳格式（_get_log_filename），按它判断文件是否过期
+FILENAME_TIMESTAMP = '%Y-%m-%d_%H-%M'
+
 
 class CustomRotatingFileHandler(RotatingFileHandler):
-    def __init__(self, base_name, log_dir, *args, **kwargs):
+    def __init__(self, base_name, log_dir, *args, retention_days=0, **kwargs):
         self.base_name = base_name
         self.log_dir = log_dir
-        self.current_date = datetime.now().strftime('%Y-%m-%d')  # 记录当前日期
+        self.retention_days = retention_days  # 删除多少天之前的日志文件，0 表示不删除
+        self.rollover_at = self._next_midnight()  # 下一次按日期轮转的时间点
         super().__init__(self._get_log_filename(), *args, **kwargs)
+        self.bytes_written = self._current_size()
+        self._remove_old_files()
 
     def _get_log_filename(self):
         """动态生成日志文件名，精确到分钟"""
-        timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M')  # 当前时间戳（精确到分钟）
+        timestamp = datetime.now().strftime(FILENAME_TIMESTAMP)  # 当前时间戳（精确到分钟）
         return os.path.join(self.log_dir, f"{self.base_name}_{timestamp}.log")
 
+    @staticmethod
+    def _next_midnight() -> float:
+        """下一个本地零点的时间戳；每条日志只和它比较一次，不再每条都 strftime 检查日期"""
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+    def _current_size(self) -> int:
+        try:
+            return os.path.getsize(self.baseFilename)
+        except OSError:
+            return 0
+
     def doRollover(self):
         """在日志轮转时更新文件名"""
-        self.stream.close()
+        if self.stream:
+            self.stream.close()
+        self.rollover_at = self._next_midnight()
         self.baseFilename = self._get_log_filename()
         self.stream = self._open()
+        self.bytes_written = self._current_size()
+        self._remove_old_files()
+
+    def _remove_old_files(self):
+        """删除文件名时间戳早于 retention_days 天前的日志（一个文件最多跨到下一个零点，按创建时间判断即可）"""
+        if self.retention_days <= 0:
+            return
+        cutoff = datetime.now() - timedelta(days=self.retention_days)
+        prefix = f"{self.base_name}_"
+        for name in os.listdir(self.log_dir):
+            if not (name.startswith(prefix) and name.endswith(".log")):
+                continue
+            try:
+                created = datetime.strptime(name[len(prefix):-len(".log")], FILENAME_TIMESTAMP)
+            except ValueError:
+                # 其他 handler 的文件（如 base_name 为 project 时的 project_xxx_...）或手工放入的文件
+                continue
+            if created < cutoff and os.path.join(self.log_dir, name) != self.baseFilename:
+                try:
+                    os.remove(os.path.join(self.log_dir, name))
+                except OSError:
+                    pass
+
+    def emit(self, record):
+        try:
+            self.write_records([record])
+        except Exception:
+            self.handleError(record)
+
+    def write_records(self, records):
+        """
+        格式化并写入一批记录，最后只 flush 一次。
+        跨天按 record.created 与预先算好的零点比较；大小按累计写入字节数判断，不像父类那样为算长度把记录再格式化一遍
+        """
+        if self.stream is None:
+            self.stream = self._open()
+        encoding = self.encoding or "utf-8"
+        chunks = []
+        for record in records:
+            msg = self.format(record) + self.terminator
+            size = len(msg.encode(encoding, "replace"))
+            if record.created >= self.rollover_at or (
+                    self.maxBytes > 0 and self.bytes_written and self.bytes_written + size > self.maxBytes):
+                if chunks:
+                    self.stream.write("".join(chunks))
+                    chunks = []
+                self.doRollover()
+            chunks.append(msg)
+            self.bytes_written += size
+        if chunks:
+            self.stream.write("".join(chunks))
+        self.stream.flush()
+
+
+# ===================== 队列 + 后台写线程 =====================
+class BatchingQueueListener(QueueListener):
+    """
+    后台写线程：阻塞取到一条后，用 get_nowait() 把队列里已有的记录（最多 batch_size 条）一起取出，
+    整批交给 target.write_records()，一批只写一次、flush 一次；task_done() 仍按条调用，flush() 据此等待写完
+    """
+
+    def __init__(self, queue, target, batch_size=BATCH_SIZE):
+        super().__init__(queue, target)
+        self.target = target
+        self.batch_size = batch_size
+
+    def _monitor(self):
+        q = self.queue
+        stopping = False
+        while not stopping:
+            batch = [q.get()]
+            while batch[-1] is not self._sentinel and len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is self._sentinel:
+                stopping = True
+            records = [record for record in batch if record is not self._sentinel and self.target.filter(record)]
+            try:
+                if records:
+                    self.target.acquire()
+                    try:
+                        self.target.write_records(records)
+                    finally:
+                        self.target.release()
+            except Exception:
+                self.target.handleError(records[0])
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+
+class QueuedRotatingFileHandler(QueueHandler):
+    """
+    参数与 CustomRotatingFileHandler 相同，外加 queue_size。
+    标准库 QueueHandler + BatchingQueueListener：级别 / filter 在调用线程上判断，prepare() 也在调用线程上把消息和异常堆栈
+    格式化成文本（之后 args / exc_info 被清空，入队后对象再变化不影响日志内容）；写文件、轮转由后台线程按批完成，
+    请求线程不等磁盘 IO。队列满时丢弃（不阻塞请求），下一条入队前补记一条 WARNING。
+    fork 出的子进程（manage.py serve 的 worker）里重新创建队列，后台线程在第一次写日志时启动。
+    """
+
+    def __init__(self, base_name, log_dir, *args, queue_size=DEFAULT_QUEUE_SIZE, **kwargs):
+        self.target = CustomRotatingFileHandler(base_name, log_dir, *args, **kwargs)
+        self.queue_size = queue_size
+        super().__init__(queue.Queue(queue_size))
+        self.listener = None
+        self.dropped = 0
+        _queued_handlers.add(self)
+
+    def setFormatter(self, fmt):
+        # 格式（asctime / levelname 等）由写文件的 handler 加；prepare() 用默认格式只得到 消息 + 异常堆栈
+        self.target.setFormatter(fmt)
 
     def emit(self, record):
-        """每次写日志时检查日期是否变化"""
-        new_date = datetime.now().strftime('%Y-%m-%d')
-        if new_date != self.current_date:  # 如果日期变化，强制更新日志文件
-            self.current_date = new_date
-            self.doRollover()
-        super().emit(record)
\ No newline at end of file
+        if self.listener is None:
+            self._start()
+        super().emit(record)
+
+    def enqueue(self, record):
+        if self.dropped and self.queue.qsize() < self.queue_size:
+            dropped, self.dropped = self.dropped, 0
+            self.enqueue(logging.makeLogRecord({
+                "name": record.name, "levelno": logging.WARNING, "levelname": "WARNING",
+                "module": "custom_log_handler", "msg": f"log queue full, {dropped} records dropped",
+            }))
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self.lock:
+            if self.listener is None:
+                self.listener = BatchingQueueListener(self.queue, self.target)
+                self.listener.start()
+
+    def flush(self):
+        # 后台线程每写完一批都会 flush；这里（logging.shutdown、显式 flush）只需等它把队列里已有的记录写完
+        if self.listener is None:
+            return
+        deadline = time.monotonic() + FLUSH_TIMEOUT
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        # stop() 先写完队列里剩下的记录再结束后台线程
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.target.close()
+        super().close()
+
+    def _before_fork(self):
+        # 拿住写文件 handler 的锁：fork 时后台线程不在写文件中途（文件对象内部的锁不会以加锁状态带进子进程）
+        self.target.acquire()
+
+    def _after_fork_in_parent(self):
+        self.target.release()
+
+    def _after_fork_in_child(self):
+        # 子进程里没有后台线程：换新队列，第一次写日志时再启动；target 的锁由 logging 模块在子进程里重新初始化
+        self.queue = queue.Queue(self.queue_size)
+        self.listener = None
+        self.dropped = 0
+
+
+_queued_handlers = weakref.WeakSet()
+
+
+def _before_fork():
+    for handler in list(_queued_handlers):
+        handler._before_fork()
+
+
+def _after_fork_in_parent():
+    for handler in list(_queued_handlers):
+        handler._after_fork_in_parent()
+
+
+def _after_fork_in_child():
+    for handler in list(_queued_handlers):
+        handler._after_fork_in_child()
+
+
+os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent, after_in_child=_after_fork_in_child)
+
+
+# ===================== 请求体 / parameters 日志 =====================
+def _payload_repr(max_bytes: int) -> reprlib.Repr:
+    # 每次调用新建：多个请求线程同时记录时不共享、不修改同一个 Repr 的限长参数
+    payload_repr = reprlib.Repr()
+    payload_repr.maxlevel = 4
+    payload_repr.maxdict = payload_repr.maxlist = payload_repr.maxtuple = 50
+    payload_repr.maxstring = payload_repr.maxother = max_bytes
+    return payload_repr
+
+
+def log_payload(value) -> str:
+    """
+    请求体、parameters 写日志前调用：按 settings.TESTBENCH_LOG_PAYLOAD_SAMPLE_RATE 采样，
+    超过 TESTBENCH_LOG_PAYLOAD_MAX_BYTES 的部分截断；未采中的只记一个占位。
+    截断在序列化前完成（bytes 先切片、dict 用限长 repr），几 MB 的批量导入请求也不会在请求线程上整体编码一遍
+    """
+    from django.conf import settings
+
+    sample_rate = getattr(settings, "TESTBENCH_LOG_PAYLOAD_SAMPLE_RATE", 1.0)
+    if sample_rate < 1 and random.random() >= sample_rate:
+        return "<payload not sampled>"
+
+    max_bytes = getattr(settings, "TESTBENCH_LOG_PAYLOAD_MAX_BYTES", 0)
+    if isinstance(value, (bytes, bytearray)):
+        if max_bytes and len(value) > max_bytes:
+            return bytes(value[:max_bytes]).decode("utf-8", "ignore") + f"...<truncated, {len(value)} bytes>"
+        return bytes(value).decode("utf-8", "replace")
+    if not max_bytes:
+        return str(value)
+    if isinstance(value, str):
+        if len(value) > max_bytes:
+            return value[:max_bytes] + f"...<truncated, {len(value)} chars>"
+        return value
+    text = _payload_repr(max_bytes).repr(value)
+    if len(text) > max_bytes:
+        return text[:max_bytes] + "...<truncated>"
+    return text
@@ -0,0 +1,466 @@
+# load_runner.py
+"""
+性能用例（Testcase.type = performance_case）的压测模式：把用例的整条步骤链作为一次迭代，
+在设定时长内按目标到达率（rps，开环）或固定并发（concurrency，闭环）反复执行，支持预热和线性加压。
+迭代与每个步骤的耗时记入固定内存的直方图，返回吞吐量与 p50/p90/p99/max，
+并对步骤上的 ${stats} 聚合断言（如 ${stats}.p99 less_than 200）按全部样本判定。
+
+步骤发送、断言判定复用 async_runner / test_runner（与 mode=async 的执行结果一致），依赖 aiohttp。
+"""
+import asyncio
+import math
+import time
+from array import array
+
+from django.core.exceptions import ValidationError
+
+from utils import async_runner
+from utils.test_runner import (
+    DEFAULT_TIMEOUT, check, load_plans, new_step_results, plan_result, record_error, summarize,
+)
+
+PERFORMANCE_TYPE = "performance_case"
+
+DEFAULT_DURATION = 30
+DEFAULT_MAX_INFLIGHT = 1000
+MAX_DURATION = 3600
+MAX_CONCURRENCY = 2000
+MAX_RPS = 10000
+# 每个用例最多返回的不同错误信息条数
+MAX_ERROR_KINDS = 10
+
+
+# ===================== 直方图：固定内存的对数-线性分桶 =====================
+class LatencyHistogram:
+    """
+    与 HdrHistogram 同思路的分桶：以微秒计，128µs 以下每微秒一个桶，之后每翻一倍分 64 个桶，
+    分位数相对误差不超过 1/64（约 1.6%）。上限 1 小时，共 1728 个桶，内存与样本数无关；
+    count / min / max / 总和精确记录。
+    """
+
+    SUB_BUCKETS = 64
+    LINEAR_LIMIT = 2 * SUB_BUCKETS
+    MAX_US = 3600 * 1000 * 1000
+    SIZE = LINEAR_LIMIT + (MAX_US.bit_length() - 7) * SUB_BUCKETS
+
+    def __init__(self):
+        self.counts = array("q", bytes(8 * self.SIZE))
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    @classmethod
+    def _index(cls, value_us: int) -> int:
+        if value_us < cls.LINEAR_LIMIT:
+            return value_us
+        shift = value_us.bit_length() - 7
+        return cls.LINEAR_LIMIT + (shift - 1) * cls.SUB_BUCKETS + (value_us >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def _bounds(cls, index: int) -> tuple[int, int]:
+        """桶覆盖的 [最小值, 最大值]（微秒）"""
+        if index < cls.LINEAR_LIMIT:
+            return index, index
+        shift, offset = divmod(index - cls.LINEAR_LIMIT, cls.SUB_BUCKETS)
+        shift += 1
+        low = (offset + cls.SUB_BUCKETS) << shift
+        return low, low + (1 << shift) - 1
+
+    def record(self, seconds: float):
+        value_us = min(max(int(seconds * 1_000_000), 0), self.MAX_US)
+        self.counts[self._index(value_us)] += 1
+        self.count += 1
+        self.total_us += value_us
+        if self.min_us is None or value_us < self.min_us:
+            self.min_us = value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, n in enumerate(other.counts):
+            if n:
+                self.counts[index] += n
+        self.count += other.count
+        self.total_us += other.total_us
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+
+    def to_dict(self) -> dict:
+        """稀疏形式（只保留非空桶），可 JSON 序列化，用于持久化后继续合并"""
+        return {
+            "buckets": {str(index): n for index, n in enumerate(self.counts) if n},
+            "count": self.count,
+            "total_us": self.total_us,
+            "min_us": self.min_us,
+            "max_us": self.max_us,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        hist = cls()
+        for index, n in (data.get("buckets") or {}).items():
+            hist.counts[int(index)] = n
+        hist.count = data.get("count", 0)
+        hist.total_us = data.get("total_us", 0)
+        hist.min_us = data.get("min_us")
+        hist.max_us = data.get("max_us", 0)
+        return hist
+
+    def percentiles(self, ps) -> dict:
+        """
+        一次累加遍历得到多个 nearest-rank 分位数（毫秒），取所在桶的中点并限制在实际 min / max 之内；
+        没有样本时均为 None
+        """
+        if not self.count:
+            return {p: None for p in ps}
+        pending = sorted((max(1, math.ceil(p / 100 * self.count)), p) for p in ps)
+        values = {}
+        seen = 0
+        for index, n in enumerate(self.counts):
+            if not n:
+                continue
+            seen += n
+            while pending and seen >= pending[0][0]:
+                low, high = self._bounds(index)
+                value = min(max((low + high) / 2, self.min_us), self.max_us)
+                values[pending.pop(0)[1]] = round(value / 1000, 3)
+            if not pending:
+                break
+        return values
+
+    def percentile(self, p: float) -> float | None:
+        return self.percentiles([p])[p]
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0, "min_ms": None, "mean_ms": None, "p50_ms": None, "p90_ms": None,
+                    "p99_ms": None, "max_ms": None}
+        ps = self.percentiles([50, 90, 99])
+        return {
+            "count": self.count,
+            "min_ms": round(self.min_us / 1000, 3),
+            "mean_ms": round(self.total_us / self.count / 1000, 3),
+            "p50_ms": ps[50],
+            "p90_ms": ps[90],
+            "p99_ms": ps[99],
+            "max_ms": round(self.max_us / 1000, 3),
+        }
+
+
+# ===================== 压测参数 =====================
+def _number(parameters: dict, key: str, default=None, minimum=0.0, maximum=None, integer=False):
+    value = parameters.get(key, default)
+    if value is None:
+        return None
+    try:
+        value = int(value) if integer else float(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"{key} must be a number, got {value!r}")
+    if value < minimum:
+        raise ValidationError(f"{key} must be at least {minimum}, got {value}")
+    if maximum is not None and value > maximum:
+        raise ValidationError(f"{key} must be at most {maximum}, got {value}")
+    return value
+
+
+def load_profile(parameters: dict) -> dict:
+    """
+    从 run 的 parameters 解析压测参数（rps 与 concurrency 二选一）：
+      rps：目标每秒启动的迭代数（开环，慢了也按时发，max_inflight 为在途迭代上限，超出计为 dropped）
+      concurrency：虚拟用户数（闭环，每个用户上一轮结束立即开始下一轮）
+      duration：计入统计的时长（秒）；warmup：之前额外运行、不计入统计的秒数
+      ramp_up：从 0 线性加到目标 rps / 并发所用的秒数（从开始计，与 warmup 重叠的部分不计入统计）
+    """
+    rps = _number(parameters, "rps", minimum=0.001, maximum=MAX_RPS)
+    concurrency = _number(parameters, "concurrency", minimum=1, maximum=MAX_CONCURRENCY, integer=True)
+    if (rps is None) == (concurrency is None):
+        raise ValidationError("Load mode requires exactly one of rps / concurrency")
+    return {
+        "rps": rps,
+        "concurrency": concurrency,
+        "duration": _number(parameters, "duration", DEFAULT_DURATION, minimum=0.001, maximum=MAX_DURATION),
+        "warmup": _number(parameters, "warmup", 0, maximum=MAX_DURATION),
+        "ramp_up": _number(parameters, "ramp_up", 0, maximum=MAX_DURATION),
+        "max_inflight": _number(parameters, "max_inflight", DEFAULT_MAX_INFLIGHT, minimum=1,
+                                maximum=MAX_CONCURRENCY, integer=True),
+        "timeout": _number(parameters, "timeout", DEFAULT_TIMEOUT, minimum=0.001),
+    }
+
+
+def performance_plans(project_name: str, titles=None) -> list[dict]:
+    """titles 为空时取项目下全部性能用例；指定了非性能用例则报错"""
+    plans = load_plans(project_name, titles)
+    others = [p["title"] for p in plans if p["type"] != PERFORMANCE_TYPE]
+    if titles and others:
+        raise ValidationError(f"Load mode only runs {PERFORMANCE_TYPE} testcases: {sorted(others)}")
+    plans = [p for p in plans if p["type"] == PERFORMANCE_TYPE]
+    if not plans:
+        raise ValidationError(f"No {PERFORMANCE_TYPE} testcases in project '{project_name}'")
+    return plans
+
+
+# ===================== 统计 =====================
+class LoadStats:
+    """一个用例压测期间的累计结果；只统计预热结束后开始的迭代"""
+
+    def __init__(self, plan: dict):
+        self.iteration = LatencyHistogram()
+        self.steps = [LatencyHistogram() for _ in plan["steps"]]
+        self.step_failures = [0] * len(plan["steps"])
+        # 首字节耗时与新建 / 复用连接数：区分慢后端和冷连接
+        self.step_ttfb = [LatencyHistogram() for _ in plan["steps"]]
+        self.step_connections = [{"new": 0, "reused": 0} for _ in plan["steps"]]
+        self.status = {"passed": 0, "failed": 0, "error": 0}
+        self.warmup = 0
+        self.dropped = 0
+        self.errors: dict[str, int] = {}
+
+    def record(self, result: dict, latency: float):
+        self.status[result["status"]] += 1
+        self.iteration.record(latency)
+        for index, step in enumerate(result["steps"]):
+            if step["duration_ms"] is not None:
+                self.steps[index].record(step["duration_ms"] / 1000)
+            if step["status"] in ("failed", "error"):
+                self.step_failures[index] += 1
+            timing = step["timing"]
+            if timing is not None:
+                if timing["ttfb_ms"] is not None:
+                    self.step_ttfb[index].record(timing["ttfb_ms"] / 1000)
+                if timing["reused"] is not None:
+                    self.step_connections[index]["reused" if timing["reused"] else "new"] += 1
+        if result["status"] != "passed":
+            self._record_error(result)
+
+    def _record_error(self, result: dict):
+        for step in result["steps"]:
+            if step["status"] == "error":
+                message = step["error"]
+            elif step["status"] == "failed":
+                failed = next(a for a in step["assertions"] if not a["passed"])
+                message = f"{failed['target_value']} {failed['operator']} {failed['compared_value']}: {failed['message']}"
+            else:
+                continue
+            message = f"step {step['order']} {message}"
+            if message in self.errors or len(self.errors) < MAX_ERROR_KINDS:
+                self.errors[message] = self.errors.get(message, 0) + 1
+            return
+
+
+# ===================== ${stats} 聚合断言 =====================
+def _percentile_metric(metric: str):
+    return float(metric[1:]) if metric.startswith("p") else None
+
+
+def scope_stats(hist: LatencyHistogram, failures: int, duration: float, metrics) -> dict:
+    """一个范围（步骤 / 整个用例）的聚合指标；分位数只算断言里用到的，且一次遍历直方图得到"""
+    ps = {metric: _percentile_metric(metric) for metric in metrics if _percentile_metric(metric) is not None}
+    values = hist.percentiles(ps.values())
+    sampled = hist.count > 0
+    stats = {
+        "count": hist.count,
+        "min": round(hist.min_us / 1000, 3) if sampled else None,
+        "mean": round(hist.total_us / hist.count / 1000, 3) if sampled else None,
+        "max": round(hist.max_us / 1000, 3) if sampled else None,
+        "rps": round(hist.count / duration, 3),
+        "error_rate": round(failures / hist.count, 6) if sampled else None,
+    }
+    stats.update({metric: values[p] for metric, p in ps.items()})
+    return stats
+
+
+def evaluate_stats_assertions(assertions: list[dict], stats_by_scope: dict) -> list[dict]:
+    """结果结构与 test_runner.evaluate_assertions 相同"""
+    results = []
+    for a in assertions:
+        item = {
+            "target_value": a["target_value"],
+            "operator": a["operator"],
+            "compared_value": a["compared_value"],
+            "passed": False,
+            "actual": None,
+            "message": a["error"],
+        }
+        if a["error"] is None:
+            actual = stats_by_scope[a["scope"]][a["metric"]]
+            item["actual"] = actual
+            if actual is None:
+                item["message"] = "no samples"
+            else:
+                try:
+                    if check(a, actual):
+                        item["passed"] = True
+                    else:
+                        item["message"] = "assertion failed"
+                except TypeError as e:
+                    item["message"] = f"TypeError: {e}"
+        results.append(item)
+    return results
+
+
+def _arrival_time(k: int, rps: float, ramp_up: float) -> float:
+    """
+    第 k 次迭代的计划启动时刻（相对开始）：加压期间到达率从 0 线性升到 rps，
+    累计到达数 N(t) = rps·t²/(2·ramp_up)，之后 N(t) = rps·ramp_up/2 + rps·(t - ramp_up)，这里取其反函数
+    """
+    if ramp_up and k <= rps * ramp_up / 2:
+        return math.sqrt(2 * ramp_up * k / rps)
+    return ramp_up / 2 + k / rps
+
+
+# ===================== 执行 =====================
+async def _open_loop(run_one, stats: LoadStats, profile: dict, start: float, end: float):
+    """
+    开环：按计划时刻启动迭代，不等上一轮结束；耗时从计划时刻算起，服务变慢时排队时间计入耗时，
+    不会因发压端等待而低估（coordinated omission）
+    """
+    loop = asyncio.get_running_loop()
+    inflight = set()
+    k = 0
+    while True:
+        scheduled = start + _arrival_time(k, profile["rps"], profile["ramp_up"])
+        if scheduled >= end:
+            break
+        k += 1
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            # 落后于计划时也让出一次事件循环，已创建的迭代才能开始执行、结束后腾出在途名额
+            await asyncio.sleep(0)
+        if len(inflight) >= profile["max_inflight"]:
+            if scheduled - start >= profile["warmup"]:
+                stats.dropped += 1
+            continue
+        task = asyncio.create_task(run_one(scheduled))
+        inflight.add(task)
+        task.add_done_callback(inflight.discard)
+    if inflight:
+        await asyncio.gather(*inflight)
+
+
+async def _closed_loop(run_one, profile: dict, start: float, end: float):
+    """闭环：concurrency 个虚拟用户在加压期间均匀依次启动，每轮结束后立即开始下一轮"""
+    loop = asyncio.get_running_loop()
+    users = profile["concurrency"]
+
+    async def user(index):
+        delay = start + profile["ramp_up"] * index / users - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        while loop.time() < end:
+            await run_one(loop.time())
+
+    await asyncio.gather(*(user(i) for i in range(users)))
+
+
+async def run_plan(plan: dict, session, profile: dict) -> dict:
+    loop = asyncio.get_running_loop()
+    stats = LoadStats(plan)
+    limit = profile["concurrency"] or profile["max_inflight"]
+    limiter = async_runner.ConcurrencyLimiter(limit, limit)
+    started = time.perf_counter()
+    start = loop.time()
+    measure_from = start + profile["warmup"]
+    end = measure_from + profile["duration"]
+
+    async def run_one(scheduled):
+        iteration_started = time.perf_counter()
+        try:
+            result = await async_runner.run_plan(plan, session, limiter, profile["timeout"])
+        except Exception as e:
+            # 单次迭代的意外异常记为一次 error 迭代，不中断整个压测、不丢掉已收集的样本
+            step_results = new_step_results(plan)
+            if step_results:
+                record_error(step_results[0], e, iteration_started)
+            result = plan_result(plan, "error", step_results, iteration_started)
+        if scheduled < measure_from:
+            stats.warmup += 1
+        else:
+            stats.record(result, loop.time() - scheduled)
+
+    if profile["rps"] is not None:
+        await _open_loop(run_one, stats, profile, start, end)
+    else:
+        await _closed_loop(run_one, profile, start, end)
+
+    duration = profile["duration"]
+    iterations = stats.iteration.count
+    requests = sum(hist.count for hist in stats.steps)
+
+    # 聚合断言：每个范围的指标只算一次，供该范围的所有断言共用
+    stats_assertions = [a for step in plan["steps"] for a in step["stats_assertions"]]
+    failures = stats.status["failed"] + stats.status["error"]
+    testcase_stats = scope_stats(stats.iteration, failures, duration,
+                                 {a["metric"] for a in stats_assertions if a["scope"] == "testcase"})
+    step_results = []
+    for index, (step, hist) in enumerate(zip(plan["steps"], stats.steps)):
+        step_stats = scope_stats(hist, stats.step_failures[index], duration,
+                                 {a["metric"] for a in step["stats_assertions"] if a["scope"] == "step"})
+        step_results.append({
+            "order": step["order"], "keyword": step["keyword"], "method": step["method"], "url": step["url"],
+            "latency": hist.summary(),
+            "ttfb": stats.step_ttfb[index].summary(),
+            "connections": stats.step_connections[index],
+            "error_rate": step_stats["error_rate"],
+            "assertions": evaluate_stats_assertions(
+                step["stats_assertions"], {"step": step_stats, "testcase": testcase_stats}),
+        })
+
+    # 有 error_rate 聚合断言时，失败迭代的容忍比例由它判定；否则任何失败迭代都使用例不通过
+    tolerates_failures = any(a["metric"] == "error_rate" for a in stats_assertions)
+    if any(not a["passed"] for step in step_results for a in step["assertions"]):
+        status = "failed"
+    elif tolerates_failures:
+        status = "passed"
+    elif stats.status["error"]:
+        status = "error"
+    elif stats.status["failed"]:
+        status = "failed"
+    else:
+        status = "passed"
+    return {
+        "testcase_id": plan["testcase_id"],
+        "title": plan["title"],
+        "name": plan["name"],
+        "status": status,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        "load": {key: profile[key] for key in ("rps", "concurrency", "duration", "warmup", "ramp_up")},
+        "iterations": {"total": iterations, **stats.status, "dropped": stats.dropped, "warmup": stats.warmup},
+        "throughput": {
+            "iterations_per_s": round(iterations / duration, 3),
+            "requests_per_s": round(requests / duration, 3),
+        },
+        "latency": stats.iteration.summary(),
+        "error_rate": testcase_stats["error_rate"],
+        "steps": step_results,
+        "errors": [{"message": message, "count": count} for message, count in stats.errors.items()],
+    }
+
+
+async def run_plans_async(plans: list[dict], profile: dict):
+    """逐个用例压测（同一时间只压一个用例，结果互不干扰），返回 (results, summary)"""
+    if async_runner.aiohttp is None:
+        raise RuntimeError("load mode requires aiohttp, please `pip install aiohttp`")
+
+    aiohttp = async_runner.aiohttp
+    limit = profile["concurrency"] or profile["max_inflight"]
+    started = time.perf_counter()
+    results = []
+    for plan in plans:
+        # 每个用例一个连接池，上一个用例遗留的连接不影响下一个用例的建连耗时
+        connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit)
+        async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(),
+                                         trace_configs=[async_runner.timing_trace_config()]) as session:
+            results.append(await run_plan(plan, session, profile))
+    return results, summarize(results, (time.perf_counter() - started) * 1000)
+
+
+# ===================== 主入口 =====================
+def run_testcases(project_name: str, titles=None, parameters=None):
+    """同步入口：parameters 为 run 的压测参数（见 load_profile），返回 (results, summary)"""
+    profile = load_profile(parameters or {})
+    plans = performance_plans(project_name, titles)
+    return asyncio.run(run_plans_async(plans, profile))
@@ -0,0 +1,419 @@
+# prefork_server.py
+"""
+生产环境启动器（manage.py serve 使用）：主进程加载好应用后 fork 出 N 个 worker，所有 worker 共用同一个监听 socket，
+由内核把新连接分给空闲的 worker，多核都能用上。
+
+  - WSGI：worker 内是多线程的 django.core.servers.basehttp.ThreadedWSGIServer（TestBench.wsgi.application），
+    每个 worker 最多 threads 个请求线程，线程用满时不再 accept，连接留在 backlog 里由其他 worker 接走
+  - ASGI：worker 内是 uvicorn（TestBench.asgi.application），需要 pip install uvicorn
+
+WSGI worker 复用的是 runserver 的 HTTP 实现（标准库 wsgiref / http.server）：不依赖额外的包，能直接使用主进程传下来的
+共享 socket 与 SIGUSR2 热升级；但没有 gunicorn 那样的慢连接防护、请求头大小之外的限制和 HTTP 解析加固，
+只用于内网 / 反向代理（nginx）之后。需要直接对外提供服务时用 --interface asgi（uvicorn），
+或不经过本启动器直接用 gunicorn 运行 TestBench.wsgi:application（需另行安装，多进程指标目录需自行设置 TESTBENCH_METRICS_DIR）。
+
+信号（发给主进程）：
+  - SIGTERM / SIGINT：停止接受新连接，等在途请求处理完（最多 graceful_timeout 秒）后退出
+  - SIGHUP：滚动重启 worker，每次先起一个新 worker、确认就绪后再让一个旧 worker 优雅退出，全程都有 worker 在 accept
+  - SIGUSR2：热升级（部署新代码）：启动一个继承监听 socket 的新主进程，新主进程的 worker 全部就绪后，旧主进程优雅退出；
+    新主进程启动失败时旧主进程继续服务
+worker 意外退出时主进程自动补齐。仅支持 POSIX（依赖 os.fork）。
+Arbiter 不关心 worker 做什么：sock 为 None 时不监听端口，manage.py run_workers 用它管理任务队列的 worker 进程。
+"""
+import errno
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connections
+
+logger = logging.getLogger('django')
+
+DEFAULT_GRACEFUL_TIMEOUT = 30
+# 新 worker / 新主进程就绪的最长等待时间（秒）
+READY_TIMEOUT = 60
+# 连接空闲（keep-alive 等待下一个请求、读请求体）的超时秒数，也决定优雅退出时空闲连接最多拖多久
+DEFAULT_KEEPALIVE = 5
+# 每个 WSGI worker 的请求线程上限
+DEFAULT_THREADS = 32
+# 线程用满时等待空闲线程的间隔（秒），期间仍能响应 shutdown
+SLOT_WAIT = 0.05
+BACKLOG = 2048
+
+
+def parse_bind(bind: str) -> tuple[str, int]:
+    host, _, port = bind.rpartition(":")
+    return (host.strip("[]") or "0.0.0.0"), int(port)
+
+
+def create_socket(bind: str, backlog=BACKLOG) -> socket.socket:
+    host, port = parse_bind(bind)
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+# ===================== worker：WSGI =====================
+class _RequestHandler(WSGIRequestHandler):
+    timeout = DEFAULT_KEEPALIVE
+
+
+class SharedSocketWSGIServer(ThreadedWSGIServer):
+    """使用主进程传下来的监听 socket，不自己 bind；同时处理的连接数不超过 threads"""
+    # 非 daemon 线程才会被 server_close() 等待（socketserver 不跟踪 daemon 线程），优雅退出依赖这一点
+    daemon_threads = False
+
+    def __init__(self, sock, application, keepalive=DEFAULT_KEEPALIVE, threads=DEFAULT_THREADS):
+        handler = type("RequestHandler", (_RequestHandler,), {"timeout": keepalive})
+        super().__init__(sock.getsockname()[:2], handler, bind_and_activate=False)
+        self._slots = threading.BoundedSemaphore(max(1, threads))
+        self.socket.close()
+        self.socket = sock
+        # 多个 worker 同时被唤醒时只有一个能 accept 到连接，非阻塞 accept 让其余 worker 直接回到 select
+        self.socket.setblocking(False)
+        host, port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        self.set_app(application)
+
+    def get_request(self):
+        # 先占一个线程名额再 accept：线程用满时连接留在 backlog 里；抛出 OSError 时 serve_forever 回到 select
+        if not self._slots.acquire(timeout=SLOT_WAIT):
+            raise BlockingIOError(errno.EAGAIN, "no free request thread")
+        try:
+            conn, address = self.socket.accept()
+        except BaseException:
+            self._slots.release()
+            raise
+        conn.setblocking(True)
+        return conn, address
+
+    def process_request(self, request, client_address):
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+
+def serve_wsgi(application, sock, ready, keepalive=DEFAULT_KEEPALIVE, threads=DEFAULT_THREADS):
+    server = SharedSocketWSGIServer(sock, application, keepalive=keepalive, threads=threads)
+
+    def _stop(signum, frame):
+        # shutdown() 要等 serve_forever 退出，不能在运行 serve_forever 的主线程里直接调用
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    ready()
+    server.serve_forever(poll_interval=0.5)
+    # 关闭本进程的监听 socket 副本，并等待处理中的请求线程结束
+    server.server_close()
+
+
+# ===================== worker：ASGI =====================
+def serve_asgi(application, sock, ready, keepalive=DEFAULT_KEEPALIVE, graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT):
+    import uvicorn
+
+    config = uvicorn.Config(
+        application,
+        lifespan="off",
+        timeout_keep_alive=keepalive,
+        timeout_graceful_shutdown=graceful_timeout,
+        access_log=False,
+    )
+    # uvicorn 自己处理 SIGTERM：停止 accept，等在途请求结束
+    server = uvicorn.Server(config)
+    ready()
+    server.run(sockets=[sock])
+
+
+# ===================== 主进程 =====================
+class Arbiter:
+    """
+    serve(application, sock, ready) 在 worker 进程里运行，返回即退出；ready() 在开始 accept 前调用
+    upgrade_argv：SIGUSR2 时启动新主进程的命令行（会追加 --fd / --ready-fd）
+    sock 为 None 时 worker 不 accept 连接（如任务队列 worker），SIGUSR2 热升级不可用，用 SIGHUP 滚动重启加载新代码
+    """
+
+    def __init__(self, serve, sock, workers, graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT, upgrade_argv=None,
+                 pidfile=None, ready_fd=None):
+        self.serve = serve
+        self.sock = sock
+        self.num_workers = max(1, int(workers))
+        self.graceful_timeout = graceful_timeout
+        self.upgrade_argv = upgrade_argv
+        self.pidfile = pidfile
+        self.ready_fd = ready_fd
+
+        self.workers: dict[int, float] = {}   # pid -> 启动时间
+        self.ready: set[int] = set()
+        self.stopping: dict[int, float] = {}  # pid -> 强制结束的截止时间
+        self._signals: list[int] = []
+        self._buffer = b""
+
+    # ---------- 启动 ----------
+    def run(self):
+        self._ready_r, self._ready_w = os.pipe()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR2, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+        self._write_pidfile()
+
+        if self.sock is not None:
+            host, port = self.sock.getsockname()[:2]
+            logger.info(f"prefork server listening on {host}:{port}, master pid {os.getpid()}, {self.num_workers} workers")
+        else:
+            logger.info(f"prefork server started, master pid {os.getpid()}, {self.num_workers} workers")
+        for _ in range(self.num_workers):
+            self._spawn()
+        if self._wait_ready(set(self.workers), READY_TIMEOUT):
+            self._notify_parent()
+        else:
+            logger.error("prefork server: workers did not become ready")
+
+        try:
+            while True:
+                self._sleep(1.0)
+                self._reap()
+                signum = self._signals.pop(0) if self._signals else None
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    logger.info("prefork server: graceful shutdown")
+                    self._shutdown()
+                    return
+                if signum == signal.SIGHUP:
+                    logger.info("prefork server: rolling restart of workers")
+                    self._rolling_restart()
+                elif signum == signal.SIGUSR2:
+                    if self._upgrade():
+                        logger.info("prefork server: new master is ready, old master exiting")
+                        self._shutdown()
+                        return
+                self._kill_overdue()
+                self._maintain()
+        finally:
+            self._remove_pidfile()
+
+    # ---------- 信号 / 等待 ----------
+    def _on_signal(self, signum, frame):
+        if signum != signal.SIGCHLD:
+            self._signals.append(signum)
+        try:
+            os.write(self._wake_w, b"!")
+        except OSError:
+            pass
+
+    def _sleep(self, timeout):
+        try:
+            readable, _, _ = select.select([self._wake_r, self._ready_r], [], [], timeout)
+        except InterruptedError:
+            return
+        if self._wake_r in readable:
+            try:
+                while os.read(self._wake_r, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+        if self._ready_r in readable:
+            self._buffer += os.read(self._ready_r, 4096)
+            *lines, self._buffer = self._buffer.split(b"\n")
+            self.ready.update(int(line) for line in lines if line)
+
+    def _wait_ready(self, pids: set[int], timeout) -> bool:
+        deadline = time.monotonic() + timeout
+        while not pids <= self.ready:
+            if time.monotonic() >= deadline:
+                return False
+            self._sleep(min(1.0, deadline - time.monotonic()))
+            self._reap()
+            if not pids <= set(self.workers):
+                # 还没就绪就退出了
+                return False
+        return True
+
+    # ---------- worker 管理 ----------
+    def _spawn(self) -> int:
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return pid
+        self._worker_main()
+
+    def _worker_main(self):
+        status = 0
+        try:
+            for signum in (signal.SIGHUP, signal.SIGUSR2, signal.SIGINT):
+                # SIGINT（终端 Ctrl-C 会发给整个进程组）由主进程统一转成 SIGTERM
+                signal.signal(signum, signal.SIG_IGN)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            os.close(self._ready_r)
+            ready_w = self._ready_w
+
+            def ready():
+                os.write(ready_w, f"{os.getpid()}\n".encode())
+
+            self.serve(self.sock, ready)
+        except BaseException:
+            logger.exception(f"worker {os.getpid()} crashed")
+            status = 1
+        finally:
+            # os._exit 不执行主进程的 finally / atexit，日志队列需要手动写完
+            logging.shutdown()
+            os._exit(status)
+
+    def _stop_worker(self, pid):
+        self.workers.pop(pid, None)
+        self.ready.discard(pid)
+        self.stopping[pid] = time.monotonic() + self.graceful_timeout
+        self._kill(pid, signal.SIGTERM)
+
+    @staticmethod
+    def _kill(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if pid in self.workers:
+                logger.warning(f"worker {pid} exited unexpectedly (status {status})")
+            self.workers.pop(pid, None)
+            self.stopping.pop(pid, None)
+            self.ready.discard(pid)
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.stopping.items()):
+            if now >= deadline:
+                logger.warning(f"worker {pid} did not finish within {self.graceful_timeout}s, killing")
+                self._kill(pid, signal.SIGKILL)
+                self.stopping[pid] = float("inf")
+
+    def _maintain(self):
+        while len(self.workers) < self.num_workers:
+            self._spawn()
+
+    def _rolling_restart(self):
+        for old in list(self.workers):
+            new = self._spawn()
+            if not self._wait_ready({new}, READY_TIMEOUT):
+                logger.error(f"worker {new} did not become ready, rolling restart aborted")
+                self._stop_worker(new)
+                return
+            if old in self.workers:
+                self._stop_worker(old)
+
+    def _shutdown(self):
+        for pid in list(self.workers):
+            self._stop_worker(pid)
+        # 主进程也关掉监听 socket：所有 worker 都关闭后，新连接直接被拒绝而不是排队
+        if self.sock is not None:
+            self.sock.close()
+        while self.stopping:
+            self._sleep(0.2)
+            self._reap()
+            self._kill_overdue()
+
+    # ---------- 热升级 ----------
+    def _upgrade(self) -> bool:
+        if not self.upgrade_argv or self.sock is None:
+            logger.error("prefork server: upgrade is not configured")
+            return False
+        ready_r, ready_w = os.pipe()
+        fd = self.sock.fileno()
+        os.set_inheritable(fd, True)
+        argv = [*self.upgrade_argv, "--fd", str(fd), "--ready-fd", str(ready_w)]
+        logger.info(f"prefork server: starting new master: {' '.join(argv)}")
+        try:
+            child = subprocess.Popen(argv, pass_fds=(fd, ready_w))
+        finally:
+            os.close(ready_w)
+        try:
+            deadline = time.monotonic() + READY_TIMEOUT
+            while time.monotonic() < deadline:
+                if child.poll() is not None:
+                    break
+                readable, _, _ = select.select([ready_r], [], [], 0.5)
+                if readable and os.read(ready_r, 1):
+                    return True
+                self._reap()
+        except InterruptedError:
+            pass
+        finally:
+            os.close(ready_r)
+        logger.error("prefork server: new master did not become ready, keep serving with the old one")
+        if child.poll() is None:
+            child.terminate()
+        return False
+
+    def _notify_parent(self):
+        # 由旧主进程热升级启动时，通知旧主进程可以退出了
+        if self.ready_fd is None:
+            return
+        try:
+            os.write(self.ready_fd, b"1")
+            os.close(self.ready_fd)
+        except OSError as e:
+            if e.errno != errno.EBADF:
+                raise
+        self.ready_fd = None
+
+    # ---------- pid 文件 ----------
+    def _write_pidfile(self):
+        if self.pidfile:
+            with open(self.pidfile, "w") as f:
+                f.write(f"{os.getpid()}\n")
+
+    def _remove_pidfile(self):
+        if not self.pidfile:
+            return
+        try:
+            with open(self.pidfile) as f:
+                # 热升级后 pid 文件已被新主进程覆盖，不能删
+                if f.read().strip() != str(os.getpid()):
+                    return
+            os.remove(self.pidfile)
+        except OSError:
+            pass
+
+
+def preload(application):
+    """fork 前在主进程里加载 URLconf / 视图等模块，worker 直接继承；随后关闭数据库连接，避免 worker 共用同一条连接"""
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    connections.close_all()
+    return application
+
+
+def run(serve, sock, workers, **kwargs):
+    if not hasattr(os, "fork"):
+        sys.exit("prefork server requires os.fork (POSIX)")
+    Arbiter(serve, sock, workers, **kwargs).run()
@@ -0,0 +1,519 @@
+# test_runner.py
+"""
+进程内执行引擎：不再生成 pytest 文件，直接从 DB 读取 TestCaseKeyword + Assertion，
+在有界线程池里并发执行多个用例；每个目标 host 复用一个带连接池（keep-alive）的 requests.Session，
+返回结构化的逐步结果。断言 DSL 与生成器共用同一套解析规则（parse_target_value / compile_comparison）；
+取值按解析出的下标路径逐层读取、比较直接调用比较函数，不 eval / exec 用户输入。
+"""
+import json
+import operator
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+
+from testplatform.models import Project, TestCaseKeyword, Assertion
+from utils.test_script_generator import (
+    _parse_body_text, compile_comparison, compile_stats_target, is_stats_target, parse_target_value,
+)
+
+DEFAULT_MAX_WORKERS = 8
+MAX_WORKERS_LIMIT = 64
+DEFAULT_TIMEOUT = 10
+
+
+# ===================== 响应包装：json 只解析一次 =====================
+class StepResponse:
+    """
+    断言表达式里的 resp 对象：提供 status_code / headers / text / json()，与 requests.Response 用法一致。
+    json() 结果缓存，同一响应不会重复解析；elapsed_ms 为整个请求耗时，timing 为分阶段耗时（StepTiming.as_dict）。
+    """
+
+    def __init__(self, status_code, headers, content: bytes, encoding=None, elapsed_ms=None, timing=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding or "utf-8"
+        self.elapsed_ms = elapsed_ms
+        self.timing = timing
+        self._json = None
+        self._json_loaded = False
+
+    @classmethod
+    def from_requests(cls, resp: requests.Response, elapsed_ms=None, timing=None):
+        return cls(resp.status_code, resp.headers, resp.content, resp.encoding, elapsed_ms, timing)
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        if not self._json_loaded:
+            self._json = json.loads(self.content)
+            self._json_loaded = True
+        return self._json
+
+
+# ===================== 分阶段耗时：DNS / 建连 / TLS / 首字节 / 传输 =====================
+class StepTiming:
+    """
+    一次步骤请求的分阶段耗时，全部取自 time.perf_counter（单调、高精度）。
+    复用 keep-alive 连接时 dns / connect / tls 为 0、reused=True，据此区分冷连接和慢后端；
+    ttfb 从拿到可用连接算到收到响应头，transfer 为读取响应体的时间。无法单独测量的阶段为 None。
+    """
+
+    __slots__ = ("started", "dns", "connect", "tls", "ready", "headers_at", "finished", "reused")
+
+    def __init__(self, started: float):
+        self.started = started
+        self.dns = self.connect = self.tls = 0.0
+        self.ready = None
+        self.headers_at = None
+        self.finished = None
+        self.reused = None
+
+    def as_dict(self) -> dict:
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+
+        ttfb = transfer = None
+        if self.headers_at is not None:
+            ttfb = self.headers_at - (self.ready or self.started)
+            if self.finished is not None:
+                transfer = self.finished - self.headers_at
+        return {
+            "dns_ms": ms(self.dns),
+            "connect_ms": ms(self.connect),
+            "tls_ms": ms(self.tls),
+            "ttfb_ms": ms(ttfb),
+            "transfer_ms": ms(transfer),
+            "reused": self.reused,
+        }
+
+
+# 线程池模式下当前线程正在执行的步骤请求：连接池 / 连接对象在请求所在线程里回调，直接写入这里
+_current_timing = threading.local()
+
+
+def _timing() -> StepTiming | None:
+    return getattr(_current_timing, "value", None)
+
+
+class _TimedConnectionMixin:
+    """urllib3 连接：DNS 解析单独计时后按解析出的地址依次建连，HTTPS 的 TLS 握手为 connect() 总耗时减去前两段"""
+
+    def _new_conn(self):
+        timing = _timing()
+        started = time.perf_counter()
+        try:
+            infos = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except OSError as e:
+            raise NewConnectionError(self, f"Failed to establish a new connection: {e}")
+        resolved = time.perf_counter()
+
+        dns_host = self._dns_host
+        error = None
+        try:
+            for info in infos:
+                self._dns_host = info[4][0]
+                try:
+                    conn = super()._new_conn()
+                    break
+                except ConnectTimeoutError as e:  # NewConnectionError 也是其子类
+                    error = e
+            else:
+                raise error
+        finally:
+            self._dns_host = dns_host
+
+        if timing is not None:
+            timing.dns = resolved - started
+            timing.connect = time.perf_counter() - resolved
+        return conn
+
+    def connect(self):
+        timing = _timing()
+        started = time.perf_counter()
+        super().connect()
+        if timing is not None:
+            timing.ready = time.perf_counter()
+            timing.reused = False
+            if isinstance(self, HTTPSConnection):
+                timing.tls = max(timing.ready - started - timing.dns - timing.connect, 0.0)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedPoolMixin:
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        timing = _timing()
+        if timing is not None:
+            # 已建立的连接直接复用；新连接在首次发送时 connect()，届时覆盖 ready / reused
+            timing.ready = time.perf_counter()
+            timing.reused = conn.sock is not None
+        return conn
+
+
+class _TimedHTTPConnectionPool(_TimedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(_TimedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """连接池换成带分阶段计时的 urllib3 连接池，其余行为与 HTTPAdapter 相同"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+# ===================== 执行计划：ORM → 纯数据 =====================
+COMPARISONS = {
+    ">": operator.gt,
+    "<": operator.lt,
+    "==": operator.eq,
+    "in": lambda actual, value: value in actual,
+}
+
+
+def _compile_assertion(target_value, operator, compared_value) -> dict:
+    """把一条断言编译成 (取值来源, 下标路径) 与 (比较符, 比较值)，编译失败记录在 error 里，不影响其他断言"""
+    item = {
+        "target_value": target_value,
+        "operator": operator,
+        "compared_value": compared_value,
+        "source": None,
+        "path": None,
+        "comparison": None,
+        "value": None,
+        "uses_body": False,
+        "error": None,
+    }
+    try:
+        item["source"], item["path"] = parse_target_value(target_value)
+        item["uses_body"] = item["source"] == "body"
+        item["comparison"], item["value"] = compile_comparison(operator, compared_value)
+    except ValueError as e:
+        item["error"] = str(e)
+    return item
+
+
+def _compile_stats_assertion(target_value, operator, compared_value) -> dict:
+    """${stats} 聚合断言：记录 (范围, 指标) 和 (比较符, 比较值)，压测结束后由 load_runner 对全部样本判定"""
+    item = {
+        "target_value": target_value,
+        "operator": operator,
+        "compared_value": compared_value,
+        "scope": None,
+        "metric": None,
+        "comparison": None,
+        "value": None,
+        "error": None,
+    }
+    try:
+        item["scope"], item["metric"] = compile_stats_target(target_value)
+        item["comparison"], item["value"] = compile_comparison(operator, compared_value)
+    except ValueError as e:
+        item["error"] = str(e)
+    return item
+
+
+def check(assertion: dict, actual) -> bool:
+    """按编译好的比较符判定；类型不匹配（如字符串与数字比大小）抛出 TypeError，由调用方记录"""
+    return bool(COMPARISONS[assertion["comparison"]](actual, assertion["value"]))
+
+
+def _build_step(tk: TestCaseKeyword) -> dict:
+    assertions = list(tk.assertions.all())
+    return {
+        "order": tk.order,
+        "keyword": tk.keyword.name,
+        "url": tk.url,
+        "method": tk.method or "POST",
+        "params": tk.params or {},
+        "headers": tk.headers or {},
+        "body_type": tk.body_type,
+        "body_value": _parse_body_text(tk.body),
+        "assertions": [
+            _compile_assertion(a.target_value, a.operator, a.compared_value)
+            for a in assertions if not is_stats_target(a.target_value)
+        ],
+        # 单次执行（thread / async）不判定聚合断言
+        "stats_assertions": [
+            _compile_stats_assertion(a.target_value, a.operator, a.compared_value)
+            for a in assertions if is_stats_target(a.target_value)
+        ],
+    }
+
+
+def load_plans(project_name: str, titles=None) -> list[dict]:
+    """
+    一次性加载项目下（或指定 title 列表）的用例及其步骤、断言，固定查询次数（prefetch），
+    并转换成纯数据的执行计划——工作线程里不再访问 ORM，也就不会为每个线程各开一个 DB 连接。
+    """
+    project = Project.objects.filter(name=project_name).first()
+    if not project:
+        raise ValidationError(f"Project '{project_name}' not found")
+
+    steps_qs = (
+        TestCaseKeyword.objects
+        .select_related("keyword")
+        .prefetch_related(Prefetch("assertions", queryset=Assertion.objects.order_by("id")))
+        .order_by("order")
+    )
+    testcases = (
+        # 通过关联管理器查询：分片部署时路由到项目所在的库
+        project.testcases
+        .prefetch_related(Prefetch("testcasekeyword_set", queryset=steps_qs))
+        .order_by("id")
+    )
+    if titles:
+        testcases = testcases.filter(title__in=titles)
+
+    plans = []
+    for tc in testcases:
+        plans.append({
+            "testcase_id": tc.id,
+            "title": tc.title,
+            "name": tc.name,
+            "type": tc.type,
+            "steps": [_build_step(tk) for tk in tc.testcasekeyword_set.all()],
+        })
+
+    if titles:
+        missing = set(titles) - {p["title"] for p in plans}
+        if missing:
+            raise ValidationError(f"Testcase not found in project '{project_name}': {sorted(missing)}")
+    return plans
+
+
+# ===================== 连接池：每个 host 一个 keep-alive Session =====================
+class SessionPool:
+    """
+    按 scheme://host:port 缓存 requests.Session，所有工作线程共享其连接池。
+    禁用 cookie 持久化：与生成脚本里每步独立 requests.request 的语义保持一致，也避免用例之间串 cookie。
+    """
+
+    def __init__(self, pool_maxsize=DEFAULT_MAX_WORKERS):
+        self.pool_maxsize = pool_maxsize
+        self._sessions: dict[tuple, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> requests.Session:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = requests.Session()
+                    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                    adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, pool_block=True)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._sessions[key] = session
+        return session
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# ===================== 执行 =====================
+def request_kwargs(step: dict) -> dict:
+    """与 build_test_file_content 相同的 body 规则：x-www-form-urlencoded 走 data，其余按 json 发送"""
+    body_val = step["body_value"]
+    if step["body_type"] == "application/x-www-form-urlencoded":
+        json_body, data_body = None, body_val
+    else:
+        json_body, data_body = body_val, None
+    return {
+        "method": step["method"],
+        "url": step["url"],
+        "headers": step["headers"],
+        "params": step["params"],
+        "json": json_body,
+        "data": data_body,
+    }
+
+
+def _target_value(assertion: dict, resp, body):
+    source = assertion["source"]
+    if source == "code":
+        return resp.status_code
+    if source == "response_time":
+        return resp.elapsed_ms
+    value = {"body": body, "headers": resp.headers, "timing": resp.timing or {}}[source]
+    for key in assertion["path"]:
+        value = value[key]
+    return value
+
+
+def evaluate_assertions(step: dict, resp) -> list[dict]:
+    # 与生成脚本一致：有 body 断言时响应体只解析一次，供所有 body 断言使用
+    body = body_error = None
+    if any(a["uses_body"] for a in step["assertions"]):
+        try:
+            body = resp.json()
+        except ValueError as e:
+            body_error = f"response body is not JSON: {e}"
+
+    results = []
+    for a in step["assertions"]:
+        item = {
+            "target_value": a["target_value"],
+            "operator": a["operator"],
+            "compared_value": a["compared_value"],
+            "passed": False,
+            "actual": None,
+            "message": a["error"],
+        }
+        if a["error"] is None and a["uses_body"] and body_error:
+            item["message"] = body_error
+        elif a["error"] is None:
+            try:
+                actual = _target_value(a, resp, body)
+                item["actual"] = actual if isinstance(actual, (str, int, float, bool, type(None))) else repr(actual)
+                if check(a, actual):
+                    item["passed"] = True
+                else:
+                    item["message"] = "assertion failed"
+            except Exception as e:
+                item["message"] = f"{type(e).__name__}: {e}"
+        results.append(item)
+    return results
+
+
+def _step_result(step: dict) -> dict:
+    return {
+        "order": step["order"],
+        "keyword": step["keyword"],
+        "method": step["method"],
+        "url": step["url"],
+        "status": "skipped",
+        "status_code": None,
+        "duration_ms": None,
+        "timing": None,
+        "error": None,
+        "assertions": [],
+    }
+
+
+def new_step_results(plan: dict) -> list[dict]:
+    return [_step_result(step) for step in plan["steps"]]
+
+
+def record_error(result: dict, exc: Exception, started: float):
+    result["status"] = "error"
+    result["error"] = f"{type(exc).__name__}: {exc}"
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+
+def record_response(result: dict, step: dict, resp: StepResponse) -> bool:
+    """写入状态码与断言结果，返回该步是否全部断言通过"""
+    result["status_code"] = resp.status_code
+    result["timing"] = resp.timing
+    result["assertions"] = evaluate_assertions(step, resp)
+    passed = all(a["passed"] for a in result["assertions"])
+    result["status"] = "passed" if passed else "failed"
+    return passed
+
+
+def plan_result(plan: dict, status: str, step_results: list[dict], started: float) -> dict:
+    return {
+        "testcase_id": plan["testcase_id"],
+        "title": plan["title"],
+        "name": plan["name"],
+        "status": status,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        "steps": step_results,
+    }
+
+
+def run_plan(plan: dict, sessions: SessionPool, timeout=DEFAULT_TIMEOUT) -> dict:
+    """
+    顺序执行一个用例的全部步骤（步骤之间保持 order），某一步失败后剩余步骤标记为 skipped，
+    与生成的 pytest 脚本遇到第一个失败断言即结束的行为一致。
+    """
+    started = time.perf_counter()
+    step_results = new_step_results(plan)
+    status = "passed"
+
+    for step, result in zip(plan["steps"], step_results):
+        step_started = time.perf_counter()
+        timing = _current_timing.value = StepTiming(step_started)
+        try:
+            # stream=True：返回时只读完响应头，随后读取响应体，分别计入 ttfb 与 transfer
+            raw = sessions.get(step["url"]).request(timeout=timeout, stream=True, **request_kwargs(step))
+            timing.headers_at = time.perf_counter()
+            raw.content
+            timing.finished = time.perf_counter()
+        except requests.RequestException as e:
+            record_error(result, e, step_started)
+            status = "error"
+            break
+        finally:
+            _current_timing.value = None
+
+        result["duration_ms"] = round((timing.finished - step_started) * 1000, 3)
+        resp = StepResponse.from_requests(raw, result["duration_ms"], timing.as_dict())
+        if not record_response(result, step, resp):
+            status = "failed"
+            break
+
+    return plan_result(plan, status, step_results, started)
+
+
+def summarize(results: list[dict], duration_ms: float) -> dict:
+    summary = {"total": len(results), "passed": 0, "failed": 0, "error": 0, "duration_ms": round(duration_ms, 3)}
+    for r in results:
+        summary[r["status"]] += 1
+    return summary
+
+
+def run_plans(plans: list[dict], max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT):
+    """在有界线程池里并发执行多个用例，结果顺序与 plans 一致"""
+    max_workers = max(1, min(int(max_workers), MAX_WORKERS_LIMIT))
+    sessions = SessionPool(pool_maxsize=max_workers)
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tb-runner") as pool:
+            results = list(pool.map(lambda plan: run_plan(plan, sessions, timeout), plans))
+    finally:
+        sessions.close()
+    return results, summarize(results, (time.perf_counter() - started) * 1000)
+
+
+# ===================== 主入口 =====================
+def run_testcases(project_name: str, titles=None, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT):
+    """
+    执行项目下的用例（titles 为空则执行整个项目），返回 (results, summary)
+    """
+    plans = load_plans(project_name, titles)
+    return run_plans(plans, max_workers=max_workers, timeout=timeout)
@@ -3,20 +3,34 @@ import os
 import re
 import sys
 import ast
+import math
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，退化为不加锁
+    fcntl = None
+
 import django
+from django.apps import apps
 from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
+# 脚本输出根目录（manage.py benchmark 运行期间临时指向临时目录）
+CASEFILE_DIR = PROJECT_ROOT / "casefile"
 sys.path.insert(0, str(PROJECT_ROOT))
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "TestBench.settings")
 
-import django
-django.setup()
+# 独立运行时自行初始化 Django；被 Django 进程内（如 views/执行引擎）导入时 apps 已就绪，不再重复 setup
+if not apps.ready:
+    django.setup()
 
-from testplatform.models import Project, Testcase, TestCaseKeyword, Assertion
+from testplatform.models import Project, TestCaseKeyword, Assertion
 
 
 # ===================== 工具：命名清洗 =====================
@@ -39,18 +53,92 @@ def _safe_py_ident(s: str) -> str:
     return s
 
 
-# ===================== 工具：生成序号 0001（按项目目录下现有文件递增） =====================
-def _next_seq_num(project_dir: Path) -> str:
+# ===================== 工具：生成清单 manifest（序号 / 内容 hash / 文件路径） =====================
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_LOCK_NAME = ".manifest.lock"
+
+
+@contextmanager
+def _manifest_lock(project_dir: Path):
+    """
+    项目目录级别的排他锁：读清单 → 写文件 → 写清单 整个过程串行化，
+    两个生成器同时运行时不会拿到同一个序号，也不会互相覆盖清单
+    """
+    with open(project_dir / MANIFEST_LOCK_NAME, "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _load_manifest(project_dir: Path) -> dict | None:
+    """
+    清单结构：
+      {"next_seq": 12, "testcases": {"<testcase id>": {"hash": "...", "seq": "0003", "file": "test_xxx.py"}},
+       "orphans": ["test_xxx_0001_yyy.py"]}
+    orphans 为建立清单时没有认领到用例、但当次只生成了部分用例而未删除的旧文件，下次整项目生成时删除。
+    清单不存在时返回 None，由 _adopt_existing_files 建立
+    """
+    manifest_path = project_dir / MANIFEST_NAME
+    if manifest_path.exists():
+        return json.loads(manifest_path.read_text(encoding="utf-8"))
+    return None
+
+
+def _adopt_existing_files(project_dir: Path, project, prune: bool) -> tuple[dict, list[Path]]:
     """
-    在 casefile/{project}/ 下扫描 test_{project}_NNNN_*.py，取最大 NNNN + 1
+    首次建立清单：把没有清单时生成的 test_{project}_NNNN_{用例名}.py 按文件名里的用例名对应到项目下的用例，
+    沿用其序号和文件名（hash 留空，下次生成时按当前内容重写）。旧版本每次生成都分配新序号，同一个用例可能有多个文件：
+    同名用例按 id 顺序依次认领序号最大（最新）的文件。认领不到的文件（重复生成的旧文件、已删除用例的文件）
+    只在整项目生成（prune=True）时删除；只生成单个 / 部分用例时保留，记入清单的 orphans，等下次整项目生成再删除。
+    返回 (清单, 删除的文件)
     """
+    pattern = re.compile(rf"^test_{re.escape(_safe_fs_name(project.name))}_([0-9]{{4}})_(.+)\.py$")
+    files_by_name: dict[str, list[tuple[str, str]]] = {}
     max_n = 0
-    if project_dir.exists():
-        for p in project_dir.glob("test_*_????_*.py"):
-            m = re.search(r"_([0-9]{4})_", p.name)
-            if m:
-                max_n = max(max_n, int(m.group(1)))
-    return f"{max_n + 1:04d}"
+    for p in project_dir.glob("test_*_????_*.py"):
+        m = pattern.match(p.name)
+        if m:
+            files_by_name.setdefault(m.group(2), []).append((m.group(1), p.name))
+            max_n = max(max_n, int(m.group(1)))
+
+    entries = {}
+    for testcase_id, name in project.testcases.order_by("id").values_list("id", "name"):
+        files = files_by_name.get(_safe_fs_name(name))
+        if files:
+            seq, file_name = max(files)
+            files.remove((seq, file_name))
+            entries[str(testcase_id)] = {"hash": "", "seq": seq, "file": file_name}
+
+    leftovers = sorted(file_name for files in files_by_name.values() for _, file_name in files)
+    if not prune:
+        return {"next_seq": max_n + 1, "testcases": entries, "orphans": leftovers}, []
+    removed = []
+    for file_name in leftovers:
+        path = project_dir / file_name
+        path.unlink()
+        removed.append(path)
+    return {"next_seq": max_n + 1, "testcases": entries}, removed
+
+
+def _save_manifest(project_dir: Path, manifest: dict):
+    # 先写临时文件再 os.replace，保证清单文件始终是完整的
+    tmp_path = project_dir / f"{MANIFEST_NAME}.tmp"
+    tmp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp_path, project_dir / MANIFEST_NAME)
+
+
+# ===================== 工具：生成序号 0001（按清单递增） =====================
+def _next_seq_num(manifest: dict) -> str:
+    """
+    从清单里分配下一个序号（调用方需持有 _manifest_lock），不再 glob 扫描目录
+    """
+    n = manifest["next_seq"]
+    manifest["next_seq"] = n + 1
+    return f"{n:04d}"
 
 
 # ===================== 工具：body 解析（只在生成器里做，生成文件里不出现） =====================
@@ -82,73 +170,163 @@ def _parse_body_text(body_text: str):
 
 
 # ===================== DSL → Python 表达式（生成期编译） =====================
-def compile_target_value(target_value: str) -> str:
+TIMING_PHASES = ("dns", "connect", "tls", "ttfb", "transfer")
+
+
+TARGET_SOURCES = ("code", "body", "headers", "response_time", "timing")
+
+
+def _subscript_key(node, target_value):
+    if isinstance(node, ast.Constant) and type(node.value) in (str, int):
+        return node.value
+    if (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub)
+            and isinstance(node.operand, ast.Constant) and type(node.operand.value) is int):
+        return -node.operand.value
+    raise ValueError(f"Unsupported subscript (only ['key'] / [index]): {target_value}")
+
+
+def _parse_subscripts(suffix: str, target_value: str) -> list:
+    """
+    body / headers 后面的下标链 → 路径，如 "['data'][0]['id']" → ['data', 0, 'id']；
+    只接受字符串 / 整数常量下标，属性、调用、运算等任何其他写法都拒绝（取值按路径逐层下标，不执行表达式）
+    """
+    if not suffix.strip():
+        return []
+    try:
+        node = ast.parse("_" + suffix, mode="eval").body
+    except SyntaxError:
+        raise ValueError(f"Unsupported target_value: {target_value}")
+    path = []
+    while isinstance(node, ast.Subscript):
+        path.append(_subscript_key(node.slice, target_value))
+        node = node.value
+    if not (isinstance(node, ast.Name) and node.id == "_"):
+        raise ValueError(f"Unsupported target_value: {target_value}")
+    return path[::-1]
+
+
+def parse_target_value(target_value: str) -> tuple[str, list]:
     """
-    把 Assertion.target_value (DSL) 编译成 Python 表达式字符串（在生成期完成）
+    把 Assertion.target_value (DSL) 解析成 (取值来源, 下标路径)，来源为 TARGET_SOURCES 之一
     仅支持：
       ${response}.code
-      ${response}.body...
-      ${response}.headers...
+      ${response}.body['k'][0]...
+      ${response}.headers['k']
+      ${response}.response_time（或直接写 response_time）：请求开始到读完响应体的毫秒数
+      ${response}.timing.dns / connect / tls / ttfb / transfer：分阶段毫秒数（只在进程内执行时可用）
     """
     if not isinstance(target_value, str):
         raise ValueError(f"target_value must be str, got {type(target_value)}")
 
     tv = target_value.strip()
+    if tv == "response_time":
+        return "response_time", []
     prefix = "${response}."
     if not tv.startswith(prefix):
         raise ValueError(f"Unsupported target_value (must start with {prefix}): {tv}")
 
     expr = tv[len(prefix):]  # e.g. "code" / "body['message']" / "headers['X']"
 
-    if expr == "code":
-        return "resp.status_code"
+    if expr in ("code", "response_time"):
+        return expr, []
 
-    if expr.startswith("body"):
-        # body -> resp.json() + 其余索引片段
-        return "resp.json()" + expr[len("body"):]  # 保留后缀如 ['k']
+    for source in ("body", "headers"):
+        if expr.startswith(source):
+            return source, _parse_subscripts(expr[len(source):], tv)
 
-    if expr.startswith("headers"):
-        return "resp.headers" + expr[len("headers"):]  # 保留后缀如 ['k']
+    if expr.startswith("timing."):
+        phase = expr[len("timing."):]
+        if phase not in TIMING_PHASES:
+            raise ValueError(f"Unsupported timing phase (one of {', '.join(TIMING_PHASES)}): {tv}")
+        return "timing", [f"{phase}_ms"]
 
     raise ValueError(f"Unsupported response expression: {tv}")
 
 
+def compile_target_value(target_value: str) -> str:
+    """把 target_value 编译成生成脚本里的 Python 表达式；由解析出的路径重新拼出，下标一律 repr，原文不进入脚本"""
+    source, path = parse_target_value(target_value)
+    base = {
+        "code": "resp.status_code",
+        "body": "resp_body",  # resp_body 在每个步骤请求后只 resp.json() 解析一次
+        "headers": "resp.headers",
+        "response_time": "resp_time_ms",
+        "timing": "resp_timing",
+    }[source]
+    return base + "".join(f"[{key!r}]" for key in path)
+
+
+# ===================== ${stats} 聚合断言（压测模式判定） =====================
+STATS_PREFIX = "${stats}."
+STATS_SCOPE_TESTCASE = "testcase."
+STATS_METRICS = ("count", "min", "mean", "max", "rps", "error_rate")
+
+
+def is_stats_target(target_value) -> bool:
+    return isinstance(target_value, str) and target_value.strip().startswith(STATS_PREFIX)
+
+
+def compile_stats_target(target_value: str) -> tuple[str, str]:
+    """
+    把聚合断言的 target_value 解析成 (范围, 指标)，只在 mode=load 压测结束后对全部样本判定：
+      ${stats}.p99 / ${stats}.error_rate ...           → ("step", ...)      断言所在步骤的样本
+      ${stats}.testcase.p99 / ${stats}.testcase.rps ... → ("testcase", ...)  整条步骤链（一次迭代）的样本
+    指标：pNN（如 p50、p99、p99.9，毫秒）、min / mean / max（毫秒）、count、rps（每秒次数）、error_rate（0~1）
+    """
+    tv = target_value.strip()
+    expr = tv[len(STATS_PREFIX):]
+    scope = "step"
+    if expr.startswith(STATS_SCOPE_TESTCASE):
+        scope, expr = "testcase", expr[len(STATS_SCOPE_TESTCASE):]
+    if expr in STATS_METRICS:
+        return scope, expr
+    m = re.fullmatch(r"p(\d+(?:\.\d+)?)", expr)
+    if m and 0 < float(m.group(1)) <= 100:
+        return scope, expr
+    raise ValueError(f"Unsupported stats expression: {tv}")
+
+
 # ===================== operator → assert 语句（生成期编译） =====================
-def compile_assertion_line(target_expr_py: str, operator: str, compared_value: str) -> str:
+ASSERTION_OPERATORS = {"greater_than": ">", "less_than": "<", "equal": "==", "equal_to": "==", "contains": "in"}
+
+
+def compile_comparison(operator: str, compared_value) -> tuple[str, object]:
     """
-    根据你 V1 规则生成“纯 Python assert 语句”（生成文件里不需要任何 helper）
-    数字类：greater_than / less_than / equal
-    字符串类：equal_to / contains
+    operator → (比较符, 比较值)，生成脚本与执行引擎共用：
+    数字类：greater_than / less_than / equal，compared_value 转成 int / float
+    字符串类：equal_to / contains，compared_value 按字符串比较（contains 判断 compared_value in 实际值）
     """
     op = (operator or "").strip()
+    if op not in ASSERTION_OPERATORS:
+        raise ValueError(f"Unsupported operator: {operator}")
 
     if op in ("greater_than", "less_than", "equal"):
-        # 数字：把 compared_value 编译成数值字面量（int/float）
         s = str(compared_value).strip() if compared_value is not None else ""
         if s == "":
             raise ValueError(f"Numeric operator {op} requires compared_value")
         # 尽量 int，否则 float
         try:
-            if re.fullmatch(r"-?\d+", s):
-                num_lit = str(int(s))
-            else:
-                num_lit = str(float(s))
-        except Exception:
+            value = int(s) if re.fullmatch(r"-?\d+", s) else float(s)
+        except ValueError:
+            value = None
+        if value is None or not math.isfinite(value):
             raise ValueError(f"compared_value is not a number for {op}: {compared_value}")
+        return ASSERTION_OPERATORS[op], value
 
-        sym = { "greater_than": ">", "less_than": "<", "equal": "==" }[op]
-        return f"assert {target_expr_py} {sym} {num_lit}"
+    return ASSERTION_OPERATORS[op], "" if compared_value is None else str(compared_value)
 
-    if op in ("equal_to", "contains"):
-        # 字符串：用 repr 做安全转义
-        s = "" if compared_value is None else str(compared_value)
-        lit = repr(s)
-        if op == "equal_to":
-            return f"assert {target_expr_py} == {lit}"
-        else:
-            return f"assert {lit} in {target_expr_py}"
 
-    raise ValueError(f"Unsupported operator: {operator}")
+def compile_assertion_line(target_expr_py: str, operator: str, compared_value: str) -> str:
+    """生成“纯 Python assert 语句”（生成文件里不需要任何 helper）；比较值用 repr 做安全转义"""
+    sym, value = compile_comparison(operator, compared_value)
+    if sym == "in":
+        return f"assert {value!r} in {target_expr_py}"
+    return f"assert {target_expr_py} {sym} {value!r}"
+
+
+def _comment(text) -> str:
+    # 写进生成脚本注释的原文：换行会让后面的内容变成代码，一律转义
+    return str(text).replace("\\", "\\\\").replace("\r", "\\r").replace("\n", "\\n")
 
 
 # ===================== 生成 test 文件内容 =====================
@@ -158,11 +336,13 @@ def build_test_file_content(project_name: str, seq: str, testcase_name: str, ste
     func_name = f"test_{proj_ident}_{seq}_{case_ident}"
 
     lines: list[str] = []
-    lines.append("import requests")
+    lines.append("# http_session: casefile/conftest.py 中的 session 级 requests.Session fixture（连接池复用）")
+    if any(a["target_py"] == "resp_time_ms" for step in steps for a in step.get("assertions", [])):
+        lines.append("import time")
     lines.append("")
     lines.append("")
-    lines.append("def send_request(url, method, headers=None, params=None, json_body=None, data_body=None, timeout=10):")
-    lines.append("    return requests.request(")
+    lines.append("def send_request(session, url, method, headers=None, params=None, json_body=None, data_body=None, timeout=10):")
+    lines.append("    return session.request(")
     lines.append("        method=method,")
     lines.append("        url=url,")
     lines.append("        headers=headers,")
@@ -173,9 +353,9 @@ def build_test_file_content(project_name: str, seq: str, testcase_name: str, ste
     lines.append("    )")
     lines.append("")
     lines.append("")
-    lines.append(f"def {func_name}():")
-    lines.append(f"    # project: {project_name}")
-    lines.append(f"    # testcase: {testcase_name}")
+    lines.append(f"def {func_name}(http_session):")
+    lines.append(f"    # project: {_comment(project_name)}")
+    lines.append(f"    # testcase: {_comment(testcase_name)}")
     lines.append("")
 
     for idx, step in enumerate(steps, start=1):
@@ -209,11 +389,19 @@ def build_test_file_content(project_name: str, seq: str, testcase_name: str, ste
                 lines.append(f"    json_body = {repr(body_val)}")
             lines.append("    data_body = None")
 
-        lines.append("    resp = send_request(url, method, headers=headers, params=params, json_body=json_body, data_body=data_body, timeout=10)")
-        lines.append("")
-
         # assertions
         assertions: list[dict] = step.get("assertions", [])
+        timed = any(a["target_py"] == "resp_time_ms" for a in assertions)
+        if timed:
+            lines.append("    started = time.perf_counter()")
+        lines.append("    resp = send_request(http_session, url, method, headers=headers, params=params, json_body=json_body, data_body=data_body, timeout=10)")
+        if timed:
+            # 与进程内执行一致：从发请求到读完响应体（requests 非流式请求返回时已读完）
+            lines.append("    resp_time_ms = (time.perf_counter() - started) * 1000")
+        if any(a["target_py"].startswith("resp_body") for a in assertions):
+            # 响应体只解析一次，多条 body 断言共用
+            lines.append("    resp_body = resp.json()")
+        lines.append("")
         if assertions:
             lines.append("    # assertions")
             for a in assertions:
@@ -229,73 +417,218 @@ def build_test_file_content(project_name: str, seq: str, testcase_name: str, ste
     return "\n".join(lines) + "\n"
 
 
-# ===================== 主入口：创建脚本 =====================
-def create_test_script(project_name: str, testcase_title: str) -> str:
+# ===================== 步骤收集（基于 prefetch 结果，不再逐步查断言） =====================
+def _testcases_with_steps(project, titles=None):
     """
-    在某个项目下，按 testcase_title 找用例，生成 pytest 文件到：
-      {testbench_root}/casefile/{项目名}/test_{项目名}_{0001}_{用例名}.py
-
-    返回生成文件的绝对路径字符串
+    一次 prefetch 拿齐用例、步骤（按 order）、断言：无论多少用例，查询次数固定为 3 次
     """
-    project = Project.objects.filter(name=project_name).first()
-    if not project:
-        raise ValidationError(f"Project '{project_name}' not found")
-
-    testcase = Testcase.objects.filter(project=project, title=testcase_title).first()
-    if not testcase:
-        raise ValidationError(f"Testcase with title '{testcase_title}' not found in project '{project_name}'")
-
-    # 收集步骤（按 order）
-    testcase_keywords = TestCaseKeyword.objects.filter(test_case=testcase).order_by("order")
-
+    steps_qs = TestCaseKeyword.objects.order_by("order").prefetch_related(
+        Prefetch("assertions", queryset=Assertion.objects.order_by("id"))
+    )
+    qs = (
+        # 通过关联管理器查询：分片部署时路由到项目所在的库
+        project.testcases
+        .prefetch_related(Prefetch("testcasekeyword_set", queryset=steps_qs))
+        .order_by("id")
+    )
+    if titles:
+        qs = qs.filter(title__in=titles)
+    return qs
+
+
+def _collect_steps(testcase) -> list[dict]:
     steps: list[dict] = []
-    for tk in testcase_keywords:
-        # 拿断言（挂在 testcase_keyword 上）
-        assertions_qs = Assertion.objects.filter(testcase_keyword=tk).values("target_value", "operator", "compared_value")
-
+    for tk in testcase.testcasekeyword_set.all():
+        # 拿断言（挂在 testcase_keyword 上，已 prefetch）
         compiled_assertions = []
-        for a in assertions_qs:
-            target_value = a["target_value"]
-            operator = a["operator"]
-            compared_value = a["compared_value"]
-
-            target_py = compile_target_value(target_value)  # -> "resp.status_code" / "resp.json()['k']"
-            assert_line = compile_assertion_line(target_py, operator, compared_value)
+        for a in tk.assertions.all():
+            if is_stats_target(a.target_value):
+                # 聚合断言针对压测的全部样本，单次执行的脚本里只保留为注释
+                compile_stats_target(a.target_value)
+                compile_assertion_line("actual", a.operator, a.compared_value)
+                compiled_assertions.append({
+                    "target_py": "",
+                    "assert_line": f"# {_comment(a.target_value)} {_comment(a.operator)} {_comment(a.compared_value)}（聚合断言，只在 mode=load 压测时判定）",
+                })
+                continue
+            target_py = compile_target_value(a.target_value)  # -> "resp.status_code" / "resp_body['k']"
+            if target_py.startswith("resp_timing"):
+                # 分阶段耗时需要执行引擎在连接层计时，生成的脚本里只保留为注释
+                compile_assertion_line(target_py, a.operator, a.compared_value)
+                compiled_assertions.append({
+                    "target_py": "",
+                    "assert_line": f"# {_comment(a.target_value)} {_comment(a.operator)} {_comment(a.compared_value)}（分阶段耗时断言，只在进程内执行时判定）",
+                })
+                continue
+            assert_line = compile_assertion_line(target_py, a.operator, a.compared_value)
 
             compiled_assertions.append({
                 "target_py": target_py,
                 "assert_line": assert_line,
             })
 
-        body_value = _parse_body_text(tk.body)
-
         steps.append({
             "url": tk.url,
             "method": tk.method,
             "params": tk.params or {},
             "headers": tk.headers or {},
             "body_type": tk.body_type,
-            "body_value": body_value,
+            "body_value": _parse_body_text(tk.body),
             "assertions": compiled_assertions,
         })
+    return steps
+
+
+CONFTEST_CONTENT = """import pytest
+import requests
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+
+
+@pytest.fixture(scope="session")
+def http_session():
+    # 整个 pytest 会话共享一个带连接池的 Session（keep-alive 复用连接）
+    # 禁止 cookie 持久化：与每步独立请求的语义一致，用例之间不串 cookie
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    yield session
+    session.close()
+"""
 
+
+def _write_conftest(casefile_dir: Path):
+    # 所有项目共用 casefile/conftest.py，内容不变则不重写
+    conftest_path = casefile_dir / "conftest.py"
+    if not conftest_path.exists() or conftest_path.read_text(encoding="utf-8") != CONFTEST_CONTENT:
+        conftest_path.write_text(CONFTEST_CONTENT, encoding="utf-8")
+
+
+def _project_dir(project_name: str) -> Path:
     # 路径规则：testbench 根目录 / casefile / 项目名
-    project_root = Path(__file__).resolve().parent.parent
-    casefile_dir = project_root / "casefile"
+    casefile_dir = CASEFILE_DIR
     project_dir = casefile_dir / _safe_fs_name(project_name)
     project_dir.mkdir(parents=True, exist_ok=True)
+    _write_conftest(casefile_dir)
+    return project_dir
+
+
+def _content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
 
-    # seq: 0001 递增
-    seq = _next_seq_num(project_dir)
+def _generate(project, testcases: list, prune: bool = False, force: bool = False,
+              max_workers: int = 8) -> dict:
+    """
+    增量生成：已在清单里的用例沿用原序号，内容 hash 不变且文件仍在则跳过，不重写文件；
+    用例改名导致文件名变化时删除旧文件。prune=True（整项目生成）时，清理 DB 中已不存在的用例文件和清单里的 orphans。
+    项目目录还没有清单时，先认领之前生成的文件（_adopt_existing_files），不会为同一个用例再生成一份。
 
-    # 文件名：test_项目名_0001_用例名（testcase.name）
-    file_name = f"test_{_safe_fs_name(project_name)}_{seq}_{_safe_fs_name(testcase.name)}.py"
-    file_path = project_dir / file_name
+    返回 {"generated": [...], "unchanged": [...], "removed": [...]}，元素为文件绝对路径
+    """
+    project_name = project.name
+    project_dir = _project_dir(project_name)
+    result = {"generated": [], "unchanged": [], "removed": []}
+
+    with _manifest_lock(project_dir):
+        manifest = _load_manifest(project_dir)
+        if manifest is None:
+            manifest, removed = _adopt_existing_files(project_dir, project, prune)
+            result["removed"].extend(str(path) for path in removed)
+        entries = manifest["testcases"]
+
+        outputs: list[tuple[Path, str]] = []
+        for testcase in testcases:
+            key = str(testcase.id)
+            entry = entries.get(key)
+            seq = entry["seq"] if entry else _next_seq_num(manifest)
+            # 文件名：test_项目名_0001_用例名（testcase.name）
+            file_name = f"test_{_safe_fs_name(project_name)}_{seq}_{_safe_fs_name(testcase.name)}.py"
+            content = build_test_file_content(project_name, seq, testcase.name, _collect_steps(testcase))
+            content_hash = _content_hash(content)
+            file_path = project_dir / file_name
+
+            if (not force and entry and entry["hash"] == content_hash
+                    and entry["file"] == file_name and file_path.exists()):
+                result["unchanged"].append(str(file_path))
+                continue
+
+            if entry and entry["file"] != file_name:
+                old_path = project_dir / entry["file"]
+                if old_path.exists():
+                    old_path.unlink()
+                    result["removed"].append(str(old_path))
+
+            entries[key] = {"hash": content_hash, "seq": seq, "file": file_name}
+            outputs.append((file_path, content))
+
+        if prune:
+            alive = {str(tc.id) for tc in testcases}
+            for key in [k for k in entries if k not in alive]:
+                old_path = project_dir / entries.pop(key)["file"]
+                if old_path.exists():
+                    old_path.unlink()
+                    result["removed"].append(str(old_path))
+            for file_name in manifest.pop("orphans", []):
+                old_path = project_dir / file_name
+                if old_path.exists():
+                    old_path.unlink()
+                    result["removed"].append(str(old_path))
+
+        # 文件内容在主线程生成，写盘放到线程池并行
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            list(pool.map(lambda item: item[0].write_text(item[1], encoding="utf-8"), outputs))
+        result["generated"] = [str(path) for path, _ in outputs]
+
+        _save_manifest(project_dir, manifest)
+
+    return result
+
+
+# ===================== 主入口：批量创建脚本 =====================
+def create_test_scripts(project_name: str, testcase_titles=None, max_workers: int = 8, force: bool = False) -> dict:
+    """
+    一次生成项目下全部用例（或 testcase_titles 指定的子集）的 pytest 文件：
+      - 只做一次 django.setup / 一次项目查询 / 一次 prefetch
+      - 按清单增量生成：内容没变的用例不重写、序号不变；force=True 时全部重写（序号仍沿用）
+      - 文件内容在主线程生成，写盘放到线程池并行
 
-    content = build_test_file_content(project_name, seq, testcase.name, steps)
+    返回 {"generated": [...], "unchanged": [...], "removed": [...]}
+    """
+    project = Project.objects.filter(name=project_name).first()
+    if not project:
+        raise ValidationError(f"Project '{project_name}' not found")
+
+    testcases = list(_testcases_with_steps(project, testcase_titles))
+    if testcase_titles:
+        missing = set(testcase_titles) - {tc.title for tc in testcases}
+        if missing:
+            raise ValidationError(f"Testcase with title {sorted(missing)} not found in project '{project_name}'")
+
+    return _generate(project, testcases, prune=not testcase_titles, force=force, max_workers=max_workers)
+
+
+# ===================== 主入口：创建脚本 =====================
+def create_test_script(project_name: str, testcase_title: str) -> str:
+    """
+    在某个项目下，按 testcase_title 找用例，生成 pytest 文件到：
+      {testbench_root}/casefile/{项目名}/test_{项目名}_{0001}_{用例名}.py
+    内容未变化时不重写文件，序号沿用清单中的记录
+
+    返回生成文件的绝对路径字符串
+    """
+    project = Project.objects.filter(name=project_name).first()
+    if not project:
+        raise ValidationError(f"Project '{project_name}' not found")
+
+    testcase = _testcases_with_steps(project, [testcase_title]).first()
+    if not testcase:
+        raise ValidationError(f"Testcase with title '{testcase_title}' not found in project '{project_name}'")
 
-    file_path.write_text(content, encoding="utf-8")
-    return str(file_path)
+    result = _generate(project, [testcase])
+    return (result["generated"] or result["unchanged"])[0]
 
 
 # ===================== 可独立运行 =====================
@@ -304,11 +637,26 @@ def main():
 
     parser = argparse.ArgumentParser(description="Generate pytest script from TestBench DB testcase")
     parser.add_argument("--project", required=True, help="Project.name, e.g. 'Project A'")
-    parser.add_argument("--title", required=True, help="Testcase.title, e.g. 'eiptest'")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--title", help="Testcase.title, e.g. 'eiptest'")
+    group.add_argument("--titles", nargs="+", help="批量：只生成这些 Testcase.title")
+    group.add_argument("--all", action="store_true", help="批量：生成项目下全部用例")
+    parser.add_argument("--workers", type=int, default=8, help="批量写文件的并行线程数")
+    parser.add_argument("--force", action="store_true", help="批量：忽略内容 hash，全部重写")
     args = parser.parse_args()
 
-    out = create_test_script(args.project, args.title)
-    print(f"[OK] Generated: {out}")
+    if args.title:
+        out = create_test_script(args.project, args.title)
+        print(f"[OK] Generated: {out}")
+        return
+
+    result = create_test_scripts(args.project, args.titles, max_workers=args.workers, force=args.force)
+    for out in result["generated"]:
+        print(f"[OK] Generated: {out}")
+    for out in result["removed"]:
+        print(f"[OK] Removed: {out}")
+    print(f"[OK] project '{args.project}': {len(result['generated'])} generated, "
+          f"{len(result['unchanged'])} unchanged, {len(result['removed'])} removed")
 
 
 if __name__ == "__main__":